@@ -1,70 +1,126 @@
-from ctypes import c_uint8, c_uint16, c_uint32, c_int8, c_int16, c_int32, c_float, c_double
-from ast import literal_eval
+from ctypes import c_uint8, c_uint16, c_uint32, c_uint64, c_int8, c_int16, c_int32, c_int64, c_float, c_double
+from array import array
+from sys import byteorder
+from functools import wraps
+from threading import Lock
+from contextvars import ContextVar
+SPECIALIZATIONS = 256
+# large fixed-shape arrays are split over the executor set in the calling
+# context, EXECUTOR.set(pool); there is no other state shared between calls
+EXECUTOR = ContextVar('EXECUTOR', default=None)
+PARALLEL_MIN_BYTES = 1 << 16
+
+def specializations(build):
+    # keeps the SPECIALIZATIONS most recently used readers built by `build`,
+    # by argument tuple; the limit is read on every miss, so changing it on
+    # the module applies to later calls, and unhashable arguments like a
+    # struct value get a reader of their own that is not kept
+    readers = {}
+    lock = Lock()
+    @wraps(build)
+    def specialize(*arguments):
+        try:
+            hash(arguments)
+        except TypeError:
+            return build(*arguments)
+        with lock:
+            reader = readers.pop(arguments, None)
+            if reader is not None:
+                readers[arguments] = reader
+                return reader
+        reader = build(*arguments)
+        with lock:
+            readers[arguments] = reader
+            while readers and len(readers) > SPECIALIZATIONS:
+                del readers[next(iter(readers))]
+        return reader
+    specialize.readers = readers
+    return specialize
+
+# the byte order is fixed when the module is generated: readers and
+# writers never look it up, so ENDIAN is not a setting
 ENDIAN = 'little'
+ORDER = '__ctype_le__' if ENDIAN == 'little' else '__ctype_be__'
+SWAP = ENDIAN != byteorder
+UINT8, UINT16, UINT32, UINT64 = (getattr(type_, ORDER) for type_ in (c_uint8, c_uint16, c_uint32, c_uint64))
 
 def type_uint8(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_uint8.__ctype_le__ # type: ignore
-    else:
-        type_ = c_uint8.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 1
+    return UINT8.from_buffer_copy(data, offset), offset + 1
 
 def type_uint16(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_uint16.__ctype_le__ # type: ignore
-    else:
-        type_ = c_uint16.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 2
+    return UINT16.from_buffer_copy(data, offset), offset + 2
 
 def type_uint32(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_uint32.__ctype_le__ # type: ignore
-    else:
-        type_ = c_uint32.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 4
-
-def type_int8(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_int8.__ctype_le__ # type: ignore
-    else:
-        type_ = c_int8.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 1
-
-def type_int16(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_int16.__ctype_le__ # type: ignore
-    else:
-        type_ = c_int16.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 2
-
-def type_int32(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_uint32.__ctype_le__ # type: ignore
-    else:
-        type_ = c_uint32.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 4
-
-def type_float(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_float.__ctype_le__ # type: ignore
-    else:
-        type_ = c_float.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 4
-
-def type_double(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_double.__ctype_le__ # type: ignore
-    else:
-        type_ = c_double.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 8
+    return UINT32.from_buffer_copy(data, offset), offset + 4
+
+class TruncatedError(ValueError):
+    def __init__(self, struct, field, offset):
+        super().__init__(f"Data ends inside {struct}.{field} (field starts at offset {offset})")
+        self.struct = struct
+        self.field = field
+        self.offset = offset
+
+def truncated(struct, fields, offset, length):
+    # only runs once a hoisted check failed: find the first field that does not fit
+    for field, field_size in fields:
+        if offset + field_size > length:
+            break
+        offset += field_size
+    return TruncatedError(struct, field, offset)
+
+TYPECODES = {
+    'uint8': 'B', 'int8': 'b', 'uint16': 'H', 'int16': 'h',
+    'uint32': 'I' if array('I').itemsize == 4 else 'L',
+    'int32': 'i' if array('i').itemsize == 4 else 'l',
+    'uint64': 'Q', 'int64': 'q', 'float': 'f', 'double': 'd',
+}
+
+def type_bulk(data, offset, type_name, array_size):
+    # whole primitive arrays are copied and byte-swapped in C
+    # bounds are checked by the caller
+    arr = array(TYPECODES[type_name])
+    n = arr.itemsize * max(0, array_size)
+    arr.frombytes(data[offset:offset+n])
+    if SWAP:
+        arr.byteswap()
+    return arr, offset + n
+
+class Lazy:
+    # a field decoded on first use, then cached; indexing, iteration, len()
+    # and attributes like `.value` go to the decoded value, resolve() returns
+    # it, and decoding errors surface on first use; threads resolving it at
+    # the same time may both decode, but never see it half resolved
+    __slots__ = ('pending', 'offset', 'decoded')
+
+    def __init__(self, function, data, offset, ctx, extras):
+        self.pending = (function, data, ctx, extras)
+        self.offset = offset
+        self.decoded = None
+
+    def resolve(self):
+        pending = self.pending
+        if pending is not None:
+            function, data, ctx, extras = pending
+            self.decoded = function(data, self.offset, ctx, extras)
+            self.pending = None
+        return self.decoded
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __repr__(self):
+        if self.pending is not None:
+            return f"<Lazy at offset {self.offset}>"
+        return repr(self.decoded)
 
 def type_array(data, offset, function, array_size, function_args):
     arr = []
@@ -73,89 +129,162 @@ def type_array(data, offset, function, array_size, function_args):
         arr.append(val)
     return arr, offset
 
-def size(data, offset, bytes_):
-    n = int(literal_eval(bytes_[:-1]))
+def type_array_fixed(data, offset, function, array_size, function_args, detached=False):
+    # every element has the same size, so once the first one is decoded the
+    # rest can be split into independent chunks for EXECUTOR; a `detached`
+    # array is not waited for: the parse goes on past it while the chunks
+    # decode, and the statements reading it settle() it first
+    if array_size <= 0:
+        return [], offset
+    first, end = function(data, offset, *function_args)
+    element_size = end - offset
+    total = element_size * (array_size - 1)
+    executor = EXECUTOR.get()
+    if executor is None or element_size <= 0 or total < PARALLEL_MIN_BYTES:
+        arr, end = type_array(data, end, function, array_size - 1, function_args)
+        arr.insert(0, first)
+        return arr, end
+    per_chunk = max(1, PARALLEL_MIN_BYTES // element_size)
+    # specialized readers are closures, workers rebuild them from their arguments
+    target = getattr(function, 'specialization', function)
+    futures = []
+    for start in range(1, array_size, per_chunk):
+        count = min(per_chunk, array_size - start)
+        begin = offset + start * element_size
+        chunk = data[begin:begin + count * element_size]
+        futures.append(executor.submit(type_array_chunk, chunk, target, count, function_args))
+    if detached:
+        return Lazy(collect_chunks, futures, 0, first, None), offset + element_size * array_size
+    arr = [first]
+    for future in futures:
+        arr.extend(future.result())
+    return arr, offset + element_size * array_size
+
+def collect_chunks(futures, offset, first, extras):
+    # the elements of a detached array, in the shape of a Lazy function
+    arr = [first]
+    for future in futures:
+        arr.extend(future.result())
+    return arr
+
+def type_array_chunk(data, function, array_size, function_args):
+    # nested arrays are decoded inline, workers never wait on their own pool
+    if isinstance(function, tuple):
+        specialize, arguments = function
+        function = specialize(*arguments)
+    token = EXECUTOR.set(None)
+    try:
+        return type_array(data, 0, function, array_size, function_args)[0]
+    finally:
+        EXECUTOR.reset(token)
+
+def size(data, offset, n):
     val = data[offset:offset+n]
     return val, offset + n
-
-ENDIAN = 'little'
+# GLOBAL: "endian little"
 # GLOBAL: "noreserve"
-def parsePixel(data: bytes, offset: int, extras: dict) -> tuple[dict, int]:
+def parsePixel(data: bytes, offset: int = 0) -> tuple[dict, int]:  # spp:3:8 Pixel
     ctx = {}
-    ctx['blue'], offset = type_uint8(data, offset)
-    ctx['green'], offset = type_uint8(data, offset)
-    ctx['red'], offset = type_uint8(data, offset)
+    if offset + 3 > len(data):  # spp:4:5 Pixel.blue
+        raise truncated('Pixel', (('blue', 1), ('green', 1), ('red', 1)), offset, len(data))  # spp:4:5 Pixel.blue
+    ctx['blue'], offset = type_uint8(data, offset)  # spp:4:5 Pixel.blue
+    ctx['green'], offset = type_uint8(data, offset)  # spp:5:5 Pixel.green
+    ctx['red'], offset = type_uint8(data, offset)  # spp:6:5 Pixel.red
     return ctx, offset
 
-def parseFile(data: bytes, offset: int = 0) -> tuple[dict, int]:
+def _lazyFile_0(data, offset, ctx, extras):  # spp:9:8 File
+    ctx['pixels'], offset = specializePixelArray(ctx['dib_header']['width'].value, ctx['dib_header']['height'].value, ctx['dib_header']['bpp'].value)(data, offset)  # spp:12:5 File.pixels
+    return ctx['pixels']
+
+def parseFile(data: bytes, offset: int = 0) -> tuple[dict, int]:  # spp:9:8 File
     ctx = {}
-    ctx['file_header'], offset = parseFileHeader(data, offset, {})
-    ctx['dib_header'], offset = parseDIBHeader(data, offset, {})
-    sub_ctx = {
-        'width':ctx['dib_header']['width'].value,
-        'height':ctx['dib_header']['height'].value,
-        'bpp':ctx['dib_header']['bpp'].value,
-    }
-    ctx['pixels'], offset = parsePixelArray(data, offset, sub_ctx)
+    if offset + 54 > len(data):  # spp:10:5 File.file_header
+        raise truncated('File', (('file_header', 14), ('dib_header', 40)), offset, len(data))  # spp:10:5 File.file_header
+    ctx['file_header'], offset = parseFileHeader(data, offset)  # spp:10:5 File.file_header
+    ctx['dib_header'], offset = parseDIBHeader(data, offset)  # spp:11:5 File.dib_header
+    ctx['pixels'] = Lazy(_lazyFile_0, data, int(ctx['file_header']['pixel_offset'].value), ctx, None)  # spp:12:5 File.pixels
     return ctx, offset
 
-def parseFileHeader(data: bytes, offset: int, extras: dict) -> tuple[dict, int]:
+def parseFileHeader(data: bytes, offset: int = 0) -> tuple[dict, int]:  # spp:15:8 FileHeader
     ctx = {}
-    ctx['magic'], offset = size(data, offset, '2B')
-    ctx['file_size'], offset = type_uint32(data, offset)
-    ctx['reserved'], offset = size(data, offset, '4B')
-    ctx['pixel_offset'], offset = type_uint32(data, offset)
+    if offset + 14 > len(data):  # spp:16:5 FileHeader.magic
+        raise truncated('FileHeader', (('magic', 2), ('file_size', 4), ('reserved', 4), ('pixel_offset', 4)), offset, len(data))  # spp:16:5 FileHeader.magic
+    ctx['magic'], offset = size(data, offset, 2)  # spp:16:5 FileHeader.magic
+    ctx['file_size'], offset = type_uint32(data, offset)  # spp:17:5 FileHeader.file_size
+    ctx['reserved'], offset = size(data, offset, 4)  # spp:18:5 FileHeader.reserved
+    ctx['pixel_offset'], offset = type_uint32(data, offset)  # spp:19:5 FileHeader.pixel_offset
     return ctx, offset
 
-def parseDIBHeader(data: bytes, offset: int, extras: dict) -> tuple[dict, int]:
+def parseDIBHeader(data: bytes, offset: int = 0) -> tuple[dict, int]:  # spp:22:8 DIBHeader
     ctx = {}
-    ctx['header_size'], offset = type_uint32(data, offset)
-    if (ctx['header_size'].value!=40):
-        raise ValueError("Invalid DIB header size")
-    
-    ctx['width'], offset = type_uint32(data, offset)
-    ctx['height'], offset = type_uint32(data, offset)
-    ctx['planes'], offset = type_uint16(data, offset)
-    if (ctx['planes'].value!=1):
-        raise ValueError("BMP must have 1 plane")
-    
-    ctx['bpp'], offset = type_uint16(data, offset)
-    if (ctx['bpp'].value!=24):
-        raise ValueError("Only 24-bit supported")
-    
-    ctx['compression'], offset = type_uint32(data, offset)
-    if (ctx['compression'].value!=0):
-        raise ValueError("Only uncompressed supported")
-    
-    ctx['image_size'], offset = type_uint32(data, offset)
-    ctx['x_ppm'], offset = type_uint32(data, offset)
-    ctx['y_ppm'], offset = type_uint32(data, offset)
-    ctx['colors_used'], offset = type_uint32(data, offset)
-    ctx['important_colors'], offset = type_uint32(data, offset)
+    if offset + 40 > len(data):  # spp:23:5 DIBHeader.header_size
+        raise truncated('DIBHeader', (('header_size', 4), ('width', 4), ('height', 4), ('planes', 2), ('bpp', 2), ('compression', 4), ('image_size', 4), ('x_ppm', 4), ('y_ppm', 4), ('colors_used', 4), ('important_colors', 4)), offset, len(data))  # spp:23:5 DIBHeader.header_size
+    ctx['header_size'], offset = type_uint32(data, offset)  # spp:23:5 DIBHeader.header_size
+    ctx['width'], offset = type_uint32(data, offset)  # spp:27:5 DIBHeader.width
+    ctx['height'], offset = type_uint32(data, offset)  # spp:28:5 DIBHeader.height
+    ctx['planes'], offset = type_uint16(data, offset)  # spp:29:5 DIBHeader.planes
+    ctx['bpp'], offset = type_uint16(data, offset)  # spp:33:5 DIBHeader.bpp
+    ctx['compression'], offset = type_uint32(data, offset)  # spp:37:5 DIBHeader.compression
+    ctx['image_size'], offset = type_uint32(data, offset)  # spp:41:5 DIBHeader.image_size
+    ctx['x_ppm'], offset = type_uint32(data, offset)  # spp:42:5 DIBHeader.x_ppm
+    ctx['y_ppm'], offset = type_uint32(data, offset)  # spp:43:5 DIBHeader.y_ppm
+    ctx['colors_used'], offset = type_uint32(data, offset)  # spp:44:5 DIBHeader.colors_used
+    ctx['important_colors'], offset = type_uint32(data, offset)  # spp:45:5 DIBHeader.important_colors
+    if (ctx['header_size'].value!=40) or (ctx['planes'].value!=1) or (ctx['bpp'].value!=24) or (ctx['compression'].value!=0):  # spp:24:5 DIBHeader
+        if (ctx['header_size'].value!=40):  # spp:24:5 DIBHeader
+            raise ValueError("Invalid DIB header size")  # spp:25:15 DIBHeader
+        if (ctx['planes'].value!=1):  # spp:30:5 DIBHeader
+            raise ValueError("BMP must have 1 plane")  # spp:31:15 DIBHeader
+        if (ctx['bpp'].value!=24):  # spp:34:5 DIBHeader
+            raise ValueError("Only 24-bit supported")  # spp:35:15 DIBHeader
+        if (ctx['compression'].value!=0):  # spp:38:5 DIBHeader
+            raise ValueError("Only uncompressed supported")  # spp:39:15 DIBHeader
     return ctx, offset
 
-def parsePixelRow(data: bytes, offset: int, extras: dict) -> tuple[dict, int]:
-    ctx = {}
-    if extras.get('width') is None:
+@specializations
+def specializePixelRow(width, bpp):  # spp:48:8 PixelRow
+    if width is None:
         raise ValueError("Argument for 'width' is not passed")
-    if extras.get('bpp') is None:
+    if bpp is None:
         raise ValueError("Argument for 'bpp' is not passed")
-    ctx['pixels'], offset = type_array(data, offset, parsePixel, int(extras['width']), ({},))
-    ctx['padding'], offset = type_array(data, offset, type_uint8, int(((4-((extras['width']*(extras['bpp']/8))%4))%4)), ())
-    return ctx, offset
+    extras = {'width': width, 'bpp': bpp}
+    count_pixels = int(extras['width'])
+    count_padding = int(((4-((extras['width']*(extras['bpp']/8))%4))%4))
+    def readPixelRow(data: bytes, offset: int) -> tuple[dict, int]:  # spp:48:8 PixelRow
+        ctx = {}
+        if offset + 3 * count_pixels > len(data):  # spp:49:5 PixelRow.pixels
+            raise TruncatedError('PixelRow', 'pixels', offset)  # spp:49:5 PixelRow.pixels
+        ctx['pixels'], offset = type_array_fixed(data, offset, parsePixel, count_pixels, (), True)  # spp:49:5 PixelRow.pixels
+        if offset + 1 * count_padding > len(data):  # spp:50:5 PixelRow.padding
+            raise TruncatedError('PixelRow', 'padding', offset)  # spp:50:5 PixelRow.padding
+        ctx['padding'], offset = type_bulk(data, offset, 'uint8', count_padding)  # spp:50:5 PixelRow.padding
+        return ctx, offset
+    readPixelRow.specialization = (specializePixelRow, (width, bpp,))
+    return readPixelRow
 
-def parsePixelArray(data: bytes, offset: int, extras: dict) -> tuple[dict, int]:
-    ctx = {}
-    if extras.get('width') is None:
+def parsePixelRow(data: bytes, offset: int, width, bpp) -> tuple[dict, int]:  # spp:48:8 PixelRow
+    return specializePixelRow(width, bpp)(data, offset)
+
+@specializations
+def specializePixelArray(width, height, bpp):  # spp:53:8 PixelArray
+    if width is None:
         raise ValueError("Argument for 'width' is not passed")
-    if extras.get('height') is None:
+    if height is None:
         raise ValueError("Argument for 'height' is not passed")
-    if extras.get('bpp') is None:
+    if bpp is None:
         raise ValueError("Argument for 'bpp' is not passed")
-    sub_ctx = {
-        'width':extras['width'],
-        'bpp':extras['bpp'],
-    }
-    ctx['rows'], offset = type_array(data, offset, parsePixelRow, int(extras['height']), (sub_ctx,))
-    return ctx, offset
+    extras = {'width': width, 'height': height, 'bpp': bpp}
+    read_rows = specializePixelRow(extras['width'], extras['bpp'])
+    count_rows = int(extras['height'])
+    def readPixelArray(data: bytes, offset: int) -> tuple[dict, int]:  # spp:53:8 PixelArray
+        ctx = {}
+        ctx['rows'], offset = type_array_fixed(data, offset, read_rows, count_rows, ())  # spp:54:5 PixelArray.rows
+        return ctx, offset
+    readPixelArray.specialization = (specializePixelArray, (width, height, bpp,))
+    return readPixelArray
+
+def parsePixelArray(data: bytes, offset: int, width, height, bpp) -> tuple[dict, int]:  # spp:53:8 PixelArray
+    return specializePixelArray(width, height, bpp)(data, offset)
+
 
+SOURCE_MAP = {186: (3, 8, 'Pixel'), 187: (3, 8, 'Pixel'), 188: (4, 5, 'Pixel.blue'), 189: (4, 5, 'Pixel.blue'), 190: (4, 5, 'Pixel.blue'), 191: (5, 5, 'Pixel.green'), 192: (6, 5, 'Pixel.red'), 193: (3, 8, 'Pixel'), 195: (9, 8, 'File'), 196: (12, 5, 'File.pixels'), 197: (9, 8, 'File'), 199: (9, 8, 'File'), 200: (9, 8, 'File'), 201: (10, 5, 'File.file_header'), 202: (10, 5, 'File.file_header'), 203: (10, 5, 'File.file_header'), 204: (11, 5, 'File.dib_header'), 205: (12, 5, 'File.pixels'), 206: (9, 8, 'File'), 208: (15, 8, 'FileHeader'), 209: (15, 8, 'FileHeader'), 210: (16, 5, 'FileHeader.magic'), 211: (16, 5, 'FileHeader.magic'), 212: (16, 5, 'FileHeader.magic'), 213: (17, 5, 'FileHeader.file_size'), 214: (18, 5, 'FileHeader.reserved'), 215: (19, 5, 'FileHeader.pixel_offset'), 216: (15, 8, 'FileHeader'), 218: (22, 8, 'DIBHeader'), 219: (22, 8, 'DIBHeader'), 220: (23, 5, 'DIBHeader.header_size'), 221: (23, 5, 'DIBHeader.header_size'), 222: (23, 5, 'DIBHeader.header_size'), 223: (27, 5, 'DIBHeader.width'), 224: (28, 5, 'DIBHeader.height'), 225: (29, 5, 'DIBHeader.planes'), 226: (33, 5, 'DIBHeader.bpp'), 227: (37, 5, 'DIBHeader.compression'), 228: (41, 5, 'DIBHeader.image_size'), 229: (42, 5, 'DIBHeader.x_ppm'), 230: (43, 5, 'DIBHeader.y_ppm'), 231: (44, 5, 'DIBHeader.colors_used'), 232: (45, 5, 'DIBHeader.important_colors'), 233: (24, 5, 'DIBHeader'), 234: (24, 5, 'DIBHeader'), 235: (25, 15, 'DIBHeader'), 236: (30, 5, 'DIBHeader'), 237: (31, 15, 'DIBHeader'), 238: (34, 5, 'DIBHeader'), 239: (35, 15, 'DIBHeader'), 240: (38, 5, 'DIBHeader'), 241: (39, 15, 'DIBHeader'), 242: (22, 8, 'DIBHeader'), 245: (48, 8, 'PixelRow'), 246: (48, 8, 'PixelRow'), 247: (48, 8, 'PixelRow'), 248: (48, 8, 'PixelRow'), 249: (48, 8, 'PixelRow'), 250: (48, 8, 'PixelRow'), 251: (48, 8, 'PixelRow'), 252: (48, 8, 'PixelRow'), 253: (48, 8, 'PixelRow'), 254: (48, 8, 'PixelRow'), 255: (49, 5, 'PixelRow.pixels'), 256: (49, 5, 'PixelRow.pixels'), 257: (49, 5, 'PixelRow.pixels'), 258: (50, 5, 'PixelRow.padding'), 259: (50, 5, 'PixelRow.padding'), 260: (50, 5, 'PixelRow.padding'), 261: (48, 8, 'PixelRow'), 262: (48, 8, 'PixelRow'), 263: (48, 8, 'PixelRow'), 265: (48, 8, 'PixelRow'), 266: (48, 8, 'PixelRow'), 269: (53, 8, 'PixelArray'), 270: (53, 8, 'PixelArray'), 271: (53, 8, 'PixelArray'), 272: (53, 8, 'PixelArray'), 273: (53, 8, 'PixelArray'), 274: (53, 8, 'PixelArray'), 275: (53, 8, 'PixelArray'), 276: (53, 8, 'PixelArray'), 277: (53, 8, 'PixelArray'), 278: (53, 8, 'PixelArray'), 279: (53, 8, 'PixelArray'), 280: (53, 8, 'PixelArray'), 281: (54, 5, 'PixelArray.rows'), 282: (53, 8, 'PixelArray'), 283: (53, 8, 'PixelArray'), 284: (53, 8, 'PixelArray'), 286: (53, 8, 'PixelArray'), 287: (53, 8, 'PixelArray')}
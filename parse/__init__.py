@@ -1 +1 @@
-from . import lexer, parser, ast_, code_gen
+from . import lexer, parser, ast_, analysis, code_gen, c_gen, index, values
\ No newline at end of file
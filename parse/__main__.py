@@ -0,0 +1,62 @@
+import argparse
+import json
+import sys
+from . import fuzz, profiling, query
+
+def main(argv=None):
+    arguments = argparse.ArgumentParser(prog="python -m parse")
+    commands = arguments.add_subparsers(dest="command", required=True)
+    profile = commands.add_parser("profile", help="time a schema against a sample file")
+    profile.add_argument("schema", help=".spp file")
+    profile.add_argument("data", help="sample file to parse")
+    profile.add_argument("--struct", required=True, help="struct to parse the file as")
+    profile.add_argument("--repeat", type=int, default=10, help="number of parses (default 10)")
+    profile.add_argument("--arg", action="append", default=[], metavar="NAME=VALUE",
+                         help="struct parameter, may be repeated")
+    profile.add_argument("--dump", help="write the raw cProfile statistics to this file")
+    profile.add_argument("--top", type=int, default=15, help="number of functions listed (default 15)")
+    check = commands.add_parser("fuzz", help="compare the backends on random schemas and inputs")
+    check.add_argument("--seed", type=int, default=0, help="first schema seed (default 0)")
+    check.add_argument("--schemas", type=int, default=20, help="number of schemas (default 20)")
+    check.add_argument("--inputs", type=int, default=10, help="inputs per schema (default 10)")
+    check.add_argument("--repeat", type=int, default=3, help="timed runs per input (default 3)")
+    check.add_argument("--no-c", action="store_true", help="leave out the C backend")
+    check.add_argument("--save", help="write the MB/s of each backend to this JSON file")
+    check.add_argument("--baseline", help="JSON file from --save to compare the rates with")
+    check.add_argument("--tolerance", type=float, default=0.2,
+                       help="slowdown from the baseline counted as a regression (default 0.2)")
+    scan = commands.add_parser("scan", help="list the records of files that match a predicate")
+    scan.add_argument("schema", help=".spp file")
+    scan.add_argument("files", nargs="+", help="files of back to back records")
+    scan.add_argument("--struct", required=True, help="struct of the records")
+    scan.add_argument("--where", required=True, help="predicate, a .spp expression over the struct's fields")
+    scan.add_argument("--workers", type=int, help="number of processes (default: one per CPU)")
+    options = arguments.parse_args(argv)
+    if options.command == "scan":
+        for path, offset in query.scan(options.files, options.schema, options.struct, options.where, options.workers):
+            print(f"{path}:{offset}", flush=True)
+    if options.command == "fuzz":
+        report = fuzz.run(options.seed, options.schemas, options.inputs, not options.no_c, options.repeat)
+        baseline = None
+        if options.baseline:
+            with open(options.baseline) as file:
+                baseline = json.load(file)
+        print(report.format(baseline))
+        regressions = report.regressions(baseline, options.tolerance) if baseline else []
+        for regression in regressions:
+            print("regression:", regression)
+        if options.save:
+            with open(options.save, "w") as file:
+                json.dump(report.rates(), file, indent=2)
+        if report.failures or regressions:
+            sys.exit(1)
+    if options.command == "profile":
+        extras = {}
+        for argument in options.arg:
+            name, _, value = argument.partition("=")
+            extras[name] = int(value, 0)
+        print(profiling.profile(options.schema, options.data, options.struct, options.repeat, extras,
+                                options.dump, options.top))
+
+if __name__ == "__main__":
+    main()
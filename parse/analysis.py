@@ -0,0 +1,460 @@
+from dataclasses import fields, is_dataclass
+from . import ast_
+
+PRIMITIVE_SIZES = {
+    "uint8": 1, "uint16": 2, "uint32": 4, "uint64": 8,
+    "int8": 1, "int16": 2, "int32": 4, "int64": 8,
+    "float": 4, "double": 8,
+}
+
+def references(expression: ast_.Expression | None) -> set[str]:
+    """Names an expression reads: identifiers and the roots of field accesses."""
+    if expression is None:
+        return set()
+    if isinstance(expression, ast_.Identifier):
+        return {expression.name}
+    if isinstance(expression, ast_.FieldAccess):
+        return references(expression.target)
+    if isinstance(expression, ast_.BinaryOp):
+        return references(expression.left) | references(expression.right)
+    if isinstance(expression, ast_.UnaryOp):
+        return references(expression.operand)
+    if isinstance(expression, ast_.Until):
+        return references(expression.value)
+    if isinstance(expression, ast_.CallExpression):
+        found = set()
+        for argument in expression.args:
+            found |= references(argument)
+        return found
+    return set()
+
+def declarations(statements) -> list[tuple[ast_.DeclareStatement, list[ast_.Expression]]]:
+    """Flattens a block into (declaration, enclosing conditions) pairs."""
+    found = []
+    def walk(statements, conditions):
+        for statement in statements:
+            if isinstance(statement, ast_.DeclareStatement):
+                found.append((statement, conditions))
+            elif isinstance(statement, ast_.IfThenElse):
+                branches = [statement.if_] + statement.elif_
+                previous = []
+                for branch in branches:
+                    walk(branch.statements, conditions + previous + [branch.condition])
+                    previous.append(branch.condition)
+                if statement.else_ is not None:
+                    walk(statement.else_.statements, conditions + previous)
+            elif isinstance(statement, ast_.Switch):
+                for case in statement.cases:
+                    walk([case.declaration], conditions + [statement.subject])
+    walk(statements, [])
+    return found
+
+POINTERS = ("offset", "reloffset")
+TRANSFORMS = ("zlib", "lzma")
+
+def pointer(declaration: ast_.DeclareStatement) -> ast_.Annotation | None:
+    """The @offset/@reloffset annotation of a field decoded out of line, if any.
+
+    Such a field does not advance the offset of its struct.
+    """
+    for annotation in declaration.annotations:
+        if annotation.name in POINTERS:
+            return annotation
+    return None
+
+def transform(declaration: ast_.DeclareStatement) -> ast_.Annotation | None:
+    """The @zlib/@lzma annotation of a field stored compressed, if any.
+
+    Its argument is the compressed length, which is what the field consumes.
+    """
+    for annotation in declaration.annotations:
+        if annotation.name in TRANSFORMS:
+            return annotation
+    return None
+
+def has_reloffset(statements) -> bool:
+    """Whether a block positions some field relative to the start of its struct."""
+    return any(getattr(pointer(declaration), "name", None) == "reloffset" for declaration, _ in declarations(statements))
+
+def is_validation(statement) -> bool:
+    """An `if (...) { raise ...; }` without elif or else branches."""
+    return isinstance(statement, ast_.IfThenElse) and not statement.elif_ and statement.else_ is None \
+        and bool(statement.if_.statements) \
+        and all(isinstance(inner, ast_.RaiseStmt) for inner in statement.if_.statements)
+
+def is_bits(statement) -> bool:
+    return isinstance(statement, ast_.DeclareStatement) and isinstance(statement.type, ast_.BitSize)
+
+def bit_width(declaration: ast_.DeclareStatement) -> int:
+    return int(declaration.type.value.raw[:-1], 0)
+
+def group_bits(statements) -> list:
+    """Splits a block into statements and lists of adjacent bit fields.
+
+    Each list is read as one little/big endian word of just enough bytes.
+    """
+    grouped = []
+    for statement in statements:
+        if is_bits(statement):
+            if grouped and isinstance(grouped[-1], list):
+                grouped[-1].append(statement)
+            else:
+                grouped.append([statement])
+        else:
+            grouped.append(statement)
+    return grouped
+
+def group_size(group: list[ast_.DeclareStatement]) -> int:
+    return (sum(bit_width(declaration) for declaration in group) + 7) // 8
+
+
+class Analysis:
+    """Static facts about the structs of a program.
+
+    `dependencies` tells which names each field needs before it can be
+    decoded and `dependents` the other way round, `static_size` gives the byte size of a declaration or struct when it is
+    known without reading data, and `fixed_shape` tells whether a struct's
+    size only depends on its parameters (so every element of an array of it
+    has the same size).
+    """
+    def __init__(self, ast_tree: ast_.Program):
+        self.program = ast_tree
+        self.structs = {}
+        for statement in ast_tree.items:
+            if isinstance(statement, ast_.Struct):
+                self.structs[statement.name] = statement
+        self._sizes = {}
+        self._shapes = {}
+        self._points = {}
+        self._raises = {}
+
+    def dependencies(self, name: str) -> dict[str, set[str]]:
+        """Names each field of struct `name` reads: its size, arguments,
+        annotations and the conditions it is declared under."""
+        struct = self.structs[name]
+        if isinstance(struct.block, ast_.CodeBlock):
+            return {}
+        result = {}
+        for declaration, conditions in declarations(struct.block.statements):
+            needed = reads(declaration)
+            for condition in conditions:
+                needed |= references(condition)
+            result.setdefault(declaration.name.name, set()).update(needed)
+        return result
+
+    def dependents(self, name: str) -> dict[str, set[str]]:
+        """The fields of struct `name` that read each field or parameter."""
+        result = {}
+        for field, needed in self.dependencies(name).items():
+            result.setdefault(field, set())
+            for other in needed:
+                result.setdefault(other, set()).add(field)
+        return result
+
+    def static_size(self, target: str | ast_.DeclareStatement) -> int | None:
+        if isinstance(target, str):
+            if target not in self._sizes:
+                self._sizes[target] = None # recursion guard
+                self._sizes[target] = self._struct_size(self.structs[target])
+            return self._sizes[target]
+        if pointer(target) is not None:
+            return 0
+        compressed = transform(target)
+        if compressed is not None:
+            if len(compressed.args) != 1 or not isinstance(compressed.args[0], ast_.NumberLiteral):
+                return None
+            try:
+                return int(compressed.args[0].raw, 0)
+            except ValueError:
+                return None
+        count = 1
+        if target.array_size is not None:
+            if not isinstance(target.array_size, ast_.NumberLiteral):
+                return None
+            try:
+                count = int(target.array_size.raw, 0)
+            except ValueError:
+                return None
+        element = self._type_size(target)
+        if element is None:
+            return None
+        return element * count
+
+    def _type_size(self, declaration: ast_.DeclareStatement) -> int | None:
+        type_ = declaration.type
+        if isinstance(type_, ast_.RegularSize):
+            return PRIMITIVE_SIZES[type_.value]
+        if isinstance(type_, ast_.Bytes):
+            return 1
+        if isinstance(type_, ast_.Size):
+            return int(type_.value.raw[:-1], 0)
+        if isinstance(type_, ast_.Identifier):
+            if type_.name not in self.structs or self.structs[type_.name].params:
+                return None
+            return self.static_size(type_.name)
+        return None
+
+    def _struct_size(self, struct: ast_.Struct) -> int | None:
+        if isinstance(struct.block, ast_.CodeBlock):
+            return None
+        total = 0
+        for statement in group_bits(struct.block.statements):
+            if isinstance(statement, list):
+                total += group_size(statement)
+            elif isinstance(statement, ast_.DeclareStatement):
+                size = self.static_size(statement)
+                if size is None:
+                    return None
+                total += size
+            elif declarations([statement]):
+                return None
+        return total
+
+    def needed_fields(self, extra: dict[str, list[ast_.Expression]] | None = None) -> dict[str, set[str]]:
+        """Fields of each struct that some expression reads.
+
+        Follows access paths into nested structs, so `dib_header.width.value`
+        in `File` marks `dib_header` in `File` and `width` in `DIBHeader`.
+        `extra` adds expressions evaluated against a struct from outside,
+        like a query predicate.
+        """
+        needed = {name: set() for name in self.structs}
+        for name in self.structs:
+            for struct, field in self.marks(name)[0]:
+                needed[struct].add(field)
+        for name, extra_expressions in (extra or {}).items():
+            found = set()
+            for expression in extra_expressions:
+                for path in field_paths(expression):
+                    self._mark(name, path, found, set())
+            for struct, field in found:
+                needed[struct].add(field)
+        return needed
+
+    def marks(self, name: str) -> tuple[set[tuple[str, str]], set[str]]:
+        """The (struct, field) pairs the expressions of struct `name` read,
+        and the structs looked into to find them.
+
+        The pairs only change when `name` or one of those structs changes.
+        """
+        found = set()
+        visited = set()
+        struct = self.structs[name]
+        if not isinstance(struct.block, ast_.CodeBlock):
+            for expression in expressions(struct.block.statements):
+                for path in field_paths(expression):
+                    self._mark(name, path, found, visited)
+        return found, visited
+
+    def _mark(self, name, path, found, visited):
+        visited.add(name)
+        struct = self.structs.get(name)
+        if struct is None or isinstance(struct.block, ast_.CodeBlock):
+            return
+        named = {declaration.name.name: declaration for declaration, _ in declarations(struct.block.statements)}
+        declaration = named.get(path[0])
+        if declaration is None:
+            return
+        found.add((name, path[0]))
+        if len(path) > 1 and path[1] != "value" and declaration.array_size is None \
+                and isinstance(declaration.type, ast_.Identifier):
+            self._mark(declaration.type.name, path[1:], found, visited)
+
+    def missing(self, name: str, path: list[str]) -> str | None:
+        """The first prefix of `path` that struct `name` has no field for, None if it resolves.
+
+        `value` is the attribute of primitive fields; arrays and bytes have
+        no fields, and the fields of code structs are not known.
+        """
+        for index, part in enumerate(path):
+            struct = self.structs.get(name)
+            if struct is None or isinstance(struct.block, ast_.CodeBlock):
+                return None
+            named = {declaration.name.name: declaration for declaration, _ in declarations(struct.block.statements)}
+            declaration = named.get(part)
+            if declaration is None:
+                return ".".join(path[:index + 1])
+            rest = path[index + 1:]
+            if declaration.array_size is None and isinstance(declaration.type, ast_.Identifier):
+                name = declaration.type.name
+                continue
+            if rest == ["value"] and declaration.array_size is None \
+                    and isinstance(declaration.type, (ast_.RegularSize, ast_.BitSize)):
+                return None
+            return ".".join(path[:index + 2]) if rest else None
+        return None
+
+    def uses(self, name: str) -> set[str]:
+        """Names of the structs that struct `name` declares fields of."""
+        struct = self.structs[name]
+        if isinstance(struct.block, ast_.CodeBlock):
+            return set()
+        return {declaration.type.name for declaration, _ in declarations(struct.block.statements)
+                if isinstance(declaration.type, ast_.Identifier)}
+
+    def forget(self, names) -> None:
+        """Drops the cached sizes and shapes of `names`, after they or the structs they use changed."""
+        for name in names:
+            self._sizes.pop(name, None)
+            self._shapes.pop(name, None)
+            self._points.pop(name, None)
+            self._raises.pop(name, None)
+
+    def update(self, structs: dict[str, ast_.Struct | None]) -> None:
+        """Swaps in edited structs, None removes one, and forgets their cached facts."""
+        for name, struct in structs.items():
+            if struct is None:
+                self.structs.pop(name, None)
+            else:
+                self.structs[name] = struct
+        self.forget(structs)
+
+    def fixed_shape(self, name: str) -> bool:
+        if name not in self._shapes:
+            self._shapes[name] = False # recursion guard
+            self._shapes[name] = self._fixed_shape(self.structs[name])
+        return self._shapes[name]
+
+    def points(self, name: str) -> bool:
+        """Whether struct `name`, or a struct it nests, has an @offset/@reloffset field.
+
+        Those are read from positions in the whole buffer, so arrays of the
+        struct are not split into chunks that only hold their elements.
+        """
+        if name not in self._points:
+            self._points[name] = False # recursion guard
+            struct = self.structs[name]
+            self._points[name] = not isinstance(struct.block, ast_.CodeBlock) and any(
+                pointer(declaration) is not None
+                or (isinstance(declaration.type, ast_.Identifier) and declaration.type.name in self.structs
+                    and self.points(declaration.type.name))
+                for declaration, _ in declarations(struct.block.statements))
+        return self._points[name]
+
+    def raises(self, name: str) -> bool:
+        """Whether parsing struct `name` can fail on data long enough for it.
+
+        It can when it raises, switches without a default, looks for a
+        terminator, is written by hand, or nests a struct that can.
+        """
+        if name not in self._raises:
+            self._raises[name] = True # recursion guard
+            self._raises[name] = self._raising(self.structs[name].block)
+        return self._raises[name]
+
+    def _raising(self, block) -> bool:
+        if isinstance(block, ast_.CodeBlock):
+            return True
+        def walk(statements):
+            for statement in statements:
+                if isinstance(statement, ast_.RaiseStmt):
+                    return True
+                if isinstance(statement, ast_.IfThenElse):
+                    branches = [statement.if_] + statement.elif_ + ([statement.else_] if statement.else_ else [])
+                    if any(walk(branch.statements) for branch in branches):
+                        return True
+                elif isinstance(statement, ast_.Switch):
+                    if all(case.values for case in statement.cases) or walk([case.declaration for case in statement.cases]):
+                        return True
+                elif isinstance(statement, ast_.DeclareStatement):
+                    if isinstance(statement.array_size, ast_.Until):
+                        return True
+                    # fields decoded out of line fail when they are used
+                    if pointer(statement) is None and transform(statement) is None \
+                            and isinstance(statement.type, ast_.Identifier) \
+                            and (statement.type.name not in self.structs or self.raises(statement.type.name)):
+                        return True
+            return False
+        return walk(block.statements)
+
+    def _fixed_shape(self, struct: ast_.Struct) -> bool:
+        if isinstance(struct.block, ast_.CodeBlock):
+            return False
+        params = {param.name for param in struct.params}
+        for declaration, conditions in declarations(struct.block.statements):
+            if conditions or isinstance(declaration.array_size, ast_.Until):
+                return False
+            if not references(declaration.array_size) <= params:
+                return False
+            # a compressed length or a pointer read from the data also varies
+            for annotation in declaration.annotations:
+                for argument in annotation.args:
+                    if not references(argument) <= params:
+                        return False
+            type_ = declaration.type
+            if isinstance(type_, ast_.Identifier):
+                if not references(declaration.default) <= params:
+                    return False
+                if type_.name not in self.structs or not self.fixed_shape(type_.name):
+                    return False
+        return True
+
+def expressions(statements):
+    """Yields every expression a block evaluates: sizes, arguments and conditions."""
+    for statement in statements:
+        if isinstance(statement, ast_.DeclareStatement):
+            if statement.array_size is not None:
+                yield statement.array_size
+            if statement.default is not None:
+                yield statement.default
+            for annotation in statement.annotations:
+                yield from annotation.args
+        elif isinstance(statement, ast_.IfThenElse):
+            for branch in [statement.if_] + statement.elif_:
+                yield branch.condition
+                yield from expressions(branch.statements)
+            if statement.else_ is not None:
+                yield from expressions(statement.else_.statements)
+        elif isinstance(statement, ast_.Switch):
+            yield statement.subject
+            yield from expressions([case.declaration for case in statement.cases])
+
+def reads(statement) -> set[str]:
+    """Names a statement reads, in its own expressions and in those of the statements it holds."""
+    found = set()
+    for expression in expressions([statement]):
+        found |= references(expression)
+    return found
+
+def field_paths(expression: ast_.Expression | None) -> list[list[str]]:
+    """Access paths in an expression, `a.b.value` gives ["a", "b", "value"]."""
+    if expression is None:
+        return []
+    if isinstance(expression, ast_.Identifier):
+        return [[expression.name]]
+    if isinstance(expression, ast_.FieldAccess):
+        paths = field_paths(expression.target)
+        if paths:
+            paths[-1].append(expression.field)
+        return paths
+    if isinstance(expression, ast_.BinaryOp):
+        return field_paths(expression.left) + field_paths(expression.right)
+    if isinstance(expression, ast_.UnaryOp):
+        return field_paths(expression.operand)
+    if isinstance(expression, ast_.Until):
+        return field_paths(expression.value)
+    if isinstance(expression, ast_.CallExpression):
+        paths = []
+        for argument in expression.args:
+            paths += field_paths(argument)
+        return paths
+    return []
+
+def fingerprint(node, line: int = 0):
+    """A hashable summary of a node, equal for nodes that generate the same code.
+
+    Positions are taken relative to `line`, so a struct moved up or down
+    keeps its fingerprint while one edited inside changes it.
+    """
+    if isinstance(node, list):
+        return tuple(fingerprint(item, line) for item in node)
+    if is_dataclass(node):
+        summary = [type(node).__name__]
+        for item in fields(node):
+            value = getattr(node, item.name)
+            if item.name == "pos":
+                summary.append((value[0] - line, value[1]))
+            else:
+                summary.append(fingerprint(value, line))
+        return tuple(summary)
+    return node
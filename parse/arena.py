@@ -0,0 +1,290 @@
+from array import array
+
+NONE = 0xFFFFFFFF   # field and parent of rows that have none
+COLUMNS = 5         # struct, field, offset, length, parent
+
+class Arena:
+    """A parse result as a flat node table pointing into the original buffer.
+
+    `nodes` is an `array('I')` with five columns per row: the id of the
+    struct declaring the field, the index of the field in it, then the
+    offset, length and parent row of its bytes. The root and the elements
+    of struct arrays are whole structs and have NONE as field. Only the
+    fields of the root are indexed up front: a nested struct gets its rows
+    the first time it is navigated into, and values are decoded when read,
+    so memory follows what is touched instead of the size of the data.
+    Offsets and lengths must fit in 32 bits. `module` is generated with
+    the "arena" variant.
+    """
+    def __init__(self, module, struct: str, data, offset: int = 0, extras: dict | None = None):
+        self.module = module
+        self.data = data
+        self.nodes = array("I")
+        # struct rows that need it: the arguments of a parameterized struct,
+        # or (arguments, count) of an array
+        self.arguments = {}
+        self.layouts = {}
+        self.expanded = {}
+        layout = self.layout(struct)
+        extras = extras or {}
+        for parameter in layout[2]:
+            if extras.get(parameter) is None:
+                raise ValueError(f"Argument for {parameter!r} is not passed")
+        self.arguments[0] = tuple(extras[parameter] for parameter in layout[2])
+        self.nodes.extend((layout[0], NONE, offset, 0, NONE))
+        self.nodes[3] = self._expand(0) - offset
+        self.root = Node(self, 0)
+
+    def layout(self, struct: str) -> tuple:
+        """(struct id, name, parameters, fields, fixed shape) of a struct of the module."""
+        layout = getattr(self.module, "layout" + struct)
+        known = self.layouts.setdefault(layout[0], layout)
+        if known is not layout:
+            raise ValueError(f"Structs {known[1]!r} and {struct!r} have the same id")
+        return layout
+
+    def __len__(self) -> int:
+        return len(self.nodes) // COLUMNS
+
+    def row(self, index: int) -> tuple[int, int, int, int, int]:
+        return tuple(self.nodes[index * COLUMNS:(index + 1) * COLUMNS])
+
+    def field(self, index: int) -> tuple | None:
+        """(name, kind, type, extra) of the field of a row, None for whole structs."""
+        struct, field = self.nodes[index * COLUMNS:index * COLUMNS + 2]
+        if field == NONE:
+            return None
+        return self.layouts[struct][3][field]
+
+    def children(self, index: int) -> range:
+        """Rows of the fields of a struct row, or of the elements of an array row."""
+        if index not in self.expanded:
+            start = len(self)
+            try:
+                field = self.field(index)
+                if field is None or field[1] == "struct":
+                    self._expand(index)
+                elif field[1] == "structs":
+                    self._elements(index)
+            except BaseException:
+                del self.nodes[start * COLUMNS:]
+                for row in [row for row in self.arguments if row >= start]:
+                    del self.arguments[row]
+                raise
+            self.expanded[index] = start, len(self)
+        return range(*self.expanded[index])
+
+    def expand_all(self) -> None:
+        """Indexes every row, so navigating the arena never appends to `nodes`."""
+        index = 0
+        while index < len(self):
+            self.children(index)
+            index += 1
+
+    def struct(self, index: int) -> tuple:
+        """Layout of the struct a struct row holds."""
+        field = self.field(index)
+        if field is None:
+            return self.layouts[self.nodes[index * COLUMNS]]
+        return self.layout(field[2])
+
+    def namespace(self, index: int) -> dict:
+        """Globals of the module that generated the struct of a field row.
+
+        An imported struct reads its fields with its own module's readers
+        and byte order.
+        """
+        layout = self.layouts[self.nodes[index * COLUMNS]]
+        return getattr(self.module, "arena" + layout[1]).__globals__
+
+    def parameters(self, index: int) -> tuple:
+        """Arguments of the struct a struct row holds, in parameter order."""
+        if not self.struct(index)[2]:
+            return ()
+        if index == 0:
+            return self.arguments[0]
+        if self.field(index) is None:
+            return self.arguments[self.nodes[index * COLUMNS + 4]][0]
+        return self.arguments[index]
+
+    def extras(self, index: int) -> dict:
+        """Arguments of the struct a struct row holds, by parameter name."""
+        return dict(zip(self.struct(index)[2], self.parameters(index)))
+
+    def _expand(self, index: int) -> int:
+        # skip functions step over fields nothing reads without bounds
+        # checks, the end of the struct covers them
+        layout = self.struct(index)
+        offset = self.nodes[index * COLUMNS + 2]
+        function = getattr(self.module, "arena" + layout[1])
+        end = function(self.data, offset, self.extras(index), self.nodes, self.arguments, index)[1]
+        if end > len(self.data):
+            raise ValueError(f"Data ends inside {layout[1]} (struct starts at offset {offset})")
+        return end
+
+    def _elements(self, index: int) -> None:
+        # elements only need their bounds, which the skip functions give
+        _, _, offset, _, _ = self.row(index)
+        layout = self.struct(index)
+        arguments, count = self.arguments[index]
+        name = layout[1]
+        if layout[2]:
+            specialize = getattr(self.module, "specializeSkip" + name, None) or getattr(self.module, "specialize" + name)
+            read = specialize(*arguments)
+        else:
+            read = getattr(self.module, "skip" + name, None) or getattr(self.module, "parse" + name)
+        if layout[4] and count > 0:
+            size = read(self.data, offset)[1] - offset
+            if offset + size * count > len(self.data):
+                raise ValueError(f"Data ends inside the {name} array at offset {offset}")
+            for element in range(count):
+                self.nodes.extend((layout[0], NONE, offset + element * size, size, index))
+            return
+        for _ in range(count):
+            end = read(self.data, offset)[1]
+            if end > len(self.data):
+                raise ValueError(f"Data ends inside the {name} array at offset {offset}")
+            self.nodes.extend((layout[0], NONE, offset, end - offset, index))
+            offset = end
+
+
+class Node:
+    """One row of an Arena.
+
+    Structs are indexed by field name and arrays of structs by position,
+    `value` decodes the bytes of the row like the parse function would.
+    """
+    __slots__ = ("arena", "index")
+
+    def __init__(self, arena: Arena, index: int):
+        self.arena = arena
+        self.index = index
+
+    @property
+    def name(self) -> str:
+        field = self.arena.field(self.index)
+        if field is None:
+            return self.arena.struct(self.index)[1]
+        return field[0]
+
+    @property
+    def kind(self) -> str:
+        field = self.arena.field(self.index)
+        return "struct" if field is None else field[1]
+
+    @property
+    def offset(self) -> int:
+        return self.arena.nodes[self.index * COLUMNS + 2]
+
+    @property
+    def length(self) -> int:
+        return self.arena.nodes[self.index * COLUMNS + 3]
+
+    @property
+    def parent(self) -> "Node | None":
+        parent = self.arena.nodes[self.index * COLUMNS + 4]
+        return None if parent == NONE else Node(self.arena, parent)
+
+    def keys(self) -> list[str]:
+        return [Node(self.arena, index).name for index in self.arena.children(self.index)]
+
+    def __len__(self) -> int:
+        return len(self.arena.children(self.index))
+
+    def __iter__(self):
+        for index in self.arena.children(self.index):
+            yield Node(self.arena, index)
+
+    def __getitem__(self, key):
+        kind = self.kind
+        if kind not in ("struct", "structs"):
+            return self.value[key]
+        children = self.arena.children(self.index)
+        if kind == "structs":
+            if isinstance(key, slice):
+                return [Node(self.arena, index) for index in children[key]]
+            return Node(self.arena, children[key])
+        fields = self.arena.struct(self.index)[3]
+        nodes = self.arena.nodes
+        for index in children:
+            if fields[nodes[index * COLUMNS + 1]][0] == key:
+                return Node(self.arena, index)
+        raise KeyError(key)
+
+    @property
+    def value(self):
+        arena = self.arena
+        module = arena.module
+        data = arena.data
+        offset, length = self.offset, self.length
+        field = arena.field(self.index)
+        if field is None or field[1] == "struct":
+            name = arena.struct(self.index)[1]
+            return getattr(module, "parse" + name)(data, offset, *arena.parameters(self.index))[0]
+        name, kind, type_, extra = field
+        if kind == "structs":
+            return [element.value for element in self]
+        namespace = arena.namespace(self.index)
+        if kind == "value":
+            return namespace["type_" + type_](data, offset)[0]
+        if kind == "array":
+            return namespace["type_bulk"](data, offset, type_, length // array(namespace["TYPECODES"][type_]).itemsize)[0]
+        if kind == "bytes":
+            return data[offset:offset + length]
+        if kind == "bits":
+            shift, width, endian = extra
+            return namespace[type_](int.from_bytes(data[offset:offset + length], endian) >> shift & (1 << width) - 1)
+        # lazily decoded or compressed fields come from parsing the enclosing struct again
+        value = self.parent.value[name]
+        if type(value).__name__ == "Lazy":
+            value = value.resolve()
+        return value
+
+    def __repr__(self) -> str:
+        return f"<Node {self.name} at {self.offset}+{self.length}>"
+
+
+def patch(module, struct: str, data, path: str, value, offset: int = 0, extras: dict | None = None) -> int:
+    """Overwrites the field at `path` of the `struct` at `offset` in place, returns where it starts.
+
+    `path` names fields and array indices with dots, "dib_header.width" or
+    "pixels.rows.3.pixels.0.red"; `data` is a bytearray or writable mmap.
+    Fields at a static position go through the generated patch<Struct>
+    and cost the same whatever the size of the data, others are found with
+    an Arena that only indexes the structs on the path. Only the bytes of
+    the field change: patching a count or a size does not move what follows.
+    `module` is generated with the "patch" variant, and with "arena" too
+    to reach fields whose position depends on the data.
+    """
+    try:
+        return getattr(module, "patch" + struct)(data, offset, path, value)
+    except KeyError:
+        pass
+    node = Arena(module, struct, data, offset, extras).root
+    parts = path.split(".")
+    while parts and node.kind in ("struct", "structs"):
+        part = parts.pop(0)
+        node = node[int(part)] if node.kind == "structs" else node[part]
+    arena = node.arena
+    _, kind, type_, extra = arena.field(node.index) or (None, node.kind, None, None)
+    namespace = arena.namespace(node.index)
+    at = node.offset
+    if kind == "array" and len(parts) == 1:
+        size = array(namespace["TYPECODES"][type_]).itemsize
+        index = int(parts.pop())
+        if not 0 <= index < node.length // size:
+            raise IndexError(f"{node.name} has {node.length // size} elements, not {index + 1}")
+        at += index * size
+        kind = "value"
+    if parts:
+        raise KeyError(f"{node.name} has no field {'.'.join(parts)!r}")
+    if kind == "value":
+        namespace["write_value"](data, at, type_, value)
+    elif kind == "bits":
+        shift, width, endian = extra
+        namespace["write_bits"](data, at, node.length, shift, width, value, endian)
+    elif kind == "bytes":
+        namespace["write_bytes"](data, at, node.length, value)
+    else:
+        raise ValueError(f"{node.name} is a {kind} field, only primitive, bit and bytes fields can be patched")
+    return at
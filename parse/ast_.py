@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Optional, Union
 from enum import Enum, auto
 from .lexer import TokenType
@@ -30,10 +30,22 @@ class NumberLiteral(Expression):
 class Size(Expression):
     value: NumberLiteral
 
+@dataclass
+class BitSize(Expression):
+    value: NumberLiteral
+
 @dataclass
 class RegularSize(Expression):
     value: str
 
+@dataclass
+class Bytes(Expression):
+    pass
+
+@dataclass
+class Until(Expression):
+    value: Expression   # terminator, consumed but not part of the array
+
 @dataclass
 class StringLiteral(Expression):
     value: str
@@ -54,6 +66,11 @@ class UnaryOp(Expression):
     op: str
     operand: Expression
 
+@dataclass
+class Annotation(Expression):
+    name: str   # "offset" / "reloffset" / "zlib" / "lzma"
+    args: list[Expression]
+
 # --- statements / declarations ---
 @dataclass
 class Statement:
@@ -67,9 +84,10 @@ class RaiseStmt(Statement):
 class DeclareStatement(Statement):
     # can be: ident ":" ident | size [ "[" ( ident | number | size ) "]" ] | [ "=" ( ident | number ) ]
     name: Identifier        # identifier when present (for ident:ident form or named field)
-    type: Union[Size, RegularSize, Identifier]   # type name when present (like uint32)
+    type: Union[Size, BitSize, RegularSize, Bytes, Identifier]   # type name when present (like uint32)
     array_size: Optional[Expression]  # expression inside brackets or None
     default: Optional[Expression]
+    annotations: list[Annotation] = field(default_factory=list)   # trailing @name(args)
 
 @dataclass
 class SpecialLocal(Statement):
@@ -77,6 +95,17 @@ class SpecialLocal(Statement):
     arg: Optional[str]   # "front"/"behind"/"big"/"little" or None
 
 # --- condition / flow ---
+@dataclass
+class SwitchCase(Statement):
+    values: list[Expression]   # empty for the default case
+    declaration: DeclareStatement   # named like the switch field
+
+@dataclass
+class Switch(Statement):
+    name: Identifier
+    subject: Expression
+    cases: list[SwitchCase]
+
 @dataclass
 class Block(Statement):
     statements: list[Union[Statement, 'ConditionalBlock']]
@@ -106,6 +135,10 @@ class SpecialGlobal(Statement):
     arg: Optional[str]
 
 # --- struct / top-level ---
+@dataclass
+class Import(Statement):
+    path: str   # as written, relative to the importing file
+
 @dataclass
 class Struct(Statement):
     name: str
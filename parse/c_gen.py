@@ -0,0 +1,616 @@
+from . import ast_
+from .analysis import bit_width, group_bits, group_size, has_reloffset, pointer
+from .code_gen import bit_shifts
+from ast import literal_eval
+from dataclasses import replace
+import importlib.machinery
+import importlib.util
+import os
+import shlex
+import subprocess
+import sys
+import sysconfig
+import tempfile
+
+PRECODE = """
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdint.h>
+#include <string.h>
+#include <math.h>
+
+static int truncated(Py_ssize_t offset, Py_ssize_t n, Py_ssize_t len) {
+    if (offset < 0 || n < 0 || offset + n > len) {
+        PyErr_Format(PyExc_ValueError, "Buffer too short: need %zd bytes at offset %zd, have %zd", n, offset, len);
+        return 1;
+    }
+    return 0;
+}
+
+static uint64_t read_u(const unsigned char *data, Py_ssize_t offset, int n) {
+    uint64_t v = 0;
+    int i;
+    if (LITTLE) {
+        for (i = n - 1; i >= 0; i--) v = (v << 8) | data[offset + i];
+    } else {
+        for (i = 0; i < n; i++) v = (v << 8) | data[offset + i];
+    }
+    return v;
+}
+
+static void write_u(unsigned char *out, uint64_t v, int n) {
+    int i;
+    for (i = 0; i < n; i++) out[LITTLE ? i : n - 1 - i] = (unsigned char)(v >> (8 * i));
+}
+
+/* `width` bits from bit `shift` of a `size` byte word, counted from its
+   least significant end */
+static uint64_t read_bits(const unsigned char *data, Py_ssize_t offset, int size, int shift, int width) {
+    uint64_t v = 0;
+    int i;
+    for (i = width - 1; i >= 0; i--) {
+        int bit = shift + i;
+        int byte = LITTLE ? bit / 8 : size - 1 - bit / 8;
+        v = (v << 1) | ((data[offset + byte] >> (bit % 8)) & 1);
+    }
+    return v;
+}
+
+/* the first match of `pattern` a whole number of `step` bytes after offset */
+static Py_ssize_t find_terminator(const unsigned char *data, Py_ssize_t len, Py_ssize_t offset,
+                                  const unsigned char *pattern, Py_ssize_t size, Py_ssize_t step) {
+    Py_ssize_t at;
+    for (at = offset; at >= 0 && at + size <= len; at += step) {
+        if (memcmp(data + at, pattern, size) == 0) return at;
+    }
+    return -1;
+}
+
+static int64_t read_i(const unsigned char *data, Py_ssize_t offset, int n) {
+    uint64_t v = read_u(data, offset, n);
+    int shift = 64 - 8 * n;
+    return (int64_t)(v << shift) >> shift;
+}
+
+static double read_f32(const unsigned char *data, Py_ssize_t offset) {
+    uint32_t v = (uint32_t)read_u(data, offset, 4);
+    float f;
+    memcpy(&f, &v, 4);
+    return f;
+}
+
+static double read_f64(const unsigned char *data, Py_ssize_t offset) {
+    uint64_t v = read_u(data, offset, 8);
+    double f;
+    memcpy(&f, &v, 8);
+    return f;
+}
+
+/* expressions are evaluated in long double, which holds every 64-bit
+   integer exactly on x86 and aarch64 Linux */
+typedef long double number;
+
+/* counts are clamped before they size anything, and arrays of fixed size
+   elements are checked whole before their list is allocated */
+static Py_ssize_t to_count(number n) {
+    if (!(n > 0)) return 0;
+    if (n >= (number)PY_SSIZE_T_MAX) return PY_SSIZE_T_MAX;
+    return (Py_ssize_t)n;
+}
+
+static int truncated_array(Py_ssize_t offset, Py_ssize_t n, Py_ssize_t size, Py_ssize_t len) {
+    if (n > 0 && (offset < 0 || offset > len || n > (len - offset) / size)) {
+        PyErr_Format(PyExc_ValueError, "Buffer too short: need %zd elements of %zd bytes at offset %zd, have %zd",
+                     n, size, offset, len);
+        return 1;
+    }
+    return 0;
+}
+
+static number py_mod(number a, number b) {
+    number m = fmodl(a, b);
+    if (m != 0 && ((m < 0) != (b < 0))) m += b;
+    return m;
+}
+
+static PyObject *item(PyObject *obj, const char *key) {
+    PyObject *v;
+    if (obj == NULL) return NULL;
+    v = PyDict_GetItemString(obj, key);
+    if (v == NULL && !PyErr_Occurred()) PyErr_SetString(PyExc_KeyError, key);
+    return v;
+}
+
+/* an O& converter for struct parameters; integers convert exactly,
+   64-bit ones too where long double has a 64-bit mantissa */
+static int to_number(PyObject *obj, void *out) {
+    int overflow;
+    long long v;
+    if (PyLong_Check(obj)) {
+        v = PyLong_AsLongLongAndOverflow(obj, &overflow);
+        if (overflow > 0) {
+            *(number *)out = (number)PyLong_AsUnsignedLongLong(obj);
+            return !PyErr_Occurred();
+        }
+        if (!overflow) {
+            *(number *)out = (number)v;
+            return !(v == -1 && PyErr_Occurred());
+        }
+    }
+    *(number *)out = PyFloat_AsDouble(obj);
+    return !PyErr_Occurred();
+}
+
+static number num(PyObject *obj) {
+    number v = 0;
+    if (obj != NULL) to_number(obj, &v);
+    return v;
+}
+
+static int set_item(PyObject *ctx, PyObject *key, PyObject *value) {
+    int r;
+    if (value == NULL) return -1;
+    r = PyDict_SetItem(ctx, key, value);
+    Py_DECREF(value);
+    return r;
+}
+
+""".lstrip()
+
+# ctype name -> (byte size, C reader expression, Python object constructor)
+PRIMITIVES = {
+    "uint8": (1, "read_u(data, {o}, 1)", "PyLong_FromUnsignedLongLong"),
+    "uint16": (2, "read_u(data, {o}, 2)", "PyLong_FromUnsignedLongLong"),
+    "uint32": (4, "read_u(data, {o}, 4)", "PyLong_FromUnsignedLongLong"),
+    "uint64": (8, "read_u(data, {o}, 8)", "PyLong_FromUnsignedLongLong"),
+    "int8": (1, "read_i(data, {o}, 1)", "PyLong_FromLongLong"),
+    "int16": (2, "read_i(data, {o}, 2)", "PyLong_FromLongLong"),
+    "int32": (4, "read_i(data, {o}, 4)", "PyLong_FromLongLong"),
+    "int64": (8, "read_i(data, {o}, 8)", "PyLong_FromLongLong"),
+    "float": (4, "read_f32(data, {o})", "PyFloat_FromDouble"),
+    "double": (8, "read_f64(data, {o})", "PyFloat_FromDouble"),
+}
+
+INTEGER_OPS = {"&", "|", "^"}
+
+
+class CGenerator:
+    """Compiles a parsed program into the source of a CPython extension module.
+
+    Each struct becomes a C function returning the same nested dict layout as
+    the Python backend, except that primitive fields are plain ints/floats
+    instead of ctypes objects. Use `values.plain` on Python backend results to
+    compare the two. Out-of-line fields are decoded eagerly. Code structs and
+    @zlib/@lzma fields are not supported and raise NotImplementedError.
+    """
+    def __init__(self, ast_tree: ast_.Program, module_name: str):
+        self.program = ast_tree
+        self.module_name = module_name
+        self.functions = {}
+        self.endian = 'little'
+        self.keys = {}
+        self.struct_name = ""
+        self.indent_ = "    "
+        self.load_functions()
+
+    def load_functions(self):
+        for statement in self.program.items:
+            if isinstance(statement, ast_.Struct):
+                if isinstance(statement.block, ast_.CodeBlock):
+                    raise NotImplementedError(f"code struct {statement.name!r} cannot be compiled to C")
+                parameters = tuple(param.name for param in statement.params)
+                self.functions[statement.name] = parameters
+            elif isinstance(statement, ast_.SpecialGlobal) and statement.name == "endian":
+                self.endian = statement.arg
+
+    def _fields(self, statements, found: dict):
+        for statement in statements:
+            if isinstance(statement, ast_.DeclareStatement):
+                found.setdefault(statement.name.name, statement)
+            elif isinstance(statement, ast_.IfThenElse):
+                self._fields(statement.if_.statements, found)
+                for elif_ in statement.elif_:
+                    self._fields(elif_.statements, found)
+                if statement.else_ is not None:
+                    self._fields(statement.else_.statements, found)
+            elif isinstance(statement, ast_.Switch):
+                self._fields([case.declaration for case in statement.cases], found)
+        return found
+
+    def _key(self, name: str) -> str:
+        # dict keys are interned once at import instead of built per field
+        return self.keys.setdefault(name, f"K_{name}")
+
+    def _local(self, name: str, fields: dict, params) -> tuple[str, str]:
+        if name in params:
+            return f"p_{name}", "num"
+        declaration = fields.get(name)
+        if declaration is None:
+            raise NameError(f"Unknown name {name!r} in expression")
+        if isinstance(declaration.type, (ast_.RegularSize, ast_.BitSize)) and declaration.array_size is None:
+            return f"f_{name}", "num"
+        return f"s_{name}", "obj"
+
+    def _gen_expression(self, expression: ast_.Expression, fields: dict, params) -> tuple[str, str]:
+        if isinstance(expression, ast_.Identifier):
+            return self._local(expression.name, fields, params)
+        if isinstance(expression, ast_.FieldAccess):
+            target, kind = self._gen_expression(expression.target, fields, params)
+            if expression.field == "value":
+                if kind == "obj":
+                    return f"num({target})", "num"
+                return target, "num"
+            if kind == "num":
+                raise TypeError(f"Cannot access field {expression.field!r} of a number at {expression.pos}")
+            return f"item({target}, \"{expression.field}\")", "obj"
+        if isinstance(expression, ast_.NumberLiteral):
+            raw = expression.raw
+            if raw[-1] in "Bb":
+                raw = raw[:-1]
+            try:
+                return f"((number){int(raw, 0)}ULL)", "num"
+            except ValueError:
+                return f"((number){raw})", "num"
+        if isinstance(expression, ast_.UnaryOp):
+            operand = self._as_num(*self._gen_expression(expression.operand, fields, params))
+            if expression.op == "~":
+                return f"((number)(~(int64_t)({operand})))", "num"
+            return f"({expression.op}({operand}))", "num"
+        if isinstance(expression, ast_.BinaryOp):
+            left = self._as_num(*self._gen_expression(expression.left, fields, params))
+            right = self._as_num(*self._gen_expression(expression.right, fields, params))
+            if expression.op == "%":
+                return f"py_mod({left}, {right})", "num"
+            if expression.op in INTEGER_OPS:
+                return f"((number)((int64_t)({left}){expression.op}(int64_t)({right})))", "num"
+            return f"({left}{expression.op}{right})", "num"
+        raise NotImplementedError(f"Expression {expression!r} cannot be compiled to C")
+
+    def _as_num(self, code: str, kind: str) -> str:
+        if kind == "obj":
+            return f"num({code})"
+        return code
+
+    def _num_expression(self, expression, fields, params) -> str:
+        return self._as_num(*self._gen_expression(expression, fields, params))
+
+    def _gen_call(self, statement: ast_.DeclareStatement, fields, params) -> str:
+        name = statement.type.name
+        parameters = self.functions[name]
+        arguments = []
+        if isinstance(statement.default, ast_.CallExpression):
+            arguments = [self._num_expression(argument, fields, params) for argument in statement.default.args]
+        if len(arguments) != len(parameters):
+            raise TypeError(f"{name} takes {len(parameters)} arguments, {len(arguments)} given at {statement.pos}")
+        return "".join(f", {argument}" for argument in arguments)
+
+    def _gen_pointer(self, statement: ast_.DeclareStatement, annotation: ast_.Annotation, fields, params) -> str:
+        # fields are not decoded lazily in C: seek, decode and come back
+        if len(annotation.args) != 1:
+            raise ValueError(f"@{annotation.name} of {statement.name.name!r} takes one argument (at {annotation.pos})")
+        position = self._num_expression(annotation.args[0], fields, params)
+        if annotation.name == "reloffset":
+            position = f"start + {position}"
+        inline = replace(statement, annotations=[other for other in statement.annotations if other is not annotation])
+        lines = ["{"]
+        lines.append(f"{self.indent_}Py_ssize_t saved = *offset;")
+        lines.append(f"{self.indent_}*offset = (Py_ssize_t)({position});")
+        lines.append(f"{self.indent_}if (PyErr_Occurred()) goto fail;")
+        lines.append(self.indent(self._gen_declaration(inline, fields, params)))
+        lines.append(f"{self.indent_}*offset = saved;")
+        lines.append("}")
+        return "\n".join(lines)
+
+    def _gen_declaration(self, statement: ast_.DeclareStatement, fields, params) -> str:
+        name = statement.name.name
+        annotation = pointer(statement)
+        if annotation is not None:
+            return self._gen_pointer(statement, annotation, fields, params)
+        if statement.annotations:
+            raise NotImplementedError(f"@{statement.annotations[0].name} cannot be compiled to C")
+        lines = []
+        if isinstance(statement.array_size, ast_.Until):
+            return self._gen_until(statement, fields, params)
+        if isinstance(statement.type, ast_.Bytes):
+            if statement.array_size is None:
+                raise ValueError(f"bytes field {name!r} needs a length or terminator (at {statement.pos})")
+            count = self._num_expression(statement.array_size, fields, params)
+            lines.append("{")
+            lines.append(f"{self.indent_}Py_ssize_t n = to_count({count});")
+            lines.append(f"{self.indent_}if (PyErr_Occurred() || truncated(*offset, n, len)) goto fail;")
+            lines.append(f"{self.indent_}s_{name} = PyBytes_FromStringAndSize((const char *)data + *offset, n);")
+            lines.append(f"{self.indent_}*offset += n;")
+            lines.append(f"{self.indent_}if (set_item(ctx, {self._key(name)}, s_{name}) < 0) goto fail;")
+            lines.append("}")
+            return "\n".join(lines)
+        size = None
+        if isinstance(statement.type, ast_.Size):
+            n = size = int(statement.type.value.raw[:-1], 0)
+            read = f"PyBytes_FromStringAndSize((const char *)data + (*offset - {n}), {n})"
+            element = (f"if (truncated(*offset, {n}, len)) goto fail;", f"*offset += {n};", read)
+        elif isinstance(statement.type, ast_.RegularSize):
+            n, reader, constructor = PRIMITIVES[statement.type.value]
+            size = n
+            element = (f"if (truncated(*offset, {n}, len)) goto fail;", f"*offset += {n};",
+                       f"{constructor}({reader.format(o=f'*offset - {n}')})")
+            if statement.array_size is None:
+                # keep the exact integer for the result, f_ only feeds expressions
+                ctype = {"PyLong_FromUnsignedLongLong": "uint64_t", "PyLong_FromLongLong": "int64_t"}.get(constructor, "double")
+                lines.append(element[0])
+                lines.append("{")
+                lines.append(f"{self.indent_}{ctype} v = {reader.format(o='*offset')};")
+                lines.append(f"{self.indent_}f_{name} = (number)v;")
+                lines.append(f"{self.indent_}{element[1]}")
+                lines.append(f"{self.indent_}if (set_item(ctx, {self._key(name)}, {constructor}(v)) < 0) goto fail;")
+                lines.append("}")
+                return "\n".join(lines)
+        elif isinstance(statement.type, ast_.Identifier):
+            call = f"parse{statement.type.name}(data, len, offset{self._gen_call(statement, fields, params)})"
+            element = (None, None, call)
+        else:
+            raise NotImplementedError(f"Type {statement.type!r} cannot be compiled to C")
+        check, advance, read = element
+        if statement.array_size is None:
+            if check is not None:
+                lines.append(check)
+                lines.append(advance)
+            lines.append(f"s_{name} = {read};")
+            lines.append(f"if (set_item(ctx, {self._key(name)}, s_{name}) < 0) goto fail;")
+            return "\n".join(lines)
+        count = self._num_expression(statement.array_size, fields, params)
+        lines.append("{")
+        lines.append(f"{self.indent_}Py_ssize_t i, n = to_count({count});")
+        lines.append(f"{self.indent_}PyObject *arr;")
+        lines.append(f"{self.indent_}if (PyErr_Occurred()) goto fail;")
+        if size is not None:
+            lines.append(f"{self.indent_}if (truncated_array(*offset, n, {size}, len)) goto fail;")
+        # structs of unknown size fail element by element, their list grows
+        # instead of being allocated for a count read from the data
+        lines.append(f"{self.indent_}arr = PyList_New({'n' if size is not None else 0});")
+        lines.append(f"{self.indent_}if (set_item(ctx, {self._key(name)}, arr) < 0) goto fail;")
+        lines.append(f"{self.indent_}s_{name} = arr;")
+        lines.append(f"{self.indent_}for (i = 0; i < n; i++) {{")
+        body = []
+        if check is not None:
+            body.append(advance)
+        body.append("{")
+        body.append(f"{self.indent_}PyObject *el = {read};")
+        body.append(f"{self.indent_}if (el == NULL) goto fail;")
+        if size is not None:
+            body.append(f"{self.indent_}PyList_SET_ITEM(arr, i, el);")
+        else:
+            body.append(f"{self.indent_}if (PyList_Append(arr, el) < 0) {{ Py_DECREF(el); goto fail; }}")
+            body.append(f"{self.indent_}Py_DECREF(el);")
+        body.append("}")
+        lines.append(self.indent("\n".join(body), 2))
+        lines.append(f"{self.indent_}}}")
+        lines.append("}")
+        return "\n".join(lines)
+
+    def _gen_until(self, statement: ast_.DeclareStatement, fields, params) -> str:
+        # the value leaves the terminator out, the offset moves past it
+        name = statement.name.name
+        terminator = statement.array_size.value
+        if isinstance(statement.type, ast_.Bytes):
+            step = 1
+        elif isinstance(statement.type, ast_.RegularSize) and statement.type.value not in ("float", "double"):
+            step = PRIMITIVES[statement.type.value][0]
+        else:
+            raise ValueError(f"Only bytes and integer arrays can end with a terminator, not {name!r} (at {statement.pos})")
+        lines = ["{"]
+        if isinstance(terminator, ast_.StringLiteral):
+            pattern = literal_eval(terminator.value).encode("latin-1")
+            lines.append(f"{self.indent_}static const unsigned char pattern[] = {{{', '.join(map(str, pattern))}}};")
+            size = len(pattern)
+        else:
+            lines.append(f"{self.indent_}unsigned char pattern[{step}];")
+            lines.append(f"{self.indent_}write_u(pattern, (uint64_t)(int64_t)({self._num_expression(terminator, fields, params)}), {step});")
+            lines.append(f"{self.indent_}if (PyErr_Occurred()) goto fail;")
+            size = step
+        lines.append(f"{self.indent_}Py_ssize_t end = find_terminator(data, len, *offset, pattern, {size}, {step});")
+        lines.append(f"{self.indent_}if (end < 0) {{")
+        lines.append(f"{self.indent_*2}PyErr_Format(PyExc_ValueError, \"Data ends inside {self.struct_name}.{name} (field starts at offset %zd)\", *offset);")
+        lines.append(f"{self.indent_*2}goto fail;")
+        lines.append(f"{self.indent_}}}")
+        if step == 1 and isinstance(statement.type, ast_.Bytes):
+            lines.append(f"{self.indent_}s_{name} = PyBytes_FromStringAndSize((const char *)data + *offset, end - *offset);")
+        else:
+            _, reader, constructor = PRIMITIVES[statement.type.value]
+            lines.append(f"{self.indent_}Py_ssize_t i, n = (end - *offset) / {step};")
+            lines.append(f"{self.indent_}s_{name} = PyList_New(n);")
+            lines.append(f"{self.indent_}for (i = 0; s_{name} != NULL && i < n; i++)")
+            lines.append(f"{self.indent_*2}PyList_SET_ITEM(s_{name}, i, {constructor}({reader.format(o=f'*offset + i * {step}')}));")
+        lines.append(f"{self.indent_}*offset = end + {size};")
+        lines.append(f"{self.indent_}if (set_item(ctx, {self._key(name)}, s_{name}) < 0) goto fail;")
+        lines.append("}")
+        return "\n".join(lines)
+
+    def _gen_bits(self, group: list[ast_.DeclareStatement]) -> str:
+        # adjacent bit fields share one word, laid out like the Python backend's
+        size = group_size(group)
+        lines = [f"if (truncated(*offset, {size}, len)) goto fail;"]
+        for declaration, shift in zip(group, bit_shifts(group, self.endian)):
+            name = declaration.name.name
+            width = bit_width(declaration)
+            if declaration.array_size is not None:
+                raise ValueError(f"Bit field {name!r} cannot be an array (at {declaration.pos})")
+            if not 0 < width <= 64:
+                raise ValueError(f"Bit field {name!r} must be 1 to 64 bits wide (at {declaration.pos})")
+            lines.append("{")
+            lines.append(f"{self.indent_}uint64_t v = read_bits(data, *offset, {size}, {shift}, {width});")
+            lines.append(f"{self.indent_}f_{name} = (number)v;")
+            lines.append(f"{self.indent_}if (set_item(ctx, {self._key(name)}, PyLong_FromUnsignedLongLong(v)) < 0) goto fail;")
+            lines.append("}")
+        lines.append(f"*offset += {size};")
+        return "\n".join(lines)
+
+    def _gen_switch(self, switch: ast_.Switch, fields, params) -> str:
+        # one comparison per case value, in the order of the cases
+        lines = ["{", f"{self.indent_}number subject = {self._num_expression(switch.subject, fields, params)};",
+                 f"{self.indent_}if (PyErr_Occurred()) goto fail;"]
+        default = None
+        branches = []
+        for case in switch.cases:
+            if not case.values:
+                default = case.declaration
+                continue
+            conditions = []
+            for value in case.values:
+                if not isinstance(value, ast_.NumberLiteral):
+                    raise ValueError(f"Case of {switch.name.name!r} is not a number (at {value.pos})")
+                conditions.append(f"subject == {self._num_expression(value, fields, params)}")
+            branches.append((" || ".join(conditions), case.declaration))
+        code = ""
+        for condition, declaration in branches:
+            code += f"{'if' if not code else ' else if'} ({condition}) {{\n"
+            code += self.indent(self._gen_declaration(declaration, fields, params)) + "\n}"
+        if default is not None:
+            fallback = self._gen_declaration(default, fields, params)
+        else:
+            message = f"No case of {self.struct_name}.{switch.name.name} matches"
+            fallback = f"PyErr_SetString(PyExc_ValueError, \"{message}\");\ngoto fail;"
+        code += (" else {\n" if code else "{\n") + self.indent(fallback) + "\n}"
+        lines.append(self.indent(code))
+        lines.append("}")
+        return "\n".join(lines)
+
+    def indent(self, text, depth=1):
+        return depth*self.indent_ + text.replace('\n','\n'+depth*self.indent_)
+
+    def _gen_block(self, statements, fields, params) -> str:
+        return "\n".join(self._gen_bits(statement) if isinstance(statement, list)
+                         else self._gen_statement(statement, fields, params) for statement in group_bits(statements))
+
+    def _gen_statement(self, statement: ast_.Statement, fields, params) -> str:
+        if isinstance(statement, ast_.DeclareStatement):
+            return self._gen_declaration(statement, fields, params)
+        if isinstance(statement, ast_.IfThenElse):
+            branches = [("if", statement.if_)] + [("else if", elif_) for elif_ in statement.elif_]
+            result = ""
+            for keyword, branch in branches:
+                condition = self._num_expression(branch.condition, fields, params)
+                if result:
+                    result += " "
+                result += f"{keyword} ({condition}) {{\n"
+                result += self.indent(f"if (PyErr_Occurred()) goto fail;\n{self._gen_block(branch.statements, fields, params)}")
+                result += "\n}"
+            if statement.else_ is not None:
+                result += " else {\n"
+                result += self.indent(self._gen_block(statement.else_.statements, fields, params))
+                result += "\n}"
+            return result + "\nif (PyErr_Occurred()) goto fail;"
+        if isinstance(statement, ast_.Switch):
+            return self._gen_switch(statement, fields, params)
+        if isinstance(statement, ast_.RaiseStmt):
+            return f"PyErr_SetString(PyExc_ValueError, {statement.message.value});\ngoto fail;"
+        if isinstance(statement, ast_.SpecialLocal):
+            return f"/* LOCAL: {statement.name} {statement.arg} */"
+        raise NotImplementedError(f"Statement {statement!r} cannot be compiled to C")
+
+    def _signature(self, struct: ast_.Struct) -> str:
+        params = "".join(f", number p_{param.name}" for param in struct.params)
+        return f"static PyObject *parse{struct.name}(const unsigned char *data, Py_ssize_t len, Py_ssize_t *offset{params})"
+
+    def _gen_struct(self, struct: ast_.Struct) -> str:
+        params = self.functions[struct.name]
+        self.struct_name = struct.name
+        fields = self._fields(struct.block.statements, {})
+        this_block = self._signature(struct) + " {\n"
+        body = ["PyObject *ctx = PyDict_New();"]
+        # branches may declare the same name with a number in one and an
+        # object in another, so every name gets both locals
+        for name in fields:
+            body.append(f"number f_{name} = 0;")
+            body.append(f"PyObject *s_{name} = NULL;")
+        if has_reloffset(struct.block.statements):
+            body.append("Py_ssize_t start = *offset;")
+        body.append("if (ctx == NULL) return NULL;")
+        body.append(self._gen_block(struct.block.statements, fields, params))
+        body.append("return ctx;")
+        this_block += self.indent("\n".join(body))
+        this_block += "\nfail:\n"
+        this_block += f"{self.indent_}Py_DECREF(ctx);\n"
+        this_block += f"{self.indent_}return NULL;\n"
+        this_block += "}\n"
+        return this_block
+
+    def _gen_wrapper(self, struct: ast_.Struct) -> str:
+        name = struct.name
+        this_block = f"static PyObject *py_parse{name}(PyObject *self, PyObject *args) {{\n"
+        body = [
+            "Py_buffer view;",
+            "Py_ssize_t offset = 0;",
+            "PyObject *result, *out;",
+        ]
+        for param in struct.params:
+            body.append(f"number p_{param.name};")
+        # parameters are positional after the offset, like parse<Struct> in Python
+        format_ = "y*n" + "O&" * len(struct.params) if struct.params else "y*|n"
+        pointers = "".join(f", to_number, &p_{param.name}" for param in struct.params)
+        body.append(f"if (!PyArg_ParseTuple(args, \"{format_}\", &view, &offset{pointers})) return NULL;")
+        arguments = "".join(f", p_{param.name}" for param in struct.params)
+        body.append(f"result = parse{name}((const unsigned char *)view.buf, view.len, &offset{arguments});")
+        body.append("PyBuffer_Release(&view);")
+        body.append("if (result == NULL) return NULL;")
+        body.append("out = Py_BuildValue(\"(Nn)\", result, offset);")
+        body.append("return out;")
+        this_block += self.indent("\n".join(body))
+        this_block += "\n}\n"
+        return this_block
+
+    def generate(self) -> str:
+        structs = [item for item in self.program.items if isinstance(item, ast_.Struct)]
+        result = f"#define LITTLE {1 if self.endian == 'little' else 0}\n" + PRECODE
+        body = ""
+        for struct in structs:
+            body += self._gen_struct(struct) + "\n"
+            body += self._gen_wrapper(struct) + "\n"
+        for key in self.keys.values():
+            result += f"static PyObject *{key};\n"
+        for struct in structs:
+            result += self._signature(struct) + ";\n"
+        result += "\n" + body
+        result += "static PyMethodDef methods[] = {\n"
+        for struct in structs:
+            result += f"{self.indent_}{{\"parse{struct.name}\", py_parse{struct.name}, METH_VARARGS, NULL}},\n"
+        result += f"{self.indent_}{{NULL, NULL, 0, NULL}}\n"
+        result += "};\n\n"
+        result += f"static struct PyModuleDef module = {{PyModuleDef_HEAD_INIT, \"{self.module_name}\", NULL, -1, methods}};\n\n"
+        result += f"PyMODINIT_FUNC PyInit_{self.module_name}(void) {{\n"
+        for name, key in self.keys.items():
+            result += f"{self.indent_}if (({key} = PyUnicode_InternFromString(\"{name}\")) == NULL) return NULL;\n"
+        result += f"{self.indent_}return PyModule_Create(&module);\n"
+        result += "}\n"
+        return result
+
+
+def build(ast_tree: ast_.Program, module_name: str, directory: str | None = None):
+    """Generates, compiles and imports a C extension module for `ast_tree`.
+
+    Uses the compiler Python itself was built with. Without `directory` the
+    sources are built in a temporary directory, removed once the module is
+    loaded. Raises `subprocess.CalledProcessError` when compilation fails
+    and `NotImplementedError` for constructs the C backend does not support.
+    """
+    source = CGenerator(ast_tree, module_name).generate()
+    if directory is None:
+        # a loaded extension does not need its file any more
+        with tempfile.TemporaryDirectory(prefix="spp_", ignore_cleanup_errors=True) as directory:
+            return _compile(source, module_name, directory)
+    return _compile(source, module_name, directory)
+
+def _compile(source: str, module_name: str, directory: str):
+    c_path = os.path.join(directory, module_name + ".c")
+    so_path = os.path.join(directory, module_name + sysconfig.get_config_var("EXT_SUFFIX"))
+    with open(c_path, "w") as file:
+        file.write(source)
+    command = shlex.split(sysconfig.get_config_var("CC") or "cc")
+    command += ["-O2", "-shared", "-fPIC", "-I" + sysconfig.get_paths()["include"], c_path, "-o", so_path]
+    if sys.platform == "darwin":
+        command += ["-undefined", "dynamic_lookup"]
+    subprocess.run(command, check=True, capture_output=True)
+    loader = importlib.machinery.ExtensionFileLoader(module_name, so_path)
+    spec = importlib.util.spec_from_file_location(module_name, so_path, loader=loader)
+    module = importlib.util.module_from_spec(spec) # type: ignore
+    loader.exec_module(module)
+    return module
@@ -1,73 +1,281 @@
 from . import ast_
+from .analysis import Analysis, PRIMITIVE_SIZES, bit_width, declarations, group_bits, group_size, has_reloffset, is_validation, pointer, reads, references, transform
+from dataclasses import replace
+from zlib import crc32
+import ast
+import re
 
 PRECODE = """
-from ctypes import c_uint8, c_uint16, c_uint32, c_int8, c_int16, c_int32, c_float, c_double
-from ast import literal_eval
+from ctypes import c_uint8, c_uint16, c_uint32, c_uint64, c_int8, c_int16, c_int32, c_int64, c_float, c_double
+from array import array
+from sys import byteorder
+from functools import wraps
+from itertools import repeat
+from threading import Lock
+from contextvars import ContextVar
+SPECIALIZATIONS = 256
+# large fixed-shape arrays are split over the executor set in the calling
+# context, EXECUTOR.set(pool); there is no other state shared between calls
+EXECUTOR = ContextVar('EXECUTOR', default=None)
+PARALLEL_MIN_BYTES = 1 << 16
+
+def specializations(build):
+    # keeps the SPECIALIZATIONS most recently used readers built by `build`,
+    # by argument tuple; the limit is read on every miss, so changing it on
+    # the module applies to later calls, and unhashable arguments like a
+    # struct value get a reader of their own that is not kept
+    readers = {}
+    lock = Lock()
+    @wraps(build)
+    def specialize(*arguments):
+        try:
+            hash(arguments)
+        except TypeError:
+            return build(*arguments)
+        with lock:
+            reader = readers.pop(arguments, None)
+            if reader is not None:
+                readers[arguments] = reader
+                return reader
+        reader = build(*arguments)
+        with lock:
+            readers[arguments] = reader
+            while readers and len(readers) > SPECIALIZATIONS:
+                del readers[next(iter(readers))]
+        return reader
+    specialize.readers = readers
+    return specialize
+
+# the byte order is fixed when the module is generated: readers and
+# writers never look it up, so ENDIAN is not a setting
 ENDIAN = 'little'
+ORDER = '__ctype_le__' if ENDIAN == 'little' else '__ctype_be__'
+SWAP = ENDIAN != byteorder
+UINT8, UINT16, UINT32, UINT64 = (getattr(type_, ORDER) for type_ in (c_uint8, c_uint16, c_uint32, c_uint64))
+INT8, INT16, INT32, INT64 = (getattr(type_, ORDER) for type_ in (c_int8, c_int16, c_int32, c_int64))
+FLOAT, DOUBLE = (getattr(type_, ORDER) for type_ in (c_float, c_double))
 
 def type_uint8(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_uint8.__ctype_le__ # type: ignore
-    else:
-        type_ = c_uint8.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 1
+    return UINT8.from_buffer_copy(data, offset), offset + 1
 
 def type_uint16(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_uint16.__ctype_le__ # type: ignore
-    else:
-        type_ = c_uint16.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 2
+    return UINT16.from_buffer_copy(data, offset), offset + 2
 
 def type_uint32(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_uint32.__ctype_le__ # type: ignore
-    else:
-        type_ = c_uint32.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 4
+    return UINT32.from_buffer_copy(data, offset), offset + 4
 
 def type_int8(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_int8.__ctype_le__ # type: ignore
-    else:
-        type_ = c_int8.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 1
+    return INT8.from_buffer_copy(data, offset), offset + 1
 
 def type_int16(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_int16.__ctype_le__ # type: ignore
-    else:
-        type_ = c_int16.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 2
+    return INT16.from_buffer_copy(data, offset), offset + 2
 
 def type_int32(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_uint32.__ctype_le__ # type: ignore
-    else:
-        type_ = c_uint32.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 4
+    return INT32.from_buffer_copy(data, offset), offset + 4
+
+def type_uint64(data, offset):
+    return UINT64.from_buffer_copy(data, offset), offset + 8
+
+def type_int64(data, offset):
+    return INT64.from_buffer_copy(data, offset), offset + 8
 
 def type_float(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_float.__ctype_le__ # type: ignore
-    else:
-        type_ = c_float.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 4
+    return FLOAT.from_buffer_copy(data, offset), offset + 4
 
 def type_double(data, offset):
-    if ENDIAN == 'little':
-        type_ = c_double.__ctype_le__ # type: ignore
+    return DOUBLE.from_buffer_copy(data, offset), offset + 8
+
+WRITERS = {
+    'uint8': UINT8, 'int8': INT8, 'uint16': UINT16, 'int16': INT16, 'uint32': UINT32,
+    'int32': INT32, 'uint64': UINT64, 'int64': INT64, 'float': FLOAT, 'double': DOUBLE,
+}
+
+def write_value(data, offset, type_name, value):
+    # fields are overwritten in place, so data has to be writable
+    # (bytearray, writable mmap or memoryview of one)
+    writer = WRITERS[type_name]
+    if type_name not in ('float', 'double') and writer(value).value != value:
+        raise ValueError(f"{value} does not fit in {type_name}")
+    writer.from_buffer(data, offset).value = value
+
+def write_bits(data, offset, size, shift, width, value, endian):
+    # `endian` comes from the tables generated with the readers
+    if not 0 <= value < 1 << width:
+        raise ValueError(f"{value} does not fit in {width} bits")
+    if offset + size > len(data):
+        raise ValueError(f"Data ends inside the bit field at offset {offset}")
+    word = int.from_bytes(data[offset:offset + size], endian)
+    word = word & ~((1 << width) - 1 << shift) | value << shift
+    data[offset:offset + size] = word.to_bytes(size, endian)
+
+def write_bytes(data, offset, length, value):
+    # the length is checked first: a bytearray would grow or shrink instead
+    if len(value) != length:
+        raise ValueError(f"{len(value)} bytes do not replace a field of {length}")
+    if offset + length > len(data):
+        raise ValueError(f"Data ends inside the field at offset {offset}")
+    data[offset:offset + length] = value
+
+def patch_field(data, offset, table, struct, path, value):
+    # `table` holds the fields of `struct` whose position does not depend
+    # on the data; nested structs continue with their own patch function,
+    # which also writes with their own module's byte order
+    name, _, rest = path.partition('.')
+    if name not in table:
+        raise KeyError(f"{struct}.{name} has no static offset")
+    at, kind, type_name, extra = table[name]
+    at += offset
+    if kind in ('array', 'structs'):
+        index, _, rest = rest.partition('.')
+        if not index.isdigit():
+            raise KeyError(f"{struct}.{name} is an array, the path needs an index")
+        if int(index) >= extra[0]:
+            raise IndexError(f"{struct}.{name} has {extra[0]} elements, not {int(index) + 1}")
+        at += int(index) * extra[1]
+    if kind in ('struct', 'structs'):
+        return globals()['patch' + type_name](data, at, rest, value)
+    if rest:
+        raise KeyError(f"{struct}.{name} has no field {rest!r}")
+    if kind in ('value', 'array'):
+        write_value(data, at, type_name, value)
+    elif kind == 'bits':
+        write_bits(data, at, extra[2], extra[0], extra[1], value, extra[3])
+    else:
+        write_bytes(data, at, extra, value)
+    return at
+
+class TruncatedError(ValueError):
+    def __init__(self, struct, field, offset):
+        super().__init__(f"Data ends inside {struct}.{field} (field starts at offset {offset})")
+        self.struct = struct
+        self.field = field
+        self.offset = offset
+
+def truncated(struct, fields, offset, length):
+    # only runs once a hoisted check failed: find the first field that does not fit
+    for field, field_size in fields:
+        if offset + field_size > length:
+            break
+        offset += field_size
+    return TruncatedError(struct, field, offset)
+
+TYPECODES = {
+    'uint8': 'B', 'int8': 'b', 'uint16': 'H', 'int16': 'h',
+    'uint32': 'I' if array('I').itemsize == 4 else 'L',
+    'int32': 'i' if array('i').itemsize == 4 else 'l',
+    'uint64': 'Q', 'int64': 'q', 'float': 'f', 'double': 'd',
+}
+
+def type_bulk(data, offset, type_name, array_size):
+    # whole primitive arrays are copied and byte-swapped in C
+    # bounds are checked by the caller
+    arr = array(TYPECODES[type_name])
+    n = arr.itemsize * max(0, array_size)
+    arr.frombytes(data[offset:offset+n])
+    if SWAP:
+        arr.byteswap()
+    return arr, offset + n
+
+def type_bytes(data, offset, array_size):
+    n = max(0, array_size)
+    return data[offset:offset+n], offset + n
+
+def find(data, pattern, start):
+    # bytes, bytearray and mmap search in C; buffers without find, like a
+    # memoryview, are copied a growing window at a time
+    if hasattr(data, 'find'):
+        return data.find(pattern, start)
+    window = 256
+    while start < len(data):
+        stop = min(len(data), start + window)
+        found = bytes(data[start:stop]).find(pattern)
+        if found >= 0:
+            return start + found
+        if stop == len(data):
+            break
+        # a match may straddle the end of the window
+        start = stop - len(pattern) + 1
+        window *= 2
+    return -1
+
+def type_until(data, offset, type_name, terminator, struct, field):
+    # the terminator is located with one C-level find instead of decoding
+    # element by element; it is consumed but not part of the value
+    if isinstance(terminator, str):
+        pattern = terminator.encode('latin-1')
+    elif type_name == 'bytes':
+        pattern = bytes([terminator])
+    else:
+        pattern = array(TYPECODES[type_name], [terminator])
+        if SWAP:
+            pattern.byteswap()
+        pattern = pattern.tobytes()
+    step = 1 if type_name == 'bytes' else array(TYPECODES[type_name]).itemsize
+    end = find(data, pattern, offset)
+    while end >= 0 and (end - offset) % step:
+        end = find(data, pattern, end + 1)
+    if end < 0:
+        raise TruncatedError(struct, field, offset)
+    if type_name == 'bytes':
+        return data[offset:end], end + len(pattern)
+    return type_bulk(data, offset, type_name, (end - offset) // step)[0], end + len(pattern)
+
+class Lazy:
+    # a field decoded on first use, then cached; indexing, iteration, len()
+    # and attributes like `.value` go to the decoded value, resolve() returns
+    # it, and decoding errors surface on first use; threads resolving it at
+    # the same time may both decode, but never see it half resolved
+    __slots__ = ('pending', 'offset', 'decoded')
+
+    def __init__(self, function, data, offset, ctx, extras):
+        self.pending = (function, data, ctx, extras)
+        self.offset = offset
+        self.decoded = None
+
+    def resolve(self):
+        pending = self.pending
+        if pending is not None:
+            function, data, ctx, extras = pending
+            self.decoded = function(data, self.offset, ctx, extras)
+            self.pending = None
+        return self.decoded
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+    def __repr__(self):
+        if self.pending is not None:
+            return f"<Lazy at offset {self.offset}>"
+        return repr(self.decoded)
+
+def inflate(codec, data, offset, length, limit, struct, field):
+    # the compressed bytes are read through a memoryview instead of copied;
+    # `limit` stops once the part of the output the field needs is there
+    if codec == 'zlib':
+        from zlib import decompressobj, error, MAX_WBITS
+        decompressor = decompressobj(MAX_WBITS | 32) # zlib or gzip header
+        limit = limit or 0
     else:
-        type_ = c_double.__ctype_be__ # type: ignore
-    obj = type_.from_buffer_copy(data, offset)
-    return obj, offset + 8
+        from lzma import LZMADecompressor, LZMAError as error
+        decompressor = LZMADecompressor()
+        limit = limit or -1
+    try:
+        with memoryview(data) as view, view[offset:offset + length] as compressed:
+            return decompressor.decompress(compressed, limit)
+    except error as exception:
+        raise ValueError(f"Cannot decompress {struct}.{field} at offset {offset}: {exception}") from None
+
+def no_case(data, offset, ctx, extras):
+    return offset
 
 def type_array(data, offset, function, array_size, function_args):
     arr = []
@@ -76,19 +284,172 @@ def type_array(data, offset, function, array_size, function_args):
         arr.append(val)
     return arr, offset
 
-def size(data, offset, bytes_):
-    n = int(literal_eval(bytes_[:-1]))
+def type_array_fixed(data, offset, function, array_size, function_args, detached=False):
+    # every element has the same size, so once the first one is decoded the
+    # rest can be split into independent chunks for EXECUTOR; a `detached`
+    # array is not waited for: the parse goes on past it while the chunks
+    # decode, and the statements reading it settle() it first
+    if array_size <= 0:
+        return [], offset
+    first, end = function(data, offset, *function_args)
+    element_size = end - offset
+    total = element_size * (array_size - 1)
+    executor = EXECUTOR.get()
+    if executor is None or element_size <= 0 or total < PARALLEL_MIN_BYTES:
+        arr, end = type_array(data, end, function, array_size - 1, function_args)
+        arr.insert(0, first)
+        return arr, end
+    per_chunk = max(1, PARALLEL_MIN_BYTES // element_size)
+    # specialized readers are closures, workers rebuild them from their arguments
+    target = getattr(function, 'specialization', function)
+    futures = []
+    for start in range(1, array_size, per_chunk):
+        count = min(per_chunk, array_size - start)
+        begin = offset + start * element_size
+        chunk = data[begin:begin + count * element_size]
+        futures.append(executor.submit(type_array_chunk, chunk, target, count, function_args))
+    if detached:
+        return Lazy(collect_chunks, futures, 0, first, None), offset + element_size * array_size
+    arr = [first]
+    for future in futures:
+        arr.extend(future.result())
+    return arr, offset + element_size * array_size
+
+def collect_chunks(futures, offset, first, extras):
+    # the elements of a detached array, in the shape of a Lazy function
+    arr = [first]
+    for future in futures:
+        arr.extend(future.result())
+    return arr
+
+def settle(value):
+    return value.resolve() if isinstance(value, Lazy) else value
+
+def type_array_chunk(data, function, array_size, function_args):
+    # nested arrays are decoded inline, workers never wait on their own pool
+    if isinstance(function, tuple):
+        specialize, arguments = function
+        function = specialize(*arguments)
+    token = EXECUTOR.set(None)
+    try:
+        return type_array(data, 0, function, array_size, function_args)[0]
+    finally:
+        EXECUTOR.reset(token)
+
+def skip_array(data, offset, function, array_size, function_args):
+    for _ in range(array_size):
+        offset = function(data, offset, *function_args)[1]
+    return offset
+
+def skip_array_fixed(data, offset, function, array_size, function_args):
+    if array_size <= 0:
+        return offset
+    end = function(data, offset, *function_args)[1]
+    return offset + (end - offset) * array_size
+
+def size(data, offset, n):
     val = data[offset:offset+n]
     return val, offset + n
 
 """.lstrip()
 
+INSTRUMENT = """
+from time import perf_counter
+FIELD_STATS = {}
+
+def record(field, probe, offset):
+    # calls, inclusive seconds and bytes consumed per field
+    stats = FIELD_STATS.get(field)
+    if stats is None:
+        stats = FIELD_STATS[field] = [0, 0.0, 0]
+    stats[0] += 1
+    stats[1] += perf_counter() - probe[0]
+    stats[2] += offset - probe[1]
+
+"""
+
+# generated lines end with "  # spp:line:column Struct.field"
+MARKER = "  # spp:"
+
+LOGICAL = {"&&": " and ", "||": " or "}
+
+def runtime_chunks(source: str) -> list[tuple[set[str], set[str], str]]:
+    """Top-level statements of `source` as (names defined, names used, text).
+
+    Comments and blank lines above a statement belong to it.
+    """
+    lines = source.split("\n")
+    chunks = []
+    start = 0
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            defined = {alias.asname or alias.name.split(".")[0] for alias in node.names}
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            defined = {node.name}
+        else:
+            defined = {name.id for target in getattr(node, "targets", ()) for name in ast.walk(target) if isinstance(name, ast.Name)}
+        used = {name.id for name in ast.walk(node) if isinstance(name, ast.Name)} - defined
+        chunks.append((defined, used, "\n".join(lines[start:node.end_lineno]) + "\n"))
+        start = node.end_lineno
+    return chunks
+
+RUNTIME = runtime_chunks(PRECODE)
+INSTRUMENT_RUNTIME = runtime_chunks(INSTRUMENT)
+# settings callers change on the module are emitted even when unused
+SETTINGS = {"SPECIALIZATIONS", "EXECUTOR", "PARALLEL_MIN_BYTES"}
+# functions generated next to parse<Struct> when asked for: parse<Struct>_batch,
+# skip<Struct>, arena<Struct> with layout<Struct>, offsets<Struct> with patch<Struct>
+VARIANTS = ("batch", "skip", "arena", "patch")
+
 class Generator:
-    def __init__(self, ast_tree: ast_.Program):
+    # if/elif chains on one value with at least this many branches become a
+    # dict lookup; below it plain comparisons are cheaper than a call
+    DISPATCH_MIN = 4
+
+    def __init__(self, ast_tree: ast_.Program, instrument: bool = False, external: dict[str, set[str]] | None = None,
+                 extra: dict[str, list[ast_.Expression]] | None = None, variants=()):
         self.program = ast_tree
+        # every struct gets parse<Struct>, the VARIANTS only when listed, so
+        # modules that only parse stay small; arena functions call the skip ones
+        self.variants = set(variants)
+        for variant in self.variants - set(VARIANTS):
+            raise ValueError(f"Unknown variant {variant!r}, expected one of {', '.join(VARIANTS)}")
+        if "arena" in self.variants:
+            self.variants.add("skip")
+        # structs generated in another module, with the fields their skip
+        # functions keep; they are called but not emitted
+        self.external = external or {}
         self.functions = {}
+        self.analysis = Analysis(ast_tree)
         self.load_functions()
-        self.result = PRECODE
+        self.endian = 'little'
+        for statement in ast_tree.items:
+            if isinstance(statement, ast_.SpecialGlobal) and statement.name == "endian":
+                self.endian = statement.arg
+        # instrumented modules time every field into FIELD_STATS
+        self.instrument = instrument
+        # runtime names looked up by name rather than called by generated
+        # code: the readers and writers of the fields in arena layouts
+        self.runtime_names = set()
+        self.hoisted = None
+        # expressions evaluated against a struct's result from outside, like
+        # a query predicate: skip functions keep the fields they read
+        self.needed = self.analysis.needed_fields({name: expressions for name, expressions in (extra or {}).items()
+                                                   if name in self.analysis.structs})
+        self.skip = False
+        # arena functions are skip functions that also record a row per field
+        self.arena = False
+        # batch functions call the readers through locals bound once per call,
+        # `batch_locals` maps those names to what they are bound to
+        self.batch = False
+        self.batch_locals = {}
+        self.length = "len(data)"
+        self.field_ids = {}
+        self.needed_here = set()
+        self.struct_name = ""
+        self.helpers = []
+        self.tables = {}
+        self.cases = 0
         self.depth = 0
         self.indent_ = "    "
         
@@ -100,43 +461,119 @@ class Generator:
                 parameters = tuple(param.name for param in statement.params)
                 self.functions[name] = parameters
     
+    def update(self, structs: dict[str, ast_.Struct | None]) -> None:
+        """Swaps in edited structs, None removes one, to generate them again with generate_item.
+
+        The caller keeps `needed` up to date.
+        """
+        self.analysis.update(structs)
+        for name, struct in structs.items():
+            if struct is None:
+                self.functions.pop(name, None)
+            else:
+                self.functions[name] = tuple(param.name for param in struct.params)
+
+    def _hoist(self, name, code, extras, expressions) -> str | None:
+        # while generating a specialization, values that only depend on the
+        # struct parameters are computed once per argument tuple
+        if self.hoisted is None:
+            return None
+        for expression in expressions:
+            if not references(expression) <= set(extras):
+                return None
+        names = {hoisted_name for hoisted_name, _ in self.hoisted}
+        unique = name
+        index = 1
+        while unique in names:
+            index += 1
+            unique = f"{name}_{index}"
+        self.hoisted.append((unique, code))
+        return unique
+
+    def _name(self, kind: str, struct: str) -> str:
+        # skip functions mirror the parse ones but only keep needed fields
+        if self.skip and self.needed[struct] <= self.external.get(struct, self.needed[struct]):
+            return {"parse": "skip", "specialize": "specializeSkip", "read": "readSkip"}[kind] + struct
+        return kind + struct
+
     def indent(self, text, depth=1):
         return depth*self.indent_ + text.replace('\n','\n'+depth*self.indent_)
     
     def _gen_statement(self, statement: ast_.Statement, extras, certains: list, certain = False):
         if isinstance(statement, ast_.DeclareStatement):
-            this_block = ""
+            if pointer(statement) is not None:
+                return self._gen_lazy(statement, extras, certains, certain)
+            if transform(statement) is not None:
+                return self._gen_transform(statement, extras, certains, certain)
             callable_ = ""
             call_arguments = ["data", "offset"]
             if isinstance(statement.type, ast_.Size):
                 callable_ = "size"
-                call_arguments.append(f"'{statement.type.value.raw}'")
+                call_arguments.append(str(int(statement.type.value.raw[:-1], 0)))
             elif isinstance(statement.type, ast_.RegularSize):
                 callable_ = f"type_{statement.type.value}"
+                if self.batch and statement.array_size is None:
+                    type_name = statement.type.value
+                    self.batch_locals[f"read_{type_name}"] = f"{type_name.upper()}.from_buffer_copy"
+                    if certain:
+                        certains.append(statement.name.name)
+                    return f"ctx['{statement.name.name}'] = read_{type_name}(data, offset)\noffset += {PRIMITIVE_SIZES[type_name]}"
+            elif isinstance(statement.type, ast_.Bytes):
+                if statement.array_size is None:
+                    raise ValueError(f"bytes field {statement.name.name!r} needs a length or terminator (at {statement.pos})")
+                callable_ = "type_bytes"
             elif isinstance(statement.type, ast_.Identifier):
                 parameters = self.functions[statement.type.name]
-                if isinstance(statement.default, ast_.CallExpression) and len(parameters) > 0:
-                    arguments = (self._gen_expression(argument, extras, certains) for argument in statement.default.args)
-                    this_block = "sub_ctx = {\n"
-                    for parameter, argument in zip(parameters, arguments):
-                        this_block += f"{self.indent_}'{parameter}':{argument},\n"
-                    this_block += "}"
-                    callable_ = f"parse{statement.type.name}"
-                    call_arguments.append("sub_ctx")
-                else:
-                    callable_ = f"parse{statement.type.name}"
+                if isinstance(self.analysis.structs[statement.type.name].block, ast_.CodeBlock):
+                    # code structs are written by hand against (data, offset, extras)
+                    callable_ = self._name("parse", statement.type.name)
                     call_arguments.append("{}")
-            if this_block:
-                result_ = this_block+"\n"+f"ctx['{statement.name.name}'], offset = "
-            else:
-                result_ = f"ctx['{statement.name.name}'], offset = "
-            if statement.array_size is not None:
+                elif len(parameters) > 0:
+                    args = self._call_arguments(statement, parameters)
+                    arguments = [self._gen_expression(argument, extras, certains) for argument in args]
+                    callable_ = f"{self._name('specialize', statement.type.name)}({', '.join(arguments)})"
+                    hoisted = self._hoist(f"read_{statement.name.name}", callable_, extras, args)
+                    if hoisted is not None:
+                        callable_ = hoisted
+                else:
+                    self._call_arguments(statement, parameters)
+                    callable_ = self._name("parse", statement.type.name)
+            if self.skip and statement.name.name not in self.needed_here:
+                return self._gen_skip(statement, callable_, call_arguments[2:], extras, certains)
+            result_ = f"ctx['{statement.name.name}'], offset = "
+            if isinstance(statement.array_size, ast_.Until):
+                result_ += self._gen_until(statement, extras, certains)
+            elif statement.array_size is not None:
                 if len(call_arguments) == 3:
                     call_arguments.append("")
                 call_arguments = ", ".join(call_arguments[2:]).strip()
                 call_arguments = "("+call_arguments+")"
-                size_ = self._gen_expression(statement.array_size, extras, certains)
-                result_ += f"type_array(data, offset, {callable_}, int({size_}), {call_arguments})"
+                size_ = f"int({self._gen_expression(statement.array_size, extras, certains)})"
+                hoisted = self._hoist(f"count_{statement.name.name}", size_, extras, (statement.array_size,))
+                if hoisted is not None:
+                    size_ = hoisted
+                element = self._element_size(statement)
+                if element is not None and self.analysis.static_size(statement) is None:
+                    # one check for the whole array instead of one per element
+                    check = ""
+                    if hoisted is None:
+                        check = f"count = {size_}\n"
+                        size_ = "count"
+                    check += f"if offset + {element} * {size_} > {self.length}:\n"
+                    check += f"{self.indent_}raise TruncatedError('{self.struct_name}', '{statement.name.name}', offset)\n"
+                    result_ = check + result_
+                array_ = "type_array"
+                if isinstance(statement.type, ast_.Identifier) and self.analysis.fixed_shape(statement.type.name) \
+                        and not self.analysis.points(statement.type.name):
+                    array_ = "type_array_fixed"
+                if self._detached(statement, certain):
+                    call_arguments += ", True"
+                if isinstance(statement.type, ast_.RegularSize):
+                    result_ += f"type_bulk(data, offset, '{statement.type.value}', {size_})"
+                elif isinstance(statement.type, ast_.Bytes):
+                    result_ += f"type_bytes(data, offset, {size_})"
+                else:
+                    result_ += f"{array_}(data, offset, {callable_}, {size_}, {call_arguments})"
             else:
                 call_arguments = ", ".join(call_arguments).strip()
                 call_arguments = "("+call_arguments+")"
@@ -146,11 +583,316 @@ class Generator:
             return result_
         elif isinstance(statement, ast_.IfThenElse):
             return self._gen_condition(statement, extras, certains)
+        elif isinstance(statement, ast_.Switch):
+            return self._gen_switch(statement, extras, certains, certain)
         elif isinstance(statement, ast_.RaiseStmt):
             return f"raise ValueError({statement.message.value})"
         print("E: ",statement)
         return ""
     
+    def _call_arguments(self, statement: ast_.DeclareStatement, parameters) -> list[ast_.Expression]:
+        # a struct field passes exactly the parameters of its struct, so the
+        # generated call can take them positionally
+        args = statement.default.args if isinstance(statement.default, ast_.CallExpression) else []
+        if len(args) != len(parameters):
+            raise ValueError(f"{statement.type.name} takes {len(parameters)} argument(s), "
+                             f"{statement.name.name!r} passes {len(args)} (at {statement.pos})")
+        return args
+
+    def _gen_statements(self, statements, extras, certains: list, certain = False) -> list[str]:
+        generated = []
+        grouped = group_bits(statements)
+        checks = {}
+        batched = {}
+        deferred = set()
+        for start, stop, fields in self._runs(grouped):
+            checks[start] = self._gen_check(fields)
+            # reads inside a run cannot fail, so its validations can all wait
+            # for the end of the run and share one combined test; a nested
+            # struct runs its own checks, so the ones above it cannot wait
+            # past it without changing which error comes first
+            validations = []
+            for index in range(start, stop + 1):
+                statement = grouped[index] if index < stop else None
+                if statement is None or (isinstance(statement, ast_.DeclareStatement)
+                                         and isinstance(statement.type, ast_.Identifier)
+                                         and pointer(statement) is None and transform(statement) is None):
+                    if len(validations) > 1:
+                        batched[index] = [grouped[validation] for validation in validations]
+                        deferred.update(validations)
+                    validations = []
+                elif is_validation(statement):
+                    validations.append(index)
+        # detached arrays that may still be decoding, see _detached
+        detached = set()
+        def settle(statements):
+            waiting = set()
+            for statement in statements:
+                waiting |= detached & reads(statement)
+            detached.difference_update(waiting)
+            return "\n".join(f"ctx['{name}'] = settle(ctx['{name}'])" for name in sorted(waiting))
+        for index, statement in enumerate(grouped + [None]):
+            if index in batched:
+                generated.append(self._mark(settle(batched[index]), batched[index][0]))
+                generated.append(self._mark(self._gen_validations(batched[index], extras, certains), batched[index][0]))
+            if statement is None:
+                break
+            if index in checks:
+                generated.append(self._mark(checks[index], statement))
+            if index in deferred:
+                continue
+            if not isinstance(statement, list):
+                generated.append(self._mark(settle([statement]), statement))
+                if self._detached(statement, certain):
+                    detached.add(statement.name.name)
+            if self.arena and isinstance(statement, (list, ast_.DeclareStatement)):
+                code = self._gen_row(statement, extras, certains, certain)
+            elif isinstance(statement, list):
+                code = self._gen_bits(statement, certains, certain)
+            else:
+                code = self._gen_statement(statement, extras, certains, certain)
+            # fields decoded out of line are timed once, in the helper that
+            # decodes them, not also when their Lazy is made
+            deferred_field = isinstance(statement, ast_.DeclareStatement) \
+                and (pointer(statement) is not None or transform(statement) is not None)
+            if self.instrument and code and isinstance(statement, (list, ast_.DeclareStatement, ast_.Switch)) \
+                    and not deferred_field:
+                code = self._gen_probe(statement, code)
+            generated.append(self._mark(code, statement))
+        return [statement for statement in generated if statement]
+
+    def _mark(self, code: str, statement) -> str:
+        # every line names the .spp position it comes from, unless a nested
+        # statement already gave it its own
+        if isinstance(statement, list):
+            statement = statement[0]
+        name = self.struct_name
+        if isinstance(statement, (ast_.DeclareStatement, ast_.Switch)):
+            name += "." + statement.name.name
+        marker = f"{MARKER}{statement.pos[0]}:{statement.pos[1]} {name}"
+        return "\n".join(line if not line.strip() or MARKER in line else line + marker for line in code.split("\n"))
+
+    def _gen_probe(self, statement, code: str) -> str:
+        if isinstance(statement, list):
+            name = "/".join(declaration.name.name for declaration in statement)
+        else:
+            name = statement.name.name
+        return f"probe = perf_counter(), offset\n{code}\nrecord('{self.struct_name}.{name}', probe, offset)"
+
+    def _gen_validations(self, validations: list[ast_.IfThenElse], extras, certains: list) -> str:
+        conditions = [self._gen_expression(validation.if_.condition, extras, certains) for validation in validations]
+        this_block = f"if {' or '.join(conditions)}:\n"
+        for validation, condition in zip(validations, conditions):
+            this_block += self.indent(self._mark(f"if {condition}:", validation)) + "\n"
+            this_block += self.indent(self._gen_branch(validation.if_.statements, extras, certains).rstrip("\n")) + "\n"
+        return this_block.rstrip("\n")
+
+    def _runs(self, grouped) -> list[tuple[int, int, list]]:
+        # statically sized fields in a row get one bounds check up front;
+        # validation-only ifs do not read, so they do not end a run
+        runs = []
+        start = None
+        fields = []
+        for index, statement in enumerate(grouped + [None]):
+            field = None
+            transparent = False
+            if isinstance(statement, list):
+                field = ("/".join(declaration.name.name for declaration in statement), group_size(statement))
+            elif isinstance(statement, ast_.DeclareStatement) and pointer(statement) is not None:
+                transparent = True
+            elif isinstance(statement, ast_.DeclareStatement):
+                size = self.analysis.static_size(statement)
+                if size is not None:
+                    field = (statement.name.name, size)
+            elif isinstance(statement, ast_.IfThenElse):
+                transparent = not declarations([statement])
+            if field is not None:
+                if start is None:
+                    start = index
+                fields.append(field)
+            elif not transparent:
+                if fields:
+                    runs.append((start, index, fields))
+                start = None
+                fields = []
+        return runs
+
+    def _gen_check(self, fields) -> str:
+        total = sum(size for _, size in fields)
+        this_block = f"if offset + {total} > {self.length}:\n"
+        this_block += f"{self.indent_}raise truncated('{self.struct_name}', {tuple(fields)!r}, offset, {self.length})"
+        return this_block
+
+    def _gen_bits(self, group: list[ast_.DeclareStatement], certains: list, certain = False) -> str:
+        # adjacent bit fields share one word read; the first field takes the
+        # low bits for little endian and the high bits for big endian
+        size = group_size(group)
+        names = [declaration.name.name for declaration in group]
+        if self.skip and not set(names) & self.needed_here:
+            return f"offset += {size}"
+        from_bytes = "int.from_bytes"
+        if self.batch:
+            from_bytes = "from_bytes"
+            self.batch_locals[from_bytes] = "int.from_bytes"
+        this_block = f"bits = {from_bytes}(data[offset:offset+{size}], '{self.endian}')\n"
+        shift = 0 if self.endian == 'little' else size * 8
+        for declaration in group:
+            name = declaration.name.name
+            width = bit_width(declaration)
+            if declaration.array_size is not None:
+                raise ValueError(f"Bit field {name!r} cannot be an array (at {declaration.pos})")
+            if not 0 < width <= 64:
+                raise ValueError(f"Bit field {name!r} must be 1 to 64 bits wide (at {declaration.pos})")
+            if self.endian != 'little':
+                shift -= width
+            ctype = bits_ctype(width)
+            if self.batch:
+                self.batch_locals["new_" + ctype] = ctype
+                ctype = "new_" + ctype
+            value = f"bits >> {shift} & {hex((1 << width) - 1)}" if shift else f"bits & {hex((1 << width) - 1)}"
+            if not self.skip or name in self.needed_here:
+                this_block += f"ctx['{name}'] = {ctype}({value})\n"
+            if self.endian == 'little':
+                shift += width
+            if certain:
+                certains.append(name)
+        this_block += f"offset += {size}"
+        return this_block
+
+    def _gen_until(self, statement: ast_.DeclareStatement, extras, certains) -> str:
+        if isinstance(statement.type, ast_.Bytes):
+            type_name = "bytes"
+        elif isinstance(statement.type, ast_.RegularSize) and statement.type.value in ("float", "double"):
+            raise ValueError(f"Array {statement.name.name!r} of floating point values cannot end with a terminator (at {statement.pos})")
+        elif isinstance(statement.type, ast_.RegularSize):
+            type_name = statement.type.value
+        else:
+            raise ValueError(f"Only bytes and integer arrays can end with a terminator, not {statement.name.name!r} (at {statement.pos})")
+        terminator = self._gen_expression(statement.array_size.value, extras, certains)
+        return f"type_until(data, offset, '{type_name}', {terminator}, '{self.struct_name}', '{statement.name.name}')"
+
+    def _gen_lazy(self, statement: ast_.DeclareStatement, extras, certains: list, certain = False) -> str:
+        # the position is computed while parsing, the field is only decoded
+        # when its Lazy is first used
+        name = statement.name.name
+        if self.skip and name not in self.needed_here:
+            return ""
+        annotation = pointer(statement)
+        if len(annotation.args) != 1:
+            raise ValueError(f"@{annotation.name} of {name!r} takes one argument (at {annotation.pos})")
+        position = f"int({self._gen_expression(annotation.args[0], extras, certains)})"
+        if annotation.name == "reloffset":
+            position = f"start + {position}"
+        if (id(statement), self.skip) not in self.tables:
+            inline = replace(statement, annotations=[other for other in statement.annotations if other is not annotation])
+            self.tables[id(statement), self.skip] = self._gen_helper("_lazy", [inline], extras, certains, f"ctx['{name}']")
+        result_ = f"ctx['{name}'] = Lazy({self.tables[id(statement), self.skip]}, data, {position}, ctx, {'extras' if extras else 'None'})"
+        if certain:
+            certains.append(name)
+        return result_
+
+    def _gen_transform(self, statement: ast_.DeclareStatement, extras, certains: list, certain = False) -> str:
+        # the compressed bytes are skipped now; decompressing and decoding
+        # waits for the first use of the field
+        name = statement.name.name
+        annotation = transform(statement)
+        if len(annotation.args) != 1:
+            raise ValueError(f"@{annotation.name} of {name!r} takes one argument (at {annotation.pos})")
+        length = f"int({self._gen_expression(annotation.args[0], extras, certains)})"
+        if self.skip and name not in self.needed_here:
+            return f"offset += {length}"
+        if (id(statement), self.skip) not in self.tables:
+            inline = replace(statement, annotations=[other for other in statement.annotations if other is not annotation])
+            limit = self.analysis.static_size(inline)
+            prelude = f"data = inflate('{annotation.name}', data, offset, {length}, {limit}, '{self.struct_name}', '{name}')\n"
+            prelude += "offset = 0"
+            self.tables[id(statement), self.skip] = self._gen_helper(f"_{annotation.name}", [inline], extras, certains, f"ctx['{name}']", prelude)
+        result_ = ""
+        if self.analysis.static_size(statement) is None:
+            result_ += f"count = {length}\n"
+            result_ += f"if offset + count > {self.length}:\n"
+            result_ += f"{self.indent_}raise TruncatedError('{self.struct_name}', '{name}', offset)\n"
+            length = "count"
+        result_ += f"ctx['{name}'] = Lazy({self.tables[id(statement), self.skip]}, data, offset, ctx, {'extras' if extras else 'None'})\n"
+        result_ += f"offset += {length}"
+        if certain:
+            certains.append(name)
+        return result_
+
+    def _detached(self, statement, certain: bool) -> bool:
+        # an array of structs that can neither fail nor run out of data once
+        # its bounds are checked, declared at the top level of its struct, is
+        # decoded alongside the fields after it up to the first one reading it
+        return certain and not (self.batch or self.skip or self.arena or self.instrument) \
+            and isinstance(statement, ast_.DeclareStatement) and isinstance(statement.type, ast_.Identifier) \
+            and statement.array_size is not None and not isinstance(statement.array_size, ast_.Until) \
+            and pointer(statement) is None and transform(statement) is None \
+            and self._element_size(statement) is not None and not self.analysis.points(statement.type.name) \
+            and not self.analysis.raises(statement.type.name)
+
+    def _element_size(self, statement: ast_.DeclareStatement) -> int | None:
+        if isinstance(statement.type, ast_.Bytes):
+            return 1
+        if isinstance(statement.type, ast_.RegularSize):
+            return PRIMITIVE_SIZES[statement.type.value]
+        if isinstance(statement.type, ast_.Size):
+            return int(statement.type.value.raw[:-1], 0)
+        if isinstance(statement.type, ast_.Identifier) and not self.functions[statement.type.name]:
+            return self.analysis.static_size(statement.type.name)
+        return None
+
+    def _gen_skip(self, statement: ast_.DeclareStatement, callable_, call_arguments, extras, certains) -> str:
+        size = self.analysis.static_size(statement)
+        if size is not None:
+            return f"offset += {size}"
+        if statement.array_size is None:
+            arguments = "".join(f", {argument}" for argument in call_arguments)
+            return f"offset = {callable_}(data, offset{arguments})[1]"
+        if isinstance(statement.array_size, ast_.Until):
+            return f"offset = {self._gen_until(statement, extras, certains)}[1]"
+        count = f"int({self._gen_expression(statement.array_size, extras, certains)})"
+        hoisted = self._hoist(f"count_{statement.name.name}", count, extras, (statement.array_size,))
+        if hoisted is not None:
+            count = hoisted
+        element = self._element_size(statement)
+        if element is not None:
+            return f"offset += {element} * max(0, {count})"
+        array_ = "skip_array"
+        if self.analysis.fixed_shape(statement.type.name):
+            array_ = "skip_array_fixed"
+        arguments = "(" + "".join(f"{argument}, " for argument in call_arguments).rstrip(" ") + ")"
+        return f"offset = {array_}(data, offset, {callable_}, {count}, {arguments})"
+
+    def _gen_body(self, struct: ast_.Struct, extras, depth=1) -> str:
+        self.struct_name = struct.name
+        this_block = ""
+        certains = []
+        pending = 0
+        if has_reloffset(struct.block.statements):
+            this_block += self.indent("start = offset", depth) + "\n"
+        for statement in self._gen_statements(struct.block.statements, extras, certains, True):
+            # runs of statically sized skips collapse into one addition
+            code = statement.split(MARKER)[0]
+            if code.startswith("offset += ") and code[10:].isdigit():
+                pending += int(code[10:])
+                continue
+            lines = statement.split("\n")
+            if self.batch and len(lines) == 2 and " = read_" in code and code.endswith("(data, offset)"):
+                # and so do the reads of a batch function, at constant displacements
+                advance = lines[1].split(MARKER)[0]
+                if pending:
+                    lines[0] = lines[0].replace("(data, offset)", f"(data, offset + {pending})", 1)
+                this_block += self.indent(lines[0], depth) + "\n"
+                pending += int(advance[10:])
+                continue
+            if pending:
+                this_block += self.indent(f"offset += {pending}", depth) + "\n"
+                pending = 0
+            this_block += self.indent(statement, depth) + "\n"
+        if pending:
+            this_block += self.indent(f"offset += {pending}", depth) + "\n"
+        return this_block
+
     def _gen_expression(self, expression: ast_.Expression, extras = None, certains = None, return_certain = False) -> str:
         if isinstance(expression, ast_.Identifier):
             if extras is not None and expression.name in extras:
@@ -180,7 +922,13 @@ class Generator:
         if isinstance(expression, ast_.BinaryOp):
             left = self._gen_expression(expression.left, extras, certains)
             right = self._gen_expression(expression.right, extras, certains)
-            result = "("+left+expression.op+right+")"
+            result = "("+left+LOGICAL.get(expression.op, expression.op)+right+")"
+            if return_certain:
+                return result, False # type: ignore
+            return result
+        if isinstance(expression, ast_.UnaryOp):
+            operand = self._gen_expression(expression.operand, extras, certains)
+            result = "("+("not " if expression.op == "!" else expression.op)+operand+")"
             if return_certain:
                 return result, False # type: ignore
             return result
@@ -188,67 +936,513 @@ class Generator:
             if return_certain:
                 return expression.raw, False # type: ignore
             return expression.raw
+        if isinstance(expression, ast_.StringLiteral):
+            if return_certain:
+                return expression.value, False # type: ignore
+            return expression.value
         print("X: ",expression)
         return ""
     
+    def expression(self, expression: ast_.Expression) -> str:
+        """Python source evaluating `expression` against a parse result `ctx`."""
+        return self._gen_expression(expression)
+
+    def _gen_branch(self, statements, extras, certains: list) -> str:
+        generated = self._gen_statements(statements, extras, certains, False)
+        if not generated:
+            generated = ["pass"]
+        return "".join(self.indent(statement) + "\n" for statement in generated)
+
+    def _literal(self, expression: ast_.Expression):
+        if not isinstance(expression, ast_.NumberLiteral):
+            return None
+        try:
+            return int(expression.raw, 0)
+        except ValueError:
+            try:
+                return float(expression.raw)
+            except ValueError:
+                return None
+
+    def _case(self, condition: ast_.Expression, extras, certains: list):
+        if not isinstance(condition, ast_.BinaryOp) or condition.op != "==":
+            return None
+        subject, key = condition.left, self._literal(condition.right)
+        if key is None:
+            subject, key = condition.right, self._literal(condition.left)
+        if key is None:
+            return None
+        return self._gen_expression(subject, extras, certains), key
+
+    def _gen_helper(self, prefix: str, statements, extras, certains: list, returns: str = "offset", prelude: str = "") -> str:
+        # a block compiled to a module-level function of (data, offset, ctx, extras)
+        name = f"{prefix}{self.struct_name}_{self.cases}"
+        self.cases += 1
+        hoisted, self.hoisted = self.hoisted, None
+        arena, self.arena = self.arena, False
+        batch, self.batch, self.length = self.batch, False, "len(data)"
+        helper = f"def {name}(data, offset, ctx, extras):\n"
+        if prelude:
+            helper += self.indent(prelude) + "\n"
+        helper += self._gen_branch(statements, extras, list(certains))
+        helper += f"{self.indent_}return {returns}\n"
+        self.hoisted = hoisted
+        self.arena = arena
+        self.batch = batch
+        self.length = "length" if batch else "len(data)"
+        self.helpers.append(helper)
+        return name
+
+    def _gen_table(self, node, subject: str, cases: dict, default, extras, certains: list) -> str:
+        # every case becomes a module-level function and the value picks one
+        # through a dict, instead of a comparison per case
+        if (id(node), self.skip) not in self.tables:
+            handlers = {}
+            def handler(statements):
+                if id(statements) not in handlers:
+                    handlers[id(statements)] = self._gen_helper("_case", statements, extras, certains)
+                return handlers[id(statements)]
+            table = {key: handler(statements) for key, statements in cases.items()}
+            default = "no_case" if default is None else handler(default)
+            name = f"_cases{self.struct_name}_{self.cases}"
+            self.cases += 1
+            self.helpers.append(f"{name} = {{{', '.join(f'{key!r}: {function}' for key, function in table.items())}}}\n")
+            self.tables[id(node), self.skip] = name, default
+        name, default = self.tables[id(node), self.skip]
+        return f"offset = {name}.get({subject}, {default})(data, offset, ctx, {'extras' if extras else 'None'})"
+
+    def _gen_dispatch(self, ifthenelse: ast_.IfThenElse, extras, certains: list) -> str | None:
+        # `if (x == 1) ... elif (x == 2) ...` compiles like a switch on x
+        branches = [ifthenelse.if_] + ifthenelse.elif_
+        if len(branches) < self.DISPATCH_MIN or has_reloffset([ifthenelse]) or self.arena:
+            return None
+        subject = None
+        cases = {}
+        for branch in branches:
+            case = self._case(branch.condition, extras, certains)
+            if case is None or (subject is not None and case[0] != subject):
+                return None
+            subject = case[0]
+            cases.setdefault(case[1], branch.statements)
+        default = None if ifthenelse.else_ is None else ifthenelse.else_.statements
+        return self._gen_table(ifthenelse, subject, cases, default, extras, certains)
+
+    def _gen_switch(self, switch: ast_.Switch, extras, certains: list, certain = False) -> str:
+        cases = {}
+        default = None
+        if has_reloffset([switch]):
+            raise ValueError(f"Cases of {switch.name.name!r} cannot use @reloffset (at {switch.pos})")
+        for case in switch.cases:
+            statements = [case.declaration]
+            if not case.values:
+                default = statements
+            for value in case.values:
+                key = self._literal(value)
+                if key is None:
+                    raise ValueError(f"Case of {switch.name.name!r} must be a number (at {value.pos})")
+                cases.setdefault(key, statements)
+        if default is None:
+            message = f"No case of {self.struct_name}.{switch.name.name} matches"
+            default = [ast_.RaiseStmt(switch.pos, ast_.StringLiteral(switch.pos, f'"{message}"'))]
+        subject = self._gen_expression(switch.subject, extras, certains)
+        if self.arena:
+            result_ = self._gen_chain(subject, cases, default, extras, certains)
+        else:
+            result_ = self._gen_table(switch, subject, cases, default, extras, certains)
+        if certain:
+            certains.append(switch.name.name)
+        return result_
+
+    def _gen_chain(self, subject: str, cases: dict, default, extras, certains: list) -> str:
+        # arena functions append rows inline, which case functions cannot do
+        keys = {}
+        for key, statements in cases.items():
+            keys.setdefault(id(statements), (statements, []))[1].append(key)
+        this_block = f"subject = {subject}\n"
+        keyword = "if"
+        for statements, values in keys.values():
+            this_block += f"{keyword} {' or '.join(f'subject == {value!r}' for value in values)}:\n"
+            this_block += self._gen_branch(statements, extras, certains)
+            keyword = "elif"
+        this_block += "else:\n"
+        this_block += self._gen_branch(default, extras, certains)
+        return this_block.rstrip("\n")
+
     def _gen_condition(self, ifthenelse: ast_.IfThenElse, extras, certains: list):
+        dispatch = self._gen_dispatch(ifthenelse, extras, certains)
+        if dispatch is not None:
+            return dispatch
         this_block = f"if " + self._gen_expression(ifthenelse.if_.condition, extras, certains)+":\n"
-        for statement in ifthenelse.if_.statements:
-            this_block += f"{self.indent_}{self._gen_statement(statement, extras, certains, False)}\n"
+        this_block += self._gen_branch(ifthenelse.if_.statements, extras, certains)
         if len(ifthenelse.elif_) > 0:
             for elif_ in ifthenelse.elif_:
                 this_block += f"elif " + self._gen_expression(elif_.condition, extras, certains)+":\n"
-                for statement in elif_.statements:
-                    this_block += f"{self.indent_}{self._gen_statement(statement, extras, certains, False)}\n"
+                this_block += self._gen_branch(elif_.statements, extras, certains)
         if ifthenelse.else_ is not None:
             this_block += "else:\n"
-            for statement in ifthenelse.else_.statements:
-                self.depth += 1
-                this_block += f"{self.indent_}{self._gen_statement(statement, extras, certains, False)}\n"
-                self.depth -= 1
+            self.depth += 1
+            this_block += self._gen_branch(ifthenelse.else_.statements, extras, certains)
+            self.depth -= 1
         return this_block
     
     def _gen_struct(self, struct: ast_.Struct):
         if isinstance(struct.block, ast_.CodeBlock):
-            this_block = struct.block.code
-        else:
-            if struct.name == "File":
-                this_block = f"def parse{struct.name}(data: bytes, offset: int = 0) -> tuple[dict, int]:\n"
+            return struct.block.code
+        self.helpers = []
+        self.tables = {}
+        self.cases = 0
+        this_block = self._gen_function(struct)
+        if not struct.params and "batch" in self.variants:
+            this_block += "\n" + self._gen_batch(struct)
+        if "skip" in self.variants:
+            self.skip = True
+            self.needed_here = self.needed[struct.name]
+            this_block += "\n" + self._gen_function(struct)
+            if "arena" in self.variants:
+                self.arena = True
+                this_block += "\n" + self._gen_arena(struct)
+                self.arena = False
+            self.skip = False
+        if "patch" in self.variants:
+            this_block += "\n" + self._gen_patch(struct)
+        this_block = "".join(helper + "\n" for helper in self.helpers) + this_block
+        marker = f"{MARKER}{struct.pos[0]}:{struct.pos[1]} {struct.name}"
+        return "\n".join(line + marker if line.lstrip().startswith("def ") else line for line in this_block.split("\n"))
+
+    def _gen_function(self, struct: ast_.Struct):
+        if struct.params:
+            return self._gen_specialized(struct)
+        this_block = f"def {self._name('parse', struct.name)}(data: bytes, offset: int = 0) -> tuple[dict, int]:\n"
+        this_block += self.indent_+"ctx = {}\n"
+        this_block += self._gen_body(struct, ())
+        this_block += f"{self.indent_}return ctx, offset\n"
+        return this_block
+
+    def _gen_specialized(self, struct: ast_.Struct):
+        # one reader per distinct argument tuple: argument checks and
+        # parameter-only sizes run once, later calls only hit the cache
+        extras = self.functions[struct.name]
+        for parameter in extras:
+            if parameter in ("data", "offset"):
+                raise ValueError(f"Parameter {parameter!r} of {struct.name} shadows an argument of parse{struct.name} (at {struct.pos})")
+        specialize = self._name("specialize", struct.name)
+        read = self._name("read", struct.name)
+        self.hoisted = []
+        reader = f"def {read}(data: bytes, offset: int) -> tuple[dict, int]:\n"
+        reader += self.indent_+"ctx = {}\n"
+        reader += self._gen_body(struct, extras)
+        reader += f"{self.indent_}return ctx, offset"
+        hoisted, self.hoisted = self.hoisted, None
+
+        this_block = "@specializations\n"
+        this_block += f"def {specialize}({', '.join(extras)}):\n"
+        for parameter in extras:
+            this_block += f"{self.indent_}if {parameter} is None:\n"
+            this_block += f"{self.indent_*2}raise ValueError(\"Argument for {repr(parameter)} is not passed\")\n"
+        this_block += f"{self.indent_}extras = {{{', '.join(f'{parameter!r}: {parameter}' for parameter in extras)}}}\n"
+        for name, code in hoisted:
+            this_block += self.indent(f"{name} = {code}") + "\n"
+        this_block += self.indent(reader) + "\n"
+        this_block += f"{self.indent_}{read}.specialization = ({specialize}, ({', '.join(extras)},))\n"
+        this_block += f"{self.indent_}return {read}\n\n"
+        parameters = "".join(f", {parameter}" for parameter in extras)
+        this_block += f"def {self._name('parse', struct.name)}(data: bytes, offset: int{parameters}) -> tuple[dict, int]:\n"
+        this_block += f"{self.indent_}return {specialize}({', '.join(extras)})(data, offset)\n"
+        return this_block
+
+    def _gen_arena(self, struct: ast_.Struct):
+        # fills one level of the node table; nested structs only get their
+        # own row until something navigates into them
+        self.field_ids = {id(declaration): index for index, (declaration, _) in enumerate(declarations(struct.block.statements))}
+        this_block = f"def arena{struct.name}(data: bytes, offset: int, extras: dict, nodes: array, arguments: dict, parent: int) -> tuple[dict, int]:\n"
+        this_block += self.indent_+"ctx = {}\n"
+        this_block += self._gen_body(struct, self.functions[struct.name])
+        this_block += f"{self.indent_}return ctx, offset\n\n"
+        this_block += f"layout{struct.name} = {self._layout(struct)!r}\n"
+        return this_block
+
+    def _layout(self, struct: ast_.Struct) -> tuple:
+        # (struct id, name, parameters, fields, fixed shape), every field is
+        # (name, kind, type, extra) and tells how its rows decode
+        shifts = {}
+        def walk(statements):
+            for statement in group_bits(statements):
+                if isinstance(statement, list):
+                    for declaration, shift in zip(statement, bit_shifts(statement, self.endian)):
+                        shifts[id(declaration)] = shift
+                elif isinstance(statement, ast_.IfThenElse):
+                    for branch in [statement.if_] + statement.elif_:
+                        walk(branch.statements)
+                    if statement.else_ is not None:
+                        walk(statement.else_.statements)
+                elif isinstance(statement, ast_.Switch):
+                    for case in statement.cases:
+                        walk([case.declaration])
+        walk(struct.block.statements)
+        fields = []
+        for declaration, _ in declarations(struct.block.statements):
+            name = declaration.name.name
+            type_ = declaration.type
+            if id(declaration) in shifts:
+                width = bit_width(declaration)
+                fields.append((name, "bits", bits_ctype(width), (shifts[id(declaration)], width, self.endian)))
+                self.runtime_names.add(bits_ctype(width))
+            elif transform(declaration) is not None:
+                fields.append((name, "opaque", None, None))
+            elif isinstance(type_, ast_.RegularSize):
+                fields.append((name, "value" if declaration.array_size is None else "array", type_.value, None))
+                self.runtime_names |= {"type_" + type_.value} if declaration.array_size is None else {"type_bulk", "TYPECODES"}
+            elif isinstance(type_, ast_.Bytes) or (isinstance(type_, ast_.Size) and declaration.array_size is None):
+                fields.append((name, "bytes", None, None))
+            elif isinstance(type_, ast_.Identifier) and not isinstance(self.analysis.structs[type_.name].block, ast_.CodeBlock):
+                fields.append((name, "struct" if declaration.array_size is None else "structs", type_.name, None))
             else:
-                this_block = f"def parse{struct.name}(data: bytes, offset: int, extras: dict) -> tuple[dict, int]:\n"
-            this_block += self.indent_+"ctx = {}\n"
-            extras = self.functions[struct.name]
-            certains = []
-            for parameter in extras:
-                this_block += f"{self.indent_}if extras.get('{parameter}') is None:\n"
-                this_block += f"{self.indent_*2}raise ValueError(\"Argument for {repr(parameter)} is not passed\")\n"
-            for statement in struct.block.statements:
-                statement = self._gen_statement(statement, extras, certains, True)
-                this_block += self.indent(statement) + "\n"
-            this_block += f"{self.indent_}return ctx, offset\n"
+                # decoded by parsing the enclosing struct again
+                fields.append((name, "opaque", None, None))
+        params = tuple(param.name for param in struct.params)
+        return struct_id(struct.name), struct.name, params, tuple(fields), self.analysis.fixed_shape(struct.name)
+
+    def _gen_patch(self, struct: ast_.Struct):
+        this_block = f"offsets{struct.name} = {self._offsets(struct)!r}\n\n"
+        this_block += f"def patch{struct.name}(data, offset: int, path: str, value) -> int:\n"
+        this_block += f"{self.indent_}return patch_field(data, offset, offsets{struct.name}, {struct.name!r}, path, value)\n"
+        return this_block
+
+    def _offsets(self, struct: ast_.Struct) -> dict:
+        # field -> (offset, kind, type, extra) for the fields in front of the
+        # first one whose size or presence depends on the data
+        table = {}
+        at = 0
+        for statement in group_bits(struct.block.statements):
+            if isinstance(statement, list):
+                size = group_size(statement)
+                for declaration, shift in zip(statement, bit_shifts(statement, self.endian)):
+                    table[declaration.name.name] = (at, "bits", None, (shift, bit_width(declaration), size, self.endian))
+                at += size
+                continue
+            if not isinstance(statement, ast_.DeclareStatement):
+                if declarations([statement]):
+                    break
+                continue
+            entry = self._offset(statement)
+            if entry is not None:
+                table[statement.name.name] = (at, *entry)
+            size = self.analysis.static_size(statement)
+            if size is None:
+                break
+            at += size
+        return table
+
+    def _offset(self, declaration: ast_.DeclareStatement) -> tuple | None:
+        if pointer(declaration) is not None or transform(declaration) is not None:
+            return None
+        type_ = declaration.type
+        count = None
+        if isinstance(declaration.array_size, ast_.NumberLiteral):
+            count = int(declaration.array_size.raw, 0)
+        elif declaration.array_size is not None:
+            return None
+        if isinstance(type_, ast_.RegularSize):
+            if count is None:
+                return "value", type_.value, None
+            return "array", type_.value, (count, PRIMITIVE_SIZES[type_.value])
+        if isinstance(type_, ast_.Size) and count is None:
+            return "bytes", None, int(type_.value.raw[:-1], 0)
+        if isinstance(type_, ast_.Bytes) and count is not None:
+            return "bytes", None, count
+        if isinstance(type_, ast_.Identifier) and not isinstance(self.analysis.structs[type_.name].block, ast_.CodeBlock):
+            if count is None:
+                return "struct", type_.name, None
+            size = self.analysis.static_size(type_.name) if not self.functions[type_.name] else None
+            if size is not None:
+                return "structs", type_.name, (count, size)
+        return None
+
+    def _gen_row(self, statement, extras, certains: list, certain = False) -> str:
+        # the field is read like in the skip function, then its bytes are
+        # appended to the node table as (struct, field, offset, length, parent)
+        struct = struct_id(self.struct_name)
+        if isinstance(statement, list):
+            code = self._gen_bits(statement, certains, certain)
+            size = group_size(statement)
+            rows = ", ".join(f"{struct}, {self.field_ids[id(declaration)]}, at, {size}, parent" for declaration in statement)
+            return f"at = offset\n{code}\nnodes.extend(({rows}))"
+        field = self.field_ids[id(statement)]
+        name = statement.name.name
+        annotation = pointer(statement)
+        if annotation is not None:
+            # the row covers the pointed to bytes, found with the skip function
+            if len(annotation.args) != 1:
+                raise ValueError(f"@{annotation.name} of {name!r} takes one argument (at {annotation.pos})")
+            position = f"int({self._gen_expression(annotation.args[0], extras, certains)})"
+            if annotation.name == "reloffset":
+                position = f"start + {position}"
+            inline = replace(statement, annotations=[other for other in statement.annotations if other is not annotation])
+            this_block = f"saved = offset\noffset = at = {position}\n"
+            this_block += self._gen_arguments(inline, extras, certains)
+            this_block += self._gen_statement(inline, extras, certains, certain) + "\n"
+            this_block += f"nodes.extend(({struct}, {field}, at, offset - at, parent))\n"
+            return this_block + "offset = saved"
+        if isinstance(statement.array_size, ast_.Until) and transform(statement) is None:
+            # the row leaves the terminator out, so it decodes like a counted array
+            this_block = f"at = offset\nvalue, offset = {self._gen_until(statement, extras, certains)}\n"
+            if name in self.needed_here:
+                this_block += f"ctx['{name}'] = value\n"
+            if certain:
+                certains.append(name)
+            element = 1 if isinstance(statement.type, ast_.Bytes) else PRIMITIVE_SIZES[statement.type.value]
+            return this_block + f"nodes.extend(({struct}, {field}, at, {element} * len(value), parent))"
+        this_block = self._gen_arguments(statement, extras, certains)
+        this_block += f"at = offset\n{self._gen_statement(statement, extras, certains, certain)}\n"
+        return this_block + f"nodes.extend(({struct}, {field}, at, offset - at, parent))"
+
+    def _gen_arguments(self, statement: ast_.DeclareStatement, extras, certains: list) -> str:
+        # struct rows keep what expanding them later needs: the arguments of
+        # parameterized structs, and the element count of arrays
+        if not isinstance(statement.type, ast_.Identifier) or transform(statement) is not None \
+                or isinstance(self.analysis.structs[statement.type.name].block, ast_.CodeBlock):
+            return ""
+        parameters = self.functions[statement.type.name]
+        args = self._call_arguments(statement, parameters)
+        arguments = [self._gen_expression(argument, extras, certains) for argument in args]
+        arguments = "(" + "".join(f"{argument}, " for argument in arguments).rstrip(" ") + ")"
+        if statement.array_size is not None:
+            arguments = f"({arguments}, int({self._gen_expression(statement.array_size, extras, certains)}))"
+        elif not parameters:
+            return ""
+        return f"arguments[len(nodes) // 5] = {arguments}\n"
+
+    def _gen_batch(self, struct: ast_.Struct):
+        # the struct body is inlined into one loop so each message costs no
+        # extra call or argument setup, and the readers are bound to locals
+        # once per call instead of looked up per field
+        names = []
+        certain = set()
+        for declaration, conditions in declarations(struct.block.statements):
+            if declaration.name.name not in names:
+                names.append(declaration.name.name)
+            if not conditions:
+                certain.add(declaration.name.name)
+        self.batch = True
+        self.batch_locals = {"length_of": "len"}
+        self.length = "length"
+        body = self._gen_body(struct, (), 2)
+        self.batch = False
+        self.length = "len(data)"
+        this_block = f"def parse{struct.name}_batch(buffers, offsets=None, columnar: bool = False) -> list[dict] | dict[str, list]:\n"
+        for name, value in sorted(self.batch_locals.items()):
+            this_block += f"{self.indent_}{name} = {value}\n"
+        this_block += f"{self.indent_}results = []\n"
+        this_block += f"{self.indent_}append = results.append\n"
+        # columns are filled as the messages are decoded, not transposed after
+        this_block += f"{self.indent_}columns = {{{', '.join(f'{name!r}: []' for name in names)}}}\n"
+        for name in names:
+            this_block += f"{self.indent_}add_{name} = columns['{name}'].append\n"
+        this_block += f"{self.indent_}if offsets is None:\n"
+        this_block += f"{self.indent_*2}items = zip(buffers, repeat(0))\n"
+        this_block += f"{self.indent_}else:\n"
+        this_block += f"{self.indent_*2}items = zip(repeat(buffers), offsets)\n"
+        this_block += f"{self.indent_}for data, offset in items:\n"
+        this_block += f"{self.indent_*2}length = length_of(data)\n"
+        this_block += f"{self.indent_*2}ctx = {{}}\n"
+        this_block += body
+        this_block += f"{self.indent_*2}if columnar:\n"
+        for name in names:
+            value = f"ctx['{name}']" if name in certain else f"ctx.get('{name}')"
+            this_block += f"{self.indent_*3}add_{name}({value})\n"
+        this_block += f"{self.indent_*2}else:\n"
+        this_block += f"{self.indent_*3}append(ctx)\n"
+        this_block += f"{self.indent_}if columnar:\n"
+        this_block += f"{self.indent_*2}return columns\n"
+        this_block += f"{self.indent_}return results\n"
         return this_block
     
     def generate(self):
-        iterable = self.program.items
-        for statement in iterable:
-            if isinstance(statement, ast_.Preprocessor):
-                this_block = f"# PRE: \"{statement.name} {" ".join(statement.args)}\""
-                self.result += this_block
-            elif isinstance(statement, ast_.SpecialGlobal):
-                if statement.name == "endian":
-                    this_block = f"ENDIAN = '{statement.arg}'"
-                elif statement.arg is not None:
-                    this_block = f"# GLOBAL: \"{statement.name} {statement.arg}\""
-                else:
-                    this_block = f"# GLOBAL: \"{statement.name}\""
-                self.result += this_block
-            elif isinstance(statement, ast_.SpecialLocal):
-                this_block = f"# LOCAL: \"{statement.name} {statement.arg}\""
-                self.result += this_block
-            elif isinstance(statement, ast_.Struct):
-                this_block = self._gen_struct(statement)
-                self.result += this_block
-            else:
-                raise ValueError(statement)
-            self.result += "\n"
-        return self.result
\ No newline at end of file
+        # blocks are joined once at the end, growing one string is quadratic
+        blocks = []
+        for statement in self.program.items:
+            this_block = self.generate_item(statement)
+            if this_block is not None:
+                blocks.append(this_block + "\n")
+        code = "".join(blocks)
+        code = self.runtime(code) + code
+        return code + f"\nSOURCE_MAP = {source_map(code)!r}\n"
+
+    def runtime(self, code: str, have=()) -> str:
+        """The part of the runtime that `code` uses, leaving out what `have` defines.
+
+        Goes after generate_item: a module only compiles the helpers its
+        structs call, so schemas without arrays or transforms import faster.
+        """
+        chunks = RUNTIME + (INSTRUMENT_RUNTIME if self.instrument else [])
+        wanted = set(re.findall(r"[A-Za-z_]\w*", code)) | SETTINGS | self.runtime_names
+        if self.instrument:
+            wanted.add("FIELD_STATS")
+        included = [False] * len(chunks)
+        changed = True
+        while changed:
+            changed = False
+            for index, (defined, used, _) in enumerate(chunks):
+                if not included[index] and defined & wanted:
+                    included[index] = changed = True
+                    wanted |= used
+        result = "".join(text for (defined, _, text), include in zip(chunks, included)
+                         if include and not all(name in have for name in defined))
+        return result.replace("ENDIAN = 'little'", f"ENDIAN = {self.endian!r}", 1)
+
+    def generate_item(self, statement) -> str | None:
+        """Code for one top-level item, None for structs of another module."""
+        if isinstance(statement, ast_.Preprocessor):
+            return f"# PRE: \"{statement.name} {' '.join(statement.args)}\""
+        if isinstance(statement, ast_.SpecialGlobal):
+            if statement.arg is not None:
+                return f"# GLOBAL: \"{statement.name} {statement.arg}\""
+            return f"# GLOBAL: \"{statement.name}\""
+        if isinstance(statement, ast_.SpecialLocal):
+            return f"# LOCAL: \"{statement.name} {statement.arg}\""
+        if isinstance(statement, ast_.Struct):
+            if statement.name in self.external:
+                return None
+            return self._gen_struct(statement)
+        if isinstance(statement, ast_.Import):
+            return f"# IMPORT: \"{statement.path}\""
+        raise ValueError(statement)
+
+def bit_shifts(group: list[ast_.DeclareStatement], endian: str) -> list[int]:
+    """Shift of each field of a bit group in the word read with `endian`."""
+    shifts = []
+    shift = 0 if endian == 'little' else group_size(group) * 8
+    for declaration in group:
+        if endian != 'little':
+            shift -= bit_width(declaration)
+        shifts.append(shift)
+        if endian == 'little':
+            shift += bit_width(declaration)
+    return shifts
+
+def bits_ctype(width: int) -> str:
+    return "c_uint8" if width <= 8 else "c_uint16" if width <= 16 else "c_uint32" if width <= 32 else "c_uint64"
+
+def struct_id(name: str) -> int:
+    """The struct column of arena rows: modules that import each other agree on it without a registry."""
+    return crc32(name.encode())
+
+def source_map(code: str) -> dict[int, tuple[int, int, str]]:
+    """Generated line -> (.spp line, column, "Struct.field").
+
+    Unmarked lines of a function belong to the struct of the function.
+    """
+    result = {}
+    function = None
+    for number, line in enumerate(code.split("\n"), 1):
+        if line and not line[0].isspace():
+            function = None
+        if MARKER in line:
+            position, _, name = line.rsplit(MARKER, 1)[1].partition(" ")
+            spp_line, _, column = position.partition(":")
+            result[number] = (int(spp_line), int(column), name)
+            if line.lstrip().startswith("def "):
+                function = result[number]
+        elif function is not None and line.strip():
+            result[number] = function
+    return result
@@ -0,0 +1,504 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import lzma
+import operator
+import random
+import re
+from struct import calcsize, pack
+import subprocess
+import time
+import types
+import zlib
+from . import ast_, c_gen, lexer, parser, values
+from .analysis import Analysis, group_bits, pointer, transform
+from .arena import Arena
+from .code_gen import VARIANTS, Generator
+
+PRIMITIVES = {
+    "uint8": "B", "int8": "b", "uint16": "H", "int16": "h", "uint32": "I",
+    "int32": "i", "uint64": "Q", "int64": "q", "float": "f", "double": "d",
+}
+INTEGERS = [name for name in PRIMITIVES if name not in ("float", "double")]
+
+OPERATORS = {
+    "+": operator.add, "-": operator.sub, "*": operator.mul, "%": operator.mod,
+    "&": operator.and_, "|": operator.or_, "^": operator.xor,
+    "==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+    ">": operator.gt, ">=": operator.ge,
+}
+
+# fields are named by role, so inputs are written without a side table:
+# c* are counts (0-3), s* selectors (0-4), o* offsets and z* compressed
+# lengths patched once what they describe is written, the rest is random
+
+def random_schema(rng: random.Random, structs: int = 4, native: bool = False) -> str:
+    """A random .spp schema whose last struct, S<structs-1>, is the root.
+
+    Uses primitives, Size and bytes fields, counted and terminated arrays,
+    bit fields, nested and parameterized structs, if/elif/else chains,
+    switches, validations, @offset/@reloffset and @zlib/@lzma. `native`
+    leaves out @zlib/@lzma, which the C backend does not support, so it gets
+    checked too.
+    """
+    lines = [f"#endian {rng.choice(('little', 'big'))}"]
+    known = []   # (name, parameters, free of pointers)
+    for index in range(structs):
+        params = ["p"] if index < structs - 1 and rng.random() < 0.3 else []
+        body, pointer_free = _body(rng, known, params, native)
+        lines.append(f"struct S{index}({', '.join(params)}) {{")
+        lines += ["    " + line for line in body]
+        lines.append("}")
+        known.append((f"S{index}", params, pointer_free))
+    return "\n".join(lines) + "\n"
+
+def _body(rng: random.Random, known: list, params: list[str], native: bool = False) -> tuple[list[str], bool]:
+    names = iter(range(1000))
+    lines = []
+    counts = list(params)   # expressions worth 0 to 3
+    pointer_free = True
+    plain = [name for name, parameters, _ in known if not parameters]
+    targets = [name for name, parameters, free in known if not parameters and free]
+
+    def simple() -> str:
+        choice = rng.random()
+        if choice < 0.6:
+            return rng.choice(list(PRIMITIVES))
+        if choice < 0.8 or not plain:
+            return f"{rng.randint(1, 4)}B"
+        return rng.choice(plain)
+
+    def struct() -> str:
+        name, parameters, _ = rng.choice(known)
+        if parameters:
+            argument = rng.choice(counts) if counts and rng.random() < 0.5 else str(rng.randint(0, 3))
+            return f"{name}({argument})"
+        return name
+
+    if params:
+        lines.append(f"f{next(names)}: {rng.choice(['uint8', 'bytes', 'int16'])}[p];")
+    kinds = ["value", "value", "count", "struct", "struct", "if", "dispatch", "validate", "pointer", "until", "bits", "switch"]
+    if rng.random() < 0.3:
+        # no counts or branches: structs the analysis may call fixed shape
+        kinds = ["value", "struct", "pointer", "bits"]
+    if not native:
+        kinds.append("compressed")
+    for _ in range(rng.randint(1, 6)):
+        kind = rng.choice(kinds)
+        number = next(names)
+        if kind == "value":
+            size = f"[{rng.randint(0, 3)}]" if rng.random() < 0.3 else ""
+            lines.append(f"f{number}: {simple() if size else rng.choice(list(PRIMITIVES))}{size};")
+        elif kind == "count":
+            lines.append(f"c{number}: uint8;")
+            counts.append(f"c{number}.value")
+            type_ = rng.choice(list(PRIMITIVES) + ["bytes", "2B"] + plain)
+            lines.append(f"f{next(names)}: {type_}[{counts[-1]}];")
+        elif kind == "until":
+            type_, terminator = rng.choice([("bytes", "0"), ("uint8", "255"), ("uint16", "65535"), ("int32", "7"), ("uint64", "0")])
+            lines.append(f"f{number}: {type_}[until {terminator}];")
+        elif kind == "bits":
+            widths = []
+            while not widths or (sum(widths) < 48 and rng.random() < 0.6):
+                widths.append(rng.randint(1, 16))
+            for width in widths:
+                lines.append(f"b{next(names)}: {width}b;")
+        elif kind == "struct" and known:
+            size = ""
+            if rng.random() < 0.4:
+                size = f"[{rng.choice(counts) if counts and rng.random() < 0.5 else rng.randint(0, 3)}]"
+            lines.append(f"f{number}: {struct()}{size};")
+        elif kind in ("if", "dispatch"):
+            lines.append(f"s{number}: uint8;")
+            selector = f"s{number}.value"
+            if kind == "dispatch":
+                conditions = [f"{selector} == {value}" for value in range(4)]
+            else:
+                conditions = [f"{selector} {rng.choice(['>', '==', '!=', '<='])} {rng.randint(0, 4)}"
+                              for _ in range(rng.randint(1, 2))]
+            shared = f"f{next(names)}"
+            for index, condition in enumerate(conditions):
+                lines.append(f"{'if' if index == 0 else 'elif'} ({condition}) {{")
+                name = shared if rng.random() < 0.5 else f"f{next(names)}"
+                lines.append(f"    {name}: {simple()};")
+                lines.append("}")
+            if rng.random() < 0.7:
+                lines[-1] += " else {"
+                lines.append(f"    {shared}: {simple()};")
+                lines.append("}")
+        elif kind == "switch":
+            lines.append(f"s{number}: uint8;")
+            lines.append(f"f{next(names)}: switch (s{number}.value) {{")
+            values_ = list(range(5))
+            rng.shuffle(values_)
+            for case in range(rng.randint(1, 3)):
+                lines.append(f"    case {', '.join(map(str, values_[case::3][:2]))}: {simple()};")
+            lines.append(f"    default: {rng.choice([simple(), 'bytes[until 0]'])};")
+            lines.append("}")
+        elif kind == "validate" and counts:
+            lines.append(f"if ({rng.choice(counts)} > {rng.randint(3, 200)}) {{")
+            lines.append('    raise "never";')
+            lines.append("}")
+        elif kind == "pointer" and targets:
+            lines.append(f"o{number}: uint32;")
+            lines.append(f"f{next(names)}: {rng.choice(targets)} @{rng.choice(['offset', 'reloffset'])}(o{number}.value);")
+            pointer_free = False
+        elif kind == "compressed" and targets:
+            lines.append(f"z{number}: uint32;")
+            lines.append(f"f{next(names)}: {rng.choice(targets)} @{rng.choice(['zlib', 'lzma'])}(z{number}.value);")
+    if not lines:
+        lines.append("f0: uint8;")
+    # a nested struct with a pointer makes this one point too
+    used = set(re.findall(r"\bS\d+\b", "\n".join(lines)))
+    pointer_free = pointer_free and all(free for name, _, free in known if name in used)
+    return lines, pointer_free
+
+def parse_schema(text: str) -> ast_.Program:
+    return parser.Parser(lexer.lex(text)).parse_program()
+
+
+class _Writer:
+    # writes random values field by field, the way the schema reads them
+
+    def __init__(self, program: ast_.Program, rng: random.Random):
+        self.rng = rng
+        self.structs = {item.name: item for item in program.items if isinstance(item, ast_.Struct)}
+        self.endian = "little"
+        for item in program.items:
+            if isinstance(item, ast_.SpecialGlobal) and item.name == "endian":
+                self.endian = item.arg
+        self.order = "<" if self.endian == "little" else ">"
+        self.pending = []   # (offset field position, base, struct) placed after the root
+
+    def write(self, root: str) -> bytes:
+        data = bytearray()
+        self.struct(data, root, {})
+        for position, base, name in self.pending:
+            target = len(data)
+            self.struct(data, name, {})
+            data[position:position + 4] = (target - base).to_bytes(4, self.endian)
+        return bytes(data)
+
+    def struct(self, data: bytearray, name: str, args: dict) -> dict:
+        ctx = {}
+        self.block(data, self.structs[name].block.statements, ctx, args, len(data), {})
+        return ctx
+
+    def block(self, data, statements, ctx, args, start, positions):
+        for statement in group_bits(statements):
+            if isinstance(statement, list):
+                self.bits(data, statement, ctx)
+            elif isinstance(statement, ast_.DeclareStatement):
+                ctx[statement.name.name] = self.field(data, statement, ctx, args, start, positions)
+            elif isinstance(statement, ast_.IfThenElse):
+                for branch in [statement.if_] + statement.elif_:
+                    if self.evaluate(branch.condition, ctx, args):
+                        self.block(data, branch.statements, ctx, args, start, positions)
+                        break
+                else:
+                    if statement.else_ is not None:
+                        self.block(data, statement.else_.statements, ctx, args, start, positions)
+            elif isinstance(statement, ast_.Switch):
+                subject = self.evaluate(statement.subject, ctx, args)
+                chosen = None
+                for case in statement.cases:
+                    if not case.values and chosen is None:
+                        chosen = case
+                    if any(self.evaluate(value, ctx, args) == subject for value in case.values):
+                        chosen = case
+                        break
+                ctx[statement.name.name] = self.field(data, chosen.declaration, ctx, args, start, positions)
+            elif isinstance(statement, ast_.RaiseStmt):
+                raise AssertionError(f"Input cannot avoid the raise at {statement.pos}")
+
+    def evaluate(self, expression, ctx, args):
+        if isinstance(expression, ast_.Identifier):
+            return args[expression.name] if expression.name in args else ctx[expression.name]
+        if isinstance(expression, ast_.FieldAccess):
+            value = self.evaluate(expression.target, ctx, args)
+            return value if expression.field == "value" else value[expression.field]
+        if isinstance(expression, ast_.NumberLiteral):
+            return int(expression.raw, 0)
+        if isinstance(expression, ast_.BinaryOp):
+            return OPERATORS[expression.op](self.evaluate(expression.left, ctx, args), self.evaluate(expression.right, ctx, args))
+        raise NotImplementedError(f"Cannot evaluate {expression!r}")
+
+    def bits(self, data, group, ctx):
+        size = (sum(int(declaration.type.value.raw[:-1]) for declaration in group) + 7) // 8
+        word = 0
+        shift = 0 if self.endian == "little" else size * 8
+        for declaration in group:
+            width = int(declaration.type.value.raw[:-1])
+            value = self.rng.getrandbits(width)
+            if self.endian != "little":
+                shift -= width
+            word |= value << shift
+            if self.endian == "little":
+                shift += width
+            ctx[declaration.name.name] = value
+        data += word.to_bytes(size, self.endian)
+
+    def primitive(self, data, type_, name="", avoid=None):
+        if name[:1] in ("o", "z"):
+            value = 0
+        elif name[:1] == "c":
+            value = self.rng.randint(0, 3)
+        elif name[:1] == "s":
+            value = self.rng.randint(0, 4)
+        elif type_ in ("float", "double"):
+            value = self.rng.randint(-4096, 4096) / 8
+        else:
+            bits = 8 * calcsize(PRIMITIVES[type_])
+            value = self.rng.getrandbits(bits)
+            if type_.startswith("int") and value >= 1 << (bits - 1):
+                value -= 1 << bits
+            if value == avoid:
+                value ^= 1
+        data += pack(self.order + PRIMITIVES[type_], value)
+        return value
+
+    def field(self, data, declaration, ctx, args, start, positions):
+        name = declaration.name.name
+        annotation = pointer(declaration)
+        if annotation is not None:
+            base = start if annotation.name == "reloffset" else 0
+            self.pending.append((positions[annotation.args[0].target.name], base, declaration.type.name))
+            return None
+        annotation = transform(declaration)
+        if annotation is not None:
+            inner = bytearray()
+            self.struct(inner, declaration.type.name, {})
+            # the level or check varies the length, so the elements of an
+            # array of such structs differ in size
+            if annotation.name == "zlib":
+                packed = zlib.compress(inner, self.rng.choice((0, 9)))
+            else:
+                packed = lzma.compress(inner, check=self.rng.choice((lzma.CHECK_NONE, lzma.CHECK_CRC64)))
+            position = positions[annotation.args[0].target.name]
+            data[position:position + 4] = len(packed).to_bytes(4, self.endian)
+            data += packed
+            return None
+        type_ = declaration.type
+        if isinstance(declaration.array_size, ast_.Until):
+            terminator = self.evaluate(declaration.array_size.value, ctx, args)
+            if isinstance(type_, ast_.Bytes):
+                value = bytes(self.rng.randint(1, 255) for _ in range(self.rng.randint(0, 6)))
+                data += value + b"\0"
+                return value
+            value = [self.primitive(data, type_.value, avoid=terminator) for _ in range(self.rng.randint(0, 4))]
+            data += pack(self.order + PRIMITIVES[type_.value], terminator)
+            return value
+        count = None
+        if declaration.array_size is not None:
+            count = max(0, int(self.evaluate(declaration.array_size, ctx, args)))
+        def one():
+            if isinstance(type_, ast_.RegularSize):
+                if type_.value == "uint32" and name[:1] in ("o", "z"):
+                    positions[name] = len(data)
+                return self.primitive(data, type_.value, name)
+            if isinstance(type_, ast_.Size):
+                value = self.rng.randbytes(int(type_.value.raw[:-1], 0))
+                data.extend(value)
+                return value
+            if isinstance(type_, ast_.Bytes):
+                value = self.rng.randbytes(count)
+                data.extend(value)
+                return value
+            struct = self.structs[type_.name]
+            arguments = []
+            if isinstance(declaration.default, ast_.CallExpression):
+                arguments = [self.evaluate(argument, ctx, args) for argument in declaration.default.args]
+            return self.struct(data, type_.name, dict(zip((param.name for param in struct.params), arguments)))
+        if count is None or isinstance(type_, ast_.Bytes):
+            return one()
+        return [one() for _ in range(count)]
+
+def conforming_input(program: ast_.Program, root: str, rng: random.Random) -> bytes:
+    """Random bytes that `root` of `program` parses without error.
+
+    Pointed to structs follow the root, compressed ones are written in place.
+    """
+    return _Writer(program, rng).write(root)
+
+def _module(program: ast_.Program, name: str, instrument: bool = False) -> types.ModuleType:
+    module = types.ModuleType(name)
+    exec(compile(Generator(program, instrument, variants=VARIANTS).generate(), f"<{name}>", "exec"), module.__dict__)
+    return module
+
+def _tree(node):
+    # the arena decoded leaf by leaf, so offsets and lengths are checked too
+    if node.kind == "struct":
+        return {child.name: _tree(child) for child in node}
+    if node.kind == "structs":
+        return [_tree(element) for element in node]
+    return values.plain(node.value)
+
+def backends(program: ast_.Program, root: str, name: str, executor=None, c: bool = True) -> dict:
+    """Every backend that handles `program`, as name -> function(data) -> (value, end).
+
+    Values are plain, None where a backend gives no value (skip) or no end
+    (batch). The C backend is left out when it does not support the schema.
+    """
+    python = _module(program, name)
+    instrumented = _module(program, name + "_instrumented", True)
+    parallel = _module(program, name + "_parallel")
+    parallel.PARALLEL_MIN_BYTES = 1
+    def run_parallel(data):
+        token = parallel.EXECUTOR.set(executor)
+        try:
+            return values.plain(getattr(parallel, "parse" + root)(data, 0))
+        finally:
+            parallel.EXECUTOR.reset(token)
+    def run_arena(data):
+        arena = Arena(python, root, data)
+        return _tree(arena.root), arena.root.length
+    found = {
+        "python": lambda data: values.plain(getattr(python, "parse" + root)(data, 0)),
+        "batch": lambda data: (values.plain(getattr(python, f"parse{root}_batch")([data])[0]), None),
+        "skip": lambda data: (None, getattr(python, "skip" + root)(data, 0)[1]),
+        "arena": run_arena,
+        "instrumented": lambda data: values.plain(getattr(instrumented, "parse" + root)(data, 0)),
+    }
+    if executor is not None:
+        found["parallel"] = run_parallel
+    if c:
+        try:
+            native = c_gen.build(program, name + "_c")
+        except NotImplementedError:
+            pass
+        else:
+            found["c"] = lambda data: getattr(native, "parse" + root)(data)
+    return found
+
+
+@dataclass
+class Report:
+    cases: int = 0
+    failures: list[str] = field(default_factory=list)
+    # backend -> [inputs, bytes, seconds]
+    throughput: dict[str, list] = field(default_factory=dict)
+
+    def rates(self) -> dict[str, float]:
+        """MB/s per backend."""
+        return {name: size / seconds / 1e6 for name, (_, size, seconds) in self.throughput.items() if seconds}
+
+    def regressions(self, baseline: dict[str, float], tolerance: float = 0.2) -> list[str]:
+        """Backends slower than `tolerance` below their rate in `baseline`."""
+        found = []
+        for name, rate in self.rates().items():
+            if name in baseline and rate < baseline[name] * (1 - tolerance):
+                found.append(f"{name}: {rate:.2f} MB/s, baseline {baseline[name]:.2f} MB/s")
+        return found
+
+    def format(self, baseline: dict[str, float] | None = None) -> str:
+        lines = [f"{self.cases} inputs, {len(self.failures)} failures"]
+        lines.append(f"{'backend':<16}{'inputs':>10}{'MB/s':>10}{'baseline':>10}")
+        rates = self.rates()
+        for name, (count, _, _) in self.throughput.items():
+            previous = f"{baseline[name]:.2f}" if baseline and name in baseline else ""
+            lines.append(f"{name:<16}{count:>10}{rates.get(name, 0.0):>10.2f}{previous:>10}")
+        lines += self.failures
+        return "\n".join(lines)
+
+def _outcome(function, data):
+    try:
+        return "ok", function(data)
+    except ValueError:
+        return "error", None
+    except Exception as exception:
+        return "crash", f"{type(exception).__name__}: {exception}"
+
+def check(text: str, inputs: list[bytes], name: str, executor=None, c: bool = True, repeat: int = 3,
+          report: Report | None = None) -> Report:
+    """Runs `inputs` through every backend of schema `text` and compares them with the Python backend.
+
+    Each input is also cut short at a random point, where every decoding
+    backend has to fail with ValueError or agree on the result.
+    """
+    if report is None:
+        report = Report()
+    program = parse_schema(text)
+    root = [item.name for item in program.items if isinstance(item, ast_.Struct)][-1]
+    try:
+        found = backends(program, root, name, executor, c)
+    except (SyntaxError, ValueError, subprocess.CalledProcessError) as exception:
+        report.failures.append(f"{name}: does not build: {type(exception).__name__}: {exception}\n{text}")
+        return report
+    rng = random.Random(name)
+    for index, data in enumerate(inputs):
+        report.cases += 1
+        expected = _outcome(found["python"], data)
+        for backend, function in found.items():
+            start = time.perf_counter()
+            for _ in range(repeat):
+                got = _outcome(function, data)
+            seconds = time.perf_counter() - start
+            totals = report.throughput.setdefault(backend, [0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += len(data) * repeat
+            totals[2] += seconds
+            problem = _compare(expected, got, backend != "skip")
+            if problem:
+                report.failures.append(f"{name} input {index} ({data.hex()}): {backend} {problem}\n{text}")
+        cut = data[:rng.randrange(len(data))] if data else data
+        expected = _outcome(found["python"], cut)
+        for backend, function in found.items():
+            if backend == "skip":
+                continue
+            problem = _compare(expected, _outcome(function, cut), True)
+            if problem:
+                report.failures.append(f"{name} input {index} cut to {len(cut)} bytes ({cut.hex()}): {backend} {problem}\n{text}")
+    report.failures += [f"{name}: {problem}\n{text}" for problem in shapes(program, name, rng)]
+    return report
+
+def shapes(program: ast_.Program, name: str, rng: random.Random, samples: int = 6) -> list[str]:
+    """Checks the sizes the analysis promises against parses of conforming inputs.
+
+    Every struct without parameters is written `samples` times: a fixed
+    shape one has to consume the same number of bytes each time, and one
+    with a static size exactly that many. Arrays of them, skip functions and
+    arenas count on it, but inputs rarely have the elements differ in size.
+    """
+    analysis = Analysis(program)
+    python = _module(program, name + "_shapes")
+    problems = []
+    for struct in program.items:
+        if not isinstance(struct, ast_.Struct) or struct.params or not analysis.fixed_shape(struct.name):
+            continue
+        parse = getattr(python, "parse" + struct.name)
+        ends = {parse(conforming_input(program, struct.name, rng), 0)[1] for _ in range(samples)}
+        size = analysis.static_size(struct.name)
+        if len(ends) > 1:
+            problems.append(f"{struct.name} has a fixed shape but takes {sorted(ends)} bytes")
+        elif size is not None and ends != {size}:
+            problems.append(f"{struct.name} has a static size of {size} but takes {ends.pop()} bytes")
+    return problems
+
+def _compare(expected, got, values_: bool) -> str | None:
+    if expected[0] != "ok" or got[0] != "ok":
+        if expected[0] == got[0] == "error":
+            return None
+        return f"gives {got[0]} {got[1] or ''} where python gives {expected[0]} {expected[1] or ''}".rstrip()
+    (value, end), (other, other_end) = expected[1], got[1]
+    if values_ and other is not None and other != value:
+        return f"gives {other!r}, python {value!r}"
+    if other_end is not None and other_end != end:
+        return f"ends at {other_end}, python at {end}"
+    return None
+
+def run(seed: int = 0, schemas: int = 20, inputs: int = 10, c: bool = True, repeat: int = 3) -> Report:
+    """Checks `schemas` random schemas with `inputs` conforming inputs each.
+
+    Schema i comes from random.Random(seed + i), so a failure reported for
+    one seed reproduces with run(that seed, 1). With `c`, every other schema
+    is restricted to what the C backend supports.
+    """
+    report = Report()
+    with ThreadPoolExecutor(2) as executor:
+        for number in range(seed, seed + schemas):
+            rng = random.Random(number)
+            text = random_schema(rng, native=c and number % 2 == 0)
+            program = parse_schema(text)
+            root = [item.name for item in program.items if isinstance(item, ast_.Struct)][-1]
+            cases = [conforming_input(program, root, rng) for _ in range(inputs)]
+            check(text, cases, f"fuzz{number}", executor, c, repeat, report)
+    return report
@@ -0,0 +1,108 @@
+from array import array
+import mmap
+import os
+
+INDEX_SUFFIX = ".idx"
+
+def build_index(path: str, module, struct: str, index: str | None = None) -> array:
+    """Records the start offset of every `struct` record in `path`.
+
+    The sidecar `index` (default `path + ".idx"`) holds native-endian
+    unsigned 64-bit offsets: one per record followed by the end of the last
+    complete record, so it can be memory-mapped as `array('Q')`. When the
+    index already exists only the bytes after that end are scanned, which
+    keeps indexing an append-only log incremental. Scanning stops at the
+    first record that is truncated or does not validate. `module` is
+    generated with the "skip" variant.
+    """
+    if index is None:
+        index = path + INDEX_SUFFIX
+    skip = getattr(module, "skip" + struct)
+    offsets = array("Q")
+    exists = os.path.exists(index)
+    if exists:
+        with open(index, "rb") as file:
+            offsets.frombytes(file.read())
+    offset = offsets.pop() if offsets else 0
+    new = array("Q")
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size > offset:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                while offset < size:
+                    try:
+                        end = skip(data, offset)[1]
+                    except ValueError:
+                        break
+                    if end > size or end <= offset:
+                        break
+                    new.append(offset)
+                    offset = end
+    new.append(offset)
+    with open(index, "r+b" if exists else "wb") as file:
+        file.seek(len(offsets) * offsets.itemsize)
+        new.tofile(file)
+        file.truncate()
+    offsets.extend(new)
+    return offsets
+
+
+class IndexedFile:
+    """Random access to the records of a file through its offset index.
+
+    `record[i]` decodes record i on access; nothing is parsed up front.
+    """
+    def __init__(self, path: str, module, struct: str, index: str | None = None, update: bool = True):
+        if index is None:
+            index = path + INDEX_SUFFIX
+        if update or not os.path.exists(index):
+            build_index(path, module, struct, index)
+        self._parse = getattr(module, "parse" + struct)
+        self._file = open(path, "rb")
+        self._index_file = open(index, "rb")
+        self.data = b""
+        if os.fstat(self._file.fileno()).st_size:
+            self.data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index_map = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = memoryview(self._index_map).cast("Q")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def _position(self, i: int) -> int:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("record index out of range")
+        return i
+
+    def span(self, i: int) -> tuple[int, int]:
+        i = self._position(i)
+        return self.offsets[i], self.offsets[i + 1]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._parse(self.data, self.offsets[self._position(i)])[0]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self.offsets.release()
+        self._index_map.close()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self._index_file.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_indexed(path: str, module, struct: str, index: str | None = None, update: bool = True) -> IndexedFile:
+    return IndexedFile(path, module, struct, index, update)
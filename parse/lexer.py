@@ -6,6 +6,7 @@ class TokenType(StrEnum):
     IDENT = auto()
     INTEGER = auto()
     SIZE = auto()
+    BITSIZE = auto()
     REGULARSIZE = auto()
     FLOAT = auto()
     STRING = auto()
@@ -50,8 +51,11 @@ class Match:
         "uint8","uint16","uint32","uint64","int8","int16","int32","int64",
         "float","double"
     }
+    # switch, case, default, bytes and until are only words inside a
+    # declaration; the parser picks them out of identifiers, so fields can
+    # still have those names
     KEYWORDS = {
-        "struct","code",
+        "struct","code","import",
         "if","elif","else","raise",
         "front","behind","big","little",
         "define","undef","ifdef","ifndef","endif",
@@ -73,9 +77,9 @@ class Match:
         "=":TokenType.EQUALS
     }
 
-def lex(code: str) -> list[Token]:
+def lex(code: str, line: int = 1) -> list[Token]:
+    # `line` is where `code` starts when it is a piece of a larger file
     index = 0
-    line = 1
     column = 1
     code_length = len(code)
     tokens = []
@@ -140,9 +144,9 @@ def lex(code: str) -> list[Token]:
             column += len(text)
         elif (match := Match.IDENT.match(code, index)):
             text = match.group()
-            if text in ("B","b") and tokens[-1][0] == TokenType.INTEGER:
+            if text in ("B","b") and tokens and tokens[-1][0] == TokenType.INTEGER:
                 text = tokens.pop()[1]+text
-                token_type = TokenType.SIZE
+                token_type = TokenType.SIZE if text[-1] == "B" else TokenType.BITSIZE
             elif text in Match.REGULARSIZES:
                 token_type = TokenType.REGULARSIZE
             elif text in Match.PREPROCESSORS:
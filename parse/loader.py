@@ -0,0 +1,665 @@
+import ast
+import os
+import sys
+import types
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from collections.abc import Mapping
+from dataclasses import dataclass, fields, is_dataclass, replace
+from itertools import count
+from typing import NamedTuple
+from . import ast_, code_gen, lexer, parser
+from .analysis import fingerprint
+
+# numbers the modules of compiled files, see Loader._compile
+_modules = count()
+_loaders_made = count()
+# module name -> (settings of its Loader, .spp path), what restore() needs
+# to compile it again in a process that did not inherit it
+_registered = {}
+
+# functions a generated module defines per struct, shared with importers
+EXPORTS = ("parse{}", "skip{}", "specialize{}", "specializeSkip{}", "parse{}_batch", "arena{}", "layout{}", "patch{}")
+
+def preprocess(program: ast_.Program, defines: dict[str, str] | None = None) -> ast_.Program:
+    """Applies #define, #undef, #ifdef, #ifndef and #endif.
+
+    `defines` are names defined before the file, like -D for a C compiler;
+    a value is source text. A defined value is parsed as an expression and
+    replaces the name wherever the name is read, so `#define COUNT 4` makes
+    `uint8[COUNT]` read 4 bytes. Conditional sections must be closed in the
+    block that opened them.
+    """
+    defines = dict(defines or {})
+    parsed = {}
+
+    def value(name):
+        if name not in parsed:
+            parsed[name] = parser.Parser(lexer.lex(defines[name])).parse_expression()
+        return parsed[name]
+
+    def block(items):
+        result = []
+        active = []
+        for item in items:
+            if isinstance(item, ast_.Preprocessor):
+                if item.name in ("ifdef", "ifndef"):
+                    if not item.args:
+                        raise ValueError(f"#{item.name} needs a name")
+                    active.append((item.args[0] in defines) == (item.name == "ifdef"))
+                elif item.name == "endif":
+                    if not active:
+                        raise ValueError("#endif without #ifdef or #ifndef")
+                    active.pop()
+                elif all(active) and item.name in ("define", "undef"):
+                    if not item.args:
+                        raise ValueError(f"#{item.name} needs a name")
+                    parsed.pop(item.args[0], None)
+                    if item.name == "define":
+                        defines[item.args[0]] = " ".join(item.args[1:])
+                    else:
+                        defines.pop(item.args[0], None)
+                continue
+            if all(active):
+                result.append(substitute(item))
+        if active:
+            raise ValueError("#ifdef or #ifndef without #endif")
+        return result
+
+    def substitute(node):
+        if isinstance(node, ast_.Identifier):
+            if defines.get(node.name):
+                return value(node.name)
+            return node
+        if isinstance(node, list):
+            return block(node)
+        if is_dataclass(node):
+            # names and types of declarations are never values
+            changes = {field.name: substitute(getattr(node, field.name)) for field in fields(node)
+                       if field.name not in ("name", "type", "params")}
+            return replace(node, **changes)
+        return node
+
+    return ast_.Program(block(program.items))
+
+
+class Schema(NamedTuple):
+    path: str
+    mtime: float
+    imports: list[str]
+    structs: dict[str, ast_.Struct]   # own and imported
+    kept: dict[str, set[str]]   # fields the skip function of each struct keeps
+    exports: dict[str, object]
+    module: types.ModuleType
+
+
+class SourceMap(Mapping):
+    """SOURCE_MAP of a loaded module: generated line -> (.spp line, column, "Struct.field").
+
+    Entries are kept per struct relative to where the struct starts, so a
+    struct that only moved in the .spp file is updated once, not per line.
+    """
+    def __init__(self):
+        self.starts = []   # sorted first generated lines of the structs
+        self.blocks = {}   # first line -> [.spp line of the struct, {offset: (offset, column, name)}]
+
+    def add(self, start: int, line: int, entries: dict[int, tuple[int, int, str]]) -> None:
+        """Adds a struct generated at line `start` from .spp `line`; `entries` count lines from 1."""
+        self.starts.insert(bisect_right(self.starts, start), start)
+        self.blocks[start] = [line, {number - 1: (spp_line - line, column, name)
+                                     for number, (spp_line, column, name) in entries.items()}]
+
+    def remove(self, start: int) -> None:
+        self.starts.remove(start)
+        del self.blocks[start]
+
+    def move(self, start: int, line: int) -> None:
+        self.blocks[start][0] = line
+
+    def __getitem__(self, line: int) -> tuple[int, int, str]:
+        index = bisect_right(self.starts, line) - 1
+        if index < 0:
+            raise KeyError(line)
+        start = self.starts[index]
+        base, entries = self.blocks[start]
+        offset, column, name = entries[line - start]
+        return base + offset, column, name
+
+    def __iter__(self):
+        for start in self.starts:
+            for offset in self.blocks[start][1]:
+                yield start + offset
+
+    def __len__(self) -> int:
+        return sum(len(entries) for _, entries in self.blocks.values())
+
+
+@dataclass(slots=True)
+class _Item:
+    node: object   # preprocessed, positions as of when it was parsed
+    first: int   # .spp lines it spans now
+    last: int
+    shift: int   # lines it moved since it was parsed
+    fingerprint: tuple
+
+
+@dataclass(slots=True)
+class _Block:
+    start: int   # first generated line
+    count: int
+    line: int   # .spp line of the struct when it was generated
+    names: list[str]   # globals it defines
+
+
+def _moved(node, lines: int):
+    """A copy of `node` whose positions are `lines` further down."""
+    if isinstance(node, list):
+        return [_moved(item, lines) for item in node]
+    if is_dataclass(node):
+        changes = {field.name: _moved(getattr(node, field.name), lines) for field in fields(node) if field.name != "pos"}
+        if hasattr(node, "pos"):
+            changes["pos"] = (node.pos[0] + lines, node.pos[1])
+        return replace(node, **changes)
+    return node
+
+def _defined(tree: ast.Module) -> list[tuple[int, str]]:
+    """(line, name) of the globals a module defines."""
+    found = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            found.append((node.lineno, node.name))
+        elif isinstance(node, ast.Assign):
+            found += [(node.lineno, target.id) for target in node.targets if isinstance(target, ast.Name)]
+    return found
+
+def _common(first: list, second: list, step: int = 256) -> int:
+    """Length of the common prefix of two lists, compared `step` items at a time in C."""
+    limit = min(len(first), len(second))
+    index = 0
+    while index + step <= limit and first[index:index + step] == second[index:index + step]:
+        index += step
+    while index < limit and first[index] == second[index]:
+        index += 1
+    return index
+
+
+class _Build:
+    """What an incremental recompile of a schema starts from.
+
+    Besides the parsed items and the generated blocks, it indexes which
+    fields every struct reads and which structs use which, so an edit only
+    costs in proportion to what it touches. A failed update leaves it
+    inconsistent; the Loader drops it and compiles the file whole.
+    """
+    def __init__(self, lines: list[str], items: list[_Item], imported: list[Schema],
+                 generator: code_gen.Generator, blocks: dict[str, _Block], length: int):
+        self.lines = lines
+        self.items = items
+        self.imported = imported
+        self.generator = generator
+        self.blocks = blocks
+        self.length = length   # first generated line not used yet
+        self.own = {item.node.name: item for item in items if isinstance(item.node, ast_.Struct)}
+        analysis = generator.analysis
+        self.marks = {}
+        self.counts = {}   # struct -> field -> number of reads
+        self.watchers = {}   # struct -> structs whose reads go through it
+        for name in analysis.structs:
+            self._mark(name)
+        self.users = {}
+        for name in analysis.structs:
+            for used in analysis.uses(name):
+                self.users.setdefault(used, set()).add(name)
+        self.interfaces = {name: self._interface(name) for name in analysis.structs}
+
+    def _mark(self, name: str) -> set[str]:
+        found, visited = self.marks[name] = self.generator.analysis.marks(name)
+        for struct, field in found:
+            fields_ = self.counts.setdefault(struct, {})
+            fields_[field] = fields_.get(field, 0) + 1
+        for struct in visited:
+            self.watchers.setdefault(struct, set()).add(name)
+        return {struct for struct, _ in found}
+
+    def _unmark(self, name: str) -> set[str]:
+        found, visited = self.marks.pop(name, (set(), set()))
+        for struct, field in found:
+            fields_ = self.counts[struct]
+            fields_[field] -= 1
+            if not fields_[field]:
+                del fields_[field]
+        for struct in visited:
+            self.watchers[struct].discard(name)
+        return {struct for struct, _ in found}
+
+    def _interface(self, name: str) -> tuple | None:
+        # what the code generated for a struct's users depends on
+        analysis = self.generator.analysis
+        struct = analysis.structs.get(name)
+        if struct is None:
+            return None
+        return (tuple(param.name for param in struct.params), analysis.static_size(name),
+                analysis.fixed_shape(name), analysis.points(name), analysis.raises(name),
+                frozenset(self.generator.needed[name]))
+
+    def splice(self, lines: list[str], parse) -> tuple[list[_Item], list[_Item], list[_Item]] | None:
+        """The items of the edited lines, with the ones the edit removed and added.
+
+        Only the lines around the edit go through `parse`. None when the
+        edit has to be parsed with the whole file: block comments and
+        strings may span items, and globals affect every struct.
+        """
+        old = self.lines
+        start = _common(old, lines)
+        end = _common(old[start:][::-1], lines[start:][::-1])
+        # old lines first..stop - 1 changed, counting from 1
+        first, stop = start + 1, len(old) - end + 1
+        delta = len(lines) - len(old)
+        items = self.items
+        index = bisect_right([item.last for item in items], first - 1)
+        until = index
+        while until < len(items) and items[until].first < stop:
+            until += 1
+        low, high = first, stop - 1
+        if index < until:
+            low, high = min(low, items[index].first), max(high, items[until - 1].last)
+        # items sharing a line with the edit are parsed again too
+        while index > 0 and items[index - 1].last >= low:
+            index -= 1
+            low = min(low, items[index].first)
+        while until < len(items) and items[until].first <= high:
+            high = max(high, items[until].last)
+            until += 1
+        before = "\n".join(old[low - 1:high])
+        after = "\n".join(lines[low - 1:high + delta])
+        if '/*' in before or '"' in before or '"' in after:
+            return None
+        removed = items[index:until]
+        if not all(isinstance(item.node, ast_.Struct) for item in removed):
+            return None
+        try:
+            added = parse(after, low)
+        except (SyntaxError, parser.ParseError, EOFError):
+            return None
+        if not all(isinstance(item.node, ast_.Struct) for item in added):
+            return None
+        if delta:
+            for item in items[until:]:
+                item.first += delta
+                item.last += delta
+                item.shift += delta
+        return items[:index] + added + items[until:], removed, added
+
+    def edit(self, path: str, items: list[_Item], removed: list[_Item], added: list[_Item],
+             external: dict[str, set[str]]) -> tuple[set[str], set[str], set[str]]:
+        """Applies the new items to the indexes.
+
+        Returns the structs to generate again, the removed ones and those
+        whose needed fields changed.
+        """
+        before = {item.node.name: item.fingerprint for item in removed if isinstance(item.node, ast_.Struct)}
+        for name in before:
+            del self.own[name]
+        for item in added:
+            if isinstance(item.node, ast_.Struct):
+                if item.node.name in external:
+                    raise ValueError(f"Struct {item.node.name!r} of {path} is also imported")
+                if item.node.name in self.own:
+                    raise ValueError(f"Struct {item.node.name!r} is defined twice in {path}")
+                self.own[item.node.name] = item
+        self.items = items
+        changed = before.keys() | {item.node.name for item in added if isinstance(item.node, ast_.Struct)}
+        dirty = {name for name in changed if name not in self.own or before.get(name) != self.own[name].fingerprint}
+        gone = before.keys() - self.own.keys()
+
+        analysis = self.generator.analysis
+        for name in dirty & analysis.structs.keys():
+            for used in analysis.uses(name):
+                self.users[used].discard(name)
+        self.generator.update({name: self.own[name].node if name in self.own else None for name in dirty})
+        for name in dirty & self.own.keys():
+            for used in analysis.uses(name):
+                self.users.setdefault(used, set()).add(name)
+
+        recheck = set(dirty)
+        for name in dirty:
+            recheck |= self.watchers.get(name, set())
+        touched = set(dirty)
+        for name in recheck:
+            touched |= self._unmark(name)
+            if name in analysis.structs:
+                touched |= self._mark(name)
+        needed = self.generator.needed
+        needs = set()   # structs whose needed fields changed
+        for name in touched:
+            if name not in analysis.structs:
+                needed.pop(name, None)
+                continue
+            fields_ = set(self.counts.get(name, ()))
+            if fields_ != needed.get(name):
+                needed[name] = fields_
+                needs.add(name)
+
+        # regenerate the edited structs, then the users of any struct
+        # whose interface changed, until nothing changes
+        regenerate = set()
+        pending = dirty | needs
+        while pending:
+            analysis.forget(pending)
+            regenerate |= pending & self.own.keys()
+            changed = set()
+            for name in pending:
+                interface = self._interface(name)
+                if interface != self.interfaces.get(name):
+                    self.interfaces[name] = interface
+                    changed.add(name)
+            pending = set()
+            for name in changed:
+                pending |= self.users.get(name, set())
+        for name in gone:
+            self.interfaces.pop(name, None)
+        return regenerate, gone, needs
+
+    def apply(self, module: types.ModuleType, regenerate: set[str], gone: set[str]) -> None:
+        """Generates `regenerate` again into `module` and drops `gone`."""
+        source_map = module.SOURCE_MAP
+        replaced = [self.blocks.pop(name) for name in regenerate | gone if name in self.blocks]
+        body = []
+        added = []
+        generated = []
+        for name in sorted(regenerate, key=lambda name: self.own[name].first):
+            item = self.own[name]
+            if item.shift:
+                item.node = _moved(item.node, item.shift)
+                item.shift = 0
+            generated.append((name, item, self.generator.generate_item(item.node)))
+        # runtime helpers the new code calls that the module has no use for yet
+        helpers = self.generator.runtime("".join(this_block for _, _, this_block in generated), module.__dict__)
+        if helpers:
+            tree = ast.parse(helpers, module.__file__)
+            ast.increment_lineno(tree, self.length - 1)
+            body += tree.body
+            self.length += helpers.count("\n") + 1
+        for name, item, this_block in generated:
+            tree = ast.parse(this_block, module.__file__)
+            ast.increment_lineno(tree, self.length - 1)
+            body += tree.body
+            count = this_block.count("\n") + 1
+            self.blocks[name] = _Block(self.length, count, item.first, [defined for _, defined in _defined(tree)])
+            added.append((self.length, item.first, code_gen.source_map(this_block)))
+            self.length += count
+        code = compile(ast.Module(body, []), module.__file__, "exec")
+        for block in replaced:
+            source_map.remove(block.start)
+            for defined in block.names:
+                module.__dict__.pop(defined, None)
+        exec(code, module.__dict__)
+        for start, line, entries in added:
+            source_map.add(start, line, entries)
+
+
+class Loader:
+    """Compiles .spp files to modules, each file once.
+
+    `import "common.spp"` makes the structs of common.spp and of its own
+    imports usable in a schema. They are generated once, in common.spp's
+    module, and every importer calls those functions. Paths are relative to
+    the importing file, then to the `search` directories. A file changed on
+    disk is recompiled, together with the files importing it.
+
+    Recompiling is incremental: only the lines around an edit are parsed
+    again, and only structs whose fingerprint changed are generated again,
+    together with the users of a struct whose parameters, size, shape or
+    needed fields changed. Their code is executed into the module already
+    loaded. A file compiles whole when it has preprocessor directives, when
+    its imports or globals were edited, or when a file it imports changed.
+
+    `variants` lists the code_gen.VARIANTS generated for every struct of
+    every file, since importers call the functions of imported modules.
+
+    Modules are registered in sys.modules under names of their own, so
+    their functions pickle by reference. Forked processes inherit them;
+    pools started otherwise (spawn, forkserver) need process_pool(), whose
+    workers compile the files again under the same names.
+    """
+    def __init__(self, defines: dict[str, str] | None = None, search=(), instrument: bool = False,
+                 extra: dict[str, list[ast_.Expression]] | None = None, variants=()):
+        self.defines = dict(defines or {})
+        self.search = list(search)
+        self.instrument = instrument
+        self.variants = tuple(variants)
+        # expressions read from outside per struct, see Generator
+        self.extra = dict(extra or {})
+        self.schemas = {}
+        self.builds = {}
+        self.loading = []
+        # path -> module name to compile it under, set by restore()
+        self.names = {}
+        self.number = next(_loaders_made)
+
+    def settings(self) -> tuple:
+        return self.number, self.defines, self.search, self.instrument, self.extra, self.variants
+
+    def schema(self, path: str) -> Schema:
+        return self._load(os.path.abspath(path))
+
+    def load(self, path: str) -> types.ModuleType:
+        return self.schema(path).module
+
+    def _resolve(self, path: str, importer: str) -> str:
+        for directory in [os.path.dirname(importer)] + self.search:
+            candidate = os.path.abspath(os.path.join(directory, path))
+            if os.path.exists(candidate):
+                return candidate
+        raise FileNotFoundError(f"Cannot find {path!r} imported by {importer}")
+
+    def _fresh(self, path: str) -> bool:
+        schema = self.schemas.get(path)
+        if schema is None or os.stat(path).st_mtime != schema.mtime:
+            return False
+        return all(self._fresh(imported) for imported in schema.imports)
+
+    def _load(self, path: str) -> Schema:
+        if self._fresh(path):
+            return self.schemas[path]
+        if path in self.loading:
+            raise ImportError(f"Circular import: {' -> '.join(self.loading + [path])}")
+        self.loading.append(path)
+        try:
+            mtime = os.stat(path).st_mtime
+            with open(path) as file:
+                text = file.read()
+            schema = None
+            build = self.builds.pop(path, None)
+            if build is not None:
+                schema = self._update(path, mtime, text, build)
+            if schema is None:
+                schema = self._compile(path, mtime, text)
+            self.schemas[path] = schema
+            return schema
+        finally:
+            self.loading.pop()
+
+    def _items(self, text: str, line: int = 1) -> list[_Item]:
+        tokens = lexer.lex(text, line)
+        reader = parser.Parser(tokens)
+        items = []
+        while reader.current() is not None:
+            first = reader.current().position[0]
+            node = reader.parse_item()
+            end = reader.index - 1
+            while tokens[end].type == lexer.TokenType.WHITESPACE:
+                end -= 1
+            last = tokens[end].position[0] + tokens[end].value.count("\n")
+            if isinstance(node, ast_.Struct):
+                if self.defines:
+                    node = preprocess(ast_.Program([node]), self.defines).items[0]
+                items.append(_Item(node, first, last, 0, fingerprint(node, node.pos[0])))
+            else:
+                items.append(_Item(node, first, last, 0, ()))
+        return items
+
+    def _imports(self, path: str, items) -> list[Schema]:
+        return [self._load(self._resolve(item.path, path)) for item in items if isinstance(item, ast_.Import)]
+
+    def _compile(self, path: str, mtime: float, text: str) -> Schema:
+        items = self._items(text)
+        plain = not any(isinstance(item.node, ast_.Preprocessor) for item in items)
+        if plain:
+            program = ast_.Program([item.node for item in items])
+        else:
+            program = preprocess(parser.Parser(lexer.lex(text)).parse_program(), self.defines)
+        imported = self._imports(path, program.items)
+        structs = {}
+        kept = {}
+        exports = {}
+        for schema in imported:
+            structs.update(schema.structs)
+            kept.update(schema.kept)
+            exports.update(schema.exports)
+        own = [item for item in program.items if isinstance(item, ast_.Struct)]
+        names = set()
+        for struct in own:
+            if struct.name in structs:
+                raise ValueError(f"Struct {struct.name!r} of {path} is also imported")
+            if struct.name in names:
+                raise ValueError(f"Struct {struct.name!r} is defined twice in {path}")
+            names.add(struct.name)
+        external = dict(kept)
+        generator = code_gen.Generator(ast_.Program(list(structs.values()) + program.items), self.instrument, external, self.extra,
+                                       self.variants)
+        # the blocks are kept apart to know the lines of each struct
+        generated = [(item, generator.generate_item(item)) for item in program.items]
+        header = generator.runtime("".join(this_block for _, this_block in generated if this_block is not None))
+        pieces = [header]
+        length = header.count("\n") + 1
+        source_map = SourceMap()
+        blocks = {}
+        for item, this_block in generated:
+            if this_block is None:
+                continue
+            count = this_block.count("\n") + 1
+            if isinstance(item, ast_.Struct):
+                blocks[item.name] = _Block(length, count, item.pos[0], [])
+                source_map.add(length, item.pos[0], code_gen.source_map(this_block))
+            pieces.append(this_block + "\n")
+            length += count
+        code = "".join(pieces)
+        # registered under a name of its own, so its functions pickle by
+        # reference into process pools and never resolve to a module of the
+        # same file name, like example.py
+        name = self.names.get(path) or f"spp_{os.path.splitext(os.path.basename(path))[0]}_{next(_modules)}"
+        module = types.ModuleType(name)
+        module.__file__ = path + ".py"
+        previous = self.schemas.get(path)
+        if previous is not None:
+            sys.modules.pop(previous.module.__name__, None)
+            _registered.pop(previous.module.__name__, None)
+        sys.modules[name] = module
+        _registered[name] = self.settings(), path
+        module.__dict__.update(exports)
+        module.SOURCE_MAP = source_map
+        tree = ast.parse(code, module.__file__)
+        exec(compile(tree, module.__file__, "exec"), module.__dict__)
+        for struct in own:
+            structs[struct.name] = struct
+            kept[struct.name] = generator.needed[struct.name]
+            for export in EXPORTS:
+                name = export.format(struct.name)
+                if name in module.__dict__:
+                    exports[name] = module.__dict__[name]
+        # the incremental bookkeeping only counts the schema's own
+        # expressions, with `extra` edited files compile whole
+        if plain and not self.extra:
+            owners = {block.start: name for name, block in blocks.items()}
+            for line, defined in _defined(tree):
+                index = bisect_right(source_map.starts, line) - 1
+                if index >= 0:
+                    block = blocks[owners[source_map.starts[index]]]
+                    if line < block.start + block.count:
+                        block.names.append(defined)
+            self.builds[path] = _Build(text.split("\n"), items, imported, generator, blocks, length)
+        return Schema(path, mtime, [schema.path for schema in imported], structs, kept, exports, module)
+
+    def _update(self, path: str, mtime: float, text: str, build: _Build) -> Schema | None:
+        """Recompiles what an edit changed into the loaded module, None if the file has to be compiled whole."""
+        lines = text.split("\n")
+        spliced = None if '/*' in text else build.splice(lines, self._items)
+        if spliced is None:
+            items = self._items(text)
+            if any(isinstance(item.node, ast_.Preprocessor) for item in items):
+                return None
+            globals_ = [fingerprint(item.node, item.first) for item in items if not isinstance(item.node, ast_.Struct)]
+            if globals_ != [fingerprint(item.node, item.first) for item in build.items
+                            if not isinstance(item.node, ast_.Struct)]:
+                return None
+            spliced = items, build.items, items
+        items, removed, added = spliced
+        # the imports are unchanged, but the imported files may have been edited
+        imported = [self._load(schema.path) for schema in build.imported]
+        if any(schema is not previous for schema, previous in zip(imported, build.imported)):
+            return None
+        external = {}
+        for schema in imported:
+            external.update(schema.kept)
+        regenerate, gone, needs = build.edit(path, items, removed, added, external)
+        previous = self.schemas[path]
+        module = previous.module
+        build.apply(module, regenerate, gone)
+        for item in items if len(lines) != len(build.lines) else added:
+            if isinstance(item.node, ast_.Struct):
+                block = build.blocks[item.node.name]
+                if item.first != block.line:
+                    # moved without changing: only its place in the .spp file differs
+                    module.SOURCE_MAP.move(block.start, item.first)
+                    block.line = item.first
+        build.lines = lines
+
+        structs = dict(previous.structs)
+        kept = dict(previous.kept)
+        exports = dict(previous.exports)
+        for name in gone:
+            del structs[name], kept[name]
+        for name in regenerate | gone:
+            for export in EXPORTS:
+                exports.pop(export.format(name), None)
+        for name in regenerate:
+            structs[name] = build.own[name].node
+            for export in EXPORTS:
+                if export.format(name) in module.__dict__:
+                    exports[export.format(name)] = module.__dict__[export.format(name)]
+        for name in needs & build.own.keys():
+            kept[name] = build.generator.needed[name]
+        self.builds[path] = build
+        return Schema(path, mtime, previous.imports, structs, kept, exports, module)
+
+
+_loaders = {}
+
+def restore(registered: dict[str, tuple]) -> None:
+    """Compiles the modules of `registered` again, under the same names.
+
+    The initializer of process_pool() workers. Modules already in
+    sys.modules, like those of forked workers, are kept. The files are read
+    again, so they should not change while the pool runs.
+    """
+    loaders = {}
+    for name, (settings, path) in registered.items():
+        if name in sys.modules:
+            continue
+        number, defines, search, instrument, extra, variants = settings
+        if number not in loaders:
+            loaders[number] = Loader(defines, search, instrument, extra, variants)
+            loaders[number].names = {other: module for module, (them, other) in registered.items() if them[0] == number}
+        loaders[number].load(path)
+
+def process_pool(workers: int | None = None, mp_context=None) -> ProcessPoolExecutor:
+    """A ProcessPoolExecutor whose workers can import the modules loaded so far, whatever the start method."""
+    return ProcessPoolExecutor(workers, mp_context, initializer=restore, initargs=(dict(_registered),))
+
+def load(path: str, defines: dict[str, str] | None = None, variants=()) -> types.ModuleType:
+    """Compiles `path` through a shared Loader, so each schema compiles once per process."""
+    key = tuple(sorted((defines or {}).items())), tuple(sorted(variants))
+    if key not in _loaders:
+        _loaders[key] = Loader(defines, variants=variants)
+    return _loaders[key].load(path)
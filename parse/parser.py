@@ -8,7 +8,7 @@ class ParseError(Exception):
 class Parser:
     def __init__(self, tokens: list[Token]):
         self.tokens = tokens
-        self.index = 0
+        self.index = self._get_token(0)[1]
     def _get_token(self, oindex, w=True):
         if oindex >= len(self.tokens):
             return None, oindex
@@ -116,7 +116,7 @@ class Parser:
                 node = FieldAccess(node.pos, node, field_tok.value)
             return node
 
-        if tok.type in (TokenType.INTEGER, TokenType.SIZE, TokenType.FLOAT):
+        if tok.type in (TokenType.INTEGER, TokenType.SIZE, TokenType.BITSIZE, TokenType.FLOAT):
             self.next()
             return NumberLiteral(tok.position, tok.value)
         
@@ -269,18 +269,29 @@ class Parser:
             raise ParseError(f"Expected ':' after identifier in declaration at {name_tok.position}")
         # consume ':'
         self.next()
-    
+
+        cur = self.current()
+        if cur is not None and (cur.type, cur.value) == (TokenType.IDENT, "switch") and self.match(TokenType.PAREN_LEFT):
+            return self.parse_switch(name_tok)
+        return self.parse_declared(name_tok)
+
+    def parse_declared(self, name_tok):
+        # the part of a declaration after "name:", also used for switch cases
         type_tok = self.current()
         if type_tok is None:
             raise ParseError(f"Expected type after ':' at {name_tok.position}")
-        if type_tok.type not in (TokenType.IDENT,TokenType.REGULARSIZE, TokenType.SIZE):
+        if type_tok.type not in (TokenType.IDENT,TokenType.REGULARSIZE, TokenType.SIZE, TokenType.BITSIZE):
             raise ParseError(f"Expected type after ':' at {type_tok.position}")
         # consume type
         self.next()
         if type_tok.type == TokenType.SIZE:
             type_expr = Size(type_tok.position, NumberLiteral(type_tok.position, type_tok.value))
+        elif type_tok.type == TokenType.BITSIZE:
+            type_expr = BitSize(type_tok.position, NumberLiteral(type_tok.position, type_tok.value))
         elif type_tok.type == TokenType.REGULARSIZE:
             type_expr = RegularSize(type_tok.position, type_tok.value)
+        elif type_tok.value == "bytes":
+            type_expr = Bytes(type_tok.position)
         else:
             type_expr = Identifier(type_tok.position, type_tok.value)
     
@@ -316,7 +327,14 @@ class Parser:
         cur = self.current()
         if cur is not None and cur.type == TokenType.BRACK_LEFT:
             self.next()  # consume '['
-            array_expr = self.parse_expression()
+            cur = self.current()
+            # `until` followed by a value starts a terminator, otherwise it is a field
+            if cur is not None and (cur.type, cur.value) == (TokenType.IDENT, "until") \
+                    and self.match(TokenType.INTEGER, TokenType.FLOAT, TokenType.STRING, TokenType.IDENT, TokenType.PAREN_LEFT):
+                self.next()  # consume 'until'
+                array_expr = Until(cur.position, self.parse_expression())
+            else:
+                array_expr = self.parse_expression()
             cur = self.current()
             if cur is None or cur.type != TokenType.BRACK_RIGHT:
                 raise ParseError(f"Expected ']' after array expression at {type_tok.position}")
@@ -327,6 +345,39 @@ class Parser:
             self.next()  # consume '='
             default_expr = self.parse_expression()
     
+        annotations = []
+        while True:
+            cur = self.current()
+            if cur is None or cur.type != TokenType.ATSIGN:
+                break
+            self.next()  # consume '@'
+            annotation_tok = self.current()
+            if annotation_tok is None or annotation_tok.type != TokenType.IDENT:
+                raise ParseError(f"Expected annotation name after '@' at {cur.position}")
+            self.next()  # consume name
+            cur = self.current()
+            if cur is None or cur.type != TokenType.PAREN_LEFT:
+                raise ParseError(f"Expected '(' after @{annotation_tok.value} at {annotation_tok.position}")
+            self.next()  # consume '('
+            args = []
+            while True:
+                cur = self.current()
+                if cur is None:
+                    raise ParseError(f"Unterminated annotation at {annotation_tok.position}")
+                if cur.type == TokenType.PAREN_RIGHT:
+                    break
+                args.append(self.parse_expression())
+                cur = self.current()
+                if cur is not None and cur.type == TokenType.COMMA:
+                    self.next()  # consume ','
+                    continue
+                break
+            cur = self.current()
+            if cur is None or cur.type != TokenType.PAREN_RIGHT:
+                raise ParseError(f"Expected ')' to close @{annotation_tok.value} at {annotation_tok.position}")
+            self.next()  # consume ')'
+            annotations.append(Annotation(annotation_tok.position, annotation_tok.value, args))
+    
         cur = self.current()
         if cur is None or cur.type != TokenType.SEMICOLON:
             raise ParseError(f"Expected ';' after declaration at {type_tok.position}")
@@ -337,9 +388,67 @@ class Parser:
             Identifier(name_tok.position, name_tok.value),
             type_expr,
             array_expr,
-            default_expr
+            default_expr,
+            annotations
         )
 
+    def parse_switch(self, name_tok):
+        switch_tok = self.current()
+        # consume 'switch'
+        self.next()
+
+        cur = self.current()
+        if cur is None or cur.type != TokenType.PAREN_LEFT:
+            raise ParseError(f"Expected '(' after switch at {switch_tok.position}")
+        self.next()
+
+        subject = self.parse_expression()
+
+        cur = self.current()
+        if cur is None or cur.type != TokenType.PAREN_RIGHT:
+            raise ParseError(f"Expected ')' after switch value at {switch_tok.position}")
+        self.next()
+
+        cur = self.current()
+        if cur is None or cur.type != TokenType.BRACE_LEFT:
+            raise ParseError(f"Expected '{{' after switch at {switch_tok.position}")
+        self.next()
+
+        cases = []
+        while True:
+            cur = self.current()
+            if cur is None:
+                raise ParseError(f"Unterminated switch (expected '}}') at {switch_tok.position}")
+            if cur.type == TokenType.BRACE_RIGHT:
+                break
+            if cur.type != TokenType.IDENT or cur.value not in ("case", "default"):
+                raise ParseError(f"Expected 'case' or 'default' in switch at {cur.position}")
+            case_tok = cur
+            # consume 'case' / 'default'
+            self.next()
+            values = []
+            if case_tok.value == "case":
+                while True:
+                    values.append(self.parse_expression())
+                    cur = self.current()
+                    if cur is not None and cur.type == TokenType.COMMA:
+                        self.next()  # consume ','
+                        continue
+                    break
+            cur = self.current()
+            if cur is None or cur.type != TokenType.COLON:
+                raise ParseError(f"Expected ':' after {case_tok.value} at {case_tok.position}")
+            # consume ':'
+            self.next()
+            cases.append(SwitchCase(case_tok.position, values, self.parse_declared(name_tok)))
+
+        # consume '}'
+        self.next()
+        cur = self.current()
+        if cur is not None and cur.type == TokenType.SEMICOLON:
+            self.next()  # optional ';'
+        return Switch(name_tok.position, Identifier(name_tok.position, name_tok.value), subject, cases)
+
     def parse_if(self):
         if_tok = self.current()
         if if_tok is None or if_tok.type != TokenType.KEYWORD or if_tok.value != "if":
@@ -402,7 +511,7 @@ class Parser:
             block = self.parse_block()
             else_block_node = block
 
-        return IfThenElse(if_block_node.pos, if_block_node, elif_blocks, else_block_node)
+        return IfThenElse(if_tok.position, if_block_node, elif_blocks, else_block_node)
 
     # --- top-level parsing ---
     def parse_struct(self):
@@ -502,20 +611,33 @@ class Parser:
             self.next()
         return SpecialGlobal(name_tok.position, name_tok.value, arg)
 
+    def parse_import(self):
+        import_tok = self.current()
+        # consume 'import'
+        self.next()
+        path_tok = self.current()
+        if path_tok is None or path_tok.type != TokenType.STRING:
+            raise ParseError(f"Expected file name string after import at {import_tok.position}")
+        self.next()
+        cur = self.current()
+        if cur is not None and cur.type == TokenType.SEMICOLON:
+            self.next()  # optional ';'
+        return Import(import_tok.position, path_tok.value[1:-1])
+
     def parse_program(self):
         items = []
-        while True:
-            cur = self.current()
-            if cur is None:
-                break
-            if cur.type == TokenType.HASHTAG:
-                items.append(self.parse_preprocessor())
-                continue
-            if cur.type == TokenType.ATSIGN:
-                items.append(self.parse_special_global())
-                continue
-            if cur.type == TokenType.KEYWORD:
-                items.append(self.parse_struct())
-                continue
-            raise ParseError(f"Unexpected top-level token {cur.value} at {cur.position}")
+        while self.current() is not None:
+            items.append(self.parse_item())
         return Program(items)
+
+    def parse_item(self):
+        cur = self.current()
+        if cur.type == TokenType.HASHTAG:
+            return self.parse_preprocessor()
+        if cur.type == TokenType.ATSIGN:
+            return self.parse_special_global()
+        if cur.type == TokenType.KEYWORD and cur.value == "import":
+            return self.parse_import()
+        if cur.type == TokenType.KEYWORD:
+            return self.parse_struct()
+        raise ParseError(f"Unexpected top-level token {cur.value} at {cur.position}")
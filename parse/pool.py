@@ -0,0 +1,36 @@
+from concurrent.futures import Executor, ThreadPoolExecutor
+from itertools import repeat
+import os
+
+def parse_threaded(module, struct: str, buffers, offsets=None, extras: dict | None = None,
+                   workers: int | None = None, chunk: int = 1024, executor: Executor | None = None) -> list[dict]:
+    """Parses many `struct` records on a pool of threads, results in order.
+
+    Takes the records like parse<Struct>_batch: a list of buffers read from
+    offset 0, or one buffer with `offsets`, through that function when the
+    module was generated with the "batch" variant. Generated parsers keep no state
+    between calls, so chunks of `chunk` records decode independently; on a
+    free-threaded build (python3.13t and later) they run on separate cores,
+    with the GIL they take turns. `extras` are the arguments of a
+    parameterized struct, which has no batch function and is parsed record
+    by record. `executor` reuses a pool instead of starting one of
+    `workers` threads (default os.cpu_count()).
+    """
+    batch = getattr(module, f"parse{struct}_batch", None)
+    if batch is None or extras:
+        parse = getattr(module, "parse" + struct)
+        def batch(buffers, offsets=None):
+            items = zip(buffers, repeat(0)) if offsets is None else zip(repeat(buffers), offsets)
+            return [parse(data, offset, **(extras or {}))[0] for data, offset in items]
+    count = len(buffers) if offsets is None else len(offsets)
+    def run(start):
+        if offsets is None:
+            return batch(buffers[start:start + chunk])
+        return batch(buffers, offsets[start:start + chunk])
+    if executor is None:
+        with ThreadPoolExecutor(workers or os.cpu_count()) as executor:
+            return parse_threaded(module, struct, buffers, offsets, extras, workers, chunk, executor)
+    results = []
+    for part in executor.map(run, range(0, count, chunk)):
+        results.extend(part)
+    return results
@@ -0,0 +1,119 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator
+import mmap
+import os
+from . import ast_, lexer, parser
+from .analysis import Analysis, field_paths
+from .code_gen import Generator
+from .loader import Loader
+
+# per process: (schema, struct, where, defines) -> (skip function, predicate)
+_QUERIES = {}
+
+# bytes of records a scan task reads before the parent gets its matches
+SCAN_CHUNK = 1 << 22
+
+def compile_predicate(where: str) -> ast_.Expression:
+    """Parses `where` with the expression grammar of .spp conditions."""
+    reader = parser.Parser(lexer.lex(where))
+    expression = reader.parse_expression()
+    if reader.current() is not None:
+        raise parser.ParseError(f"Unexpected {reader.current().value!r} in predicate at {reader.current().position}")
+    return expression
+
+def _query(schema: str, struct: str, where: str, defines: dict | None = None):
+    key = (schema, struct, where, tuple(sorted((defines or {}).items())))
+    if key not in _QUERIES:
+        expression = compile_predicate(where)
+        # the skip function keeps the fields the predicate reads and steps
+        # over the rest
+        loaded = Loader(defines, extra={struct: [expression]}, variants=("skip",)).schema(schema)
+        if struct not in loaded.structs:
+            raise KeyError(f"No struct {struct!r} in {schema}")
+        # a misspelt field would make every record silently fail to match
+        analysis = Analysis(ast_.Program(list(loaded.structs.values())))
+        for path in field_paths(expression):
+            missing = analysis.missing(struct, path)
+            if missing is not None:
+                raise KeyError(f"{struct} has no field {missing!r}")
+        predicate = eval(f"lambda ctx: {Generator(ast_.Program([])).expression(expression)}", {})
+        _QUERIES[key] = getattr(loaded.module, "skip" + struct), predicate
+    return _QUERIES[key]
+
+def scan_file(path: str, schema: str, struct: str, where: str, defines: dict | None = None) -> list[int]:
+    """Offsets of the `struct` records of `path` for which `where` holds.
+
+    Records are read back to back from the start of the file, like
+    build_index, until one is truncated or does not validate. A record
+    without a field the predicate reads, like one in an untaken branch,
+    does not match.
+    """
+    found = []
+    offset = 0
+    while offset is not None:
+        matches, offset = scan_range(path, schema, struct, where, defines, offset)
+        found += matches
+    return found
+
+def scan_range(path: str, schema: str, struct: str, where: str, defines: dict | None = None,
+               start: int = 0, chunk: int | None = None) -> tuple[list[int], int | None]:
+    """Like scan_file from the record at `start`, stopping after about `chunk` bytes.
+
+    Returns the matching offsets and where the next record starts, None
+    once the records end. Records have no size known before they are read,
+    so a file is cut into chunks in order: each one resumes where the last
+    stopped.
+    """
+    skip, predicate = _query(schema, struct, where, defines)
+    found = []
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if start >= size:
+            return found, None
+        stop = size if chunk is None else min(size, start + chunk)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = start
+            while offset < stop:
+                try:
+                    ctx, end = skip(data, offset)
+                except ValueError:
+                    return found, None
+                if end > size or end <= offset:
+                    return found, None
+                try:
+                    matches = predicate(ctx)
+                except (AttributeError, TypeError):
+                    matches = False
+                if matches:
+                    found.append(offset)
+                offset = end
+    return found, offset if offset < size else None
+
+def scan(paths, schema: str, struct: str, where: str, workers: int | None = None,
+         defines: dict | None = None, chunk: int | None = None) -> Iterator[tuple[str, int]]:
+    """Yields (path, offset) of every `struct` record in `paths` matching `where`.
+
+    `where` is a .spp expression over the fields of `struct`, for example
+    "dib_header.bpp.value != 24 && dib_header.width.value > 100". Files are
+    scanned in a pool of `workers` processes (default os.cpu_count()) that
+    only decode the fields the predicate reads. Each file is read in
+    chunks of about `chunk` bytes (default SCAN_CHUNK), and the matches of
+    a chunk are yielded as soon as it is done: in order within a file,
+    files interleaved. Workers compile the schema themselves, so the pool
+    works with any start method.
+    """
+    schema = os.path.abspath(schema)
+    _query(schema, struct, where, defines)   # errors in the predicate surface here
+    chunk = chunk or SCAN_CHUNK
+    with ProcessPoolExecutor(workers) as executor:
+        pending = {executor.submit(scan_range, path, schema, struct, where, defines, 0, chunk): path for path in paths}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                found, offset = future.result()
+                # the next chunk of the file starts before its matches are handed out
+                if offset is not None:
+                    pending[executor.submit(scan_range, path, schema, struct, where, defines, offset, chunk)] = path
+                for match in found:
+                    yield path, match
@@ -0,0 +1,148 @@
+from collections.abc import Mapping
+from dataclasses import dataclass
+from importlib import import_module
+from itertools import chain
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from array import array
+import mmap
+from .arena import COLUMNS, NONE, Arena, Node
+from .loader import process_pool
+
+@dataclass(frozen=True)
+class Descriptor:
+    """What a process needs to attach to an exported Arena.
+
+    The node table and the child spans of every row are in the shared
+    memory block `name`; the rest is small: the structs the rows refer to
+    and the arguments of parameterized structs and struct arrays.
+    """
+    name: str
+    rows: int
+    structs: tuple[str, ...]
+    arguments: dict
+
+
+def export(arena: Arena) -> Descriptor:
+    """Copies a fully indexed `arena` into a new shared memory block.
+
+    The block belongs to whoever attaches it, which unlinks it on close();
+    a descriptor that is never attached leaks its block until reboot.
+    """
+    arena.expand_all()
+    rows = len(arena)
+    expanded = arena.expanded
+    spans = array("I", chain.from_iterable(expanded[index] for index in range(rows)))
+    block = SharedMemory(create=True, size=max(1, (len(arena.nodes) + len(spans)) * 4))
+    # the attaching process unlinks it, this one must not at exit
+    resource_tracker.unregister(block._name, "shared_memory")
+    with block.buf[:len(arena.nodes) * 4] as view:
+        view[:] = memoryview(arena.nodes).cast("B")
+    with block.buf[len(arena.nodes) * 4:(len(arena.nodes) + len(spans)) * 4] as view:
+        view[:] = memoryview(spans).cast("B")
+    structs = tuple(layout[1] for layout in arena.layouts.values())
+    block.close()
+    return Descriptor(block.name, rows, structs, arena.arguments)
+
+
+class _Spans(Mapping):
+    # Arena.expanded over the shared span column, (start, end) per row
+    def __init__(self, view: memoryview):
+        self.view = view
+
+    def __getitem__(self, index: int) -> tuple[int, int]:
+        start = self.view[index * 2]
+        if start == NONE:
+            raise KeyError(index)
+        return start, self.view[index * 2 + 1]
+
+    def __contains__(self, index) -> bool:
+        return 0 <= index < len(self) and self.view[index * 2] != NONE
+
+    def __len__(self) -> int:
+        return len(self.view) // 2
+
+    def __iter__(self):
+        return (index for index in range(len(self)) if self.view[index * 2] != NONE)
+
+
+class SharedArena(Arena):
+    """An Arena attached to a node table another process exported, without copying it.
+
+    `data` must hold the same bytes the exporting process parsed. Every row
+    is already indexed, so navigation and decoding work as on the Arena
+    they came from; close() releases and unlinks the block.
+    """
+    def __init__(self, module, descriptor: Descriptor, data):
+        self.module = module
+        self.data = data
+        self.block = SharedMemory(descriptor.name)
+        size = descriptor.rows * COLUMNS
+        self.view = self.block.buf[:(size + descriptor.rows * 2) * 4].cast("I")
+        self.nodes = self.view[:size]
+        self.expanded = _Spans(self.view[size:])
+        self.arguments = descriptor.arguments
+        self.layouts = {}
+        for struct in descriptor.structs:
+            self.layout(struct)
+        self.root = Node(self, 0)
+
+    def close(self) -> None:
+        if self.block is None:
+            return
+        self.expanded.view.release()
+        self.nodes.release()
+        self.view.release()
+        self.block.close()
+        self.block.unlink()
+        self.block = None
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _export_file(module: str, struct: str, path: str, offset: int, extras: dict | None) -> Descriptor:
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        arena = Arena(import_module(module), struct, data, offset, extras)
+        descriptor = export(arena)
+        del arena
+    return descriptor
+
+def parse_files(module: str, struct: str, paths: list[str], offset: int = 0, extras: dict | None = None,
+                workers: int | None = None) -> list[SharedArena]:
+    """Parses each file of `paths` as `struct` in a pool of processes.
+
+    `module` is the importable name of a module generated with the "arena"
+    variant, such as the __name__ of a module a Loader compiled, which the
+    workers compile again when they are not forked. Workers send back a
+    Descriptor instead of pickled values and the files are mapped again
+    here, so the results cost no copy; close() each arena when done.
+    """
+    imported = import_module(module)
+    with process_pool(workers) as executor:
+        futures = [executor.submit(_export_file, module, struct, path, offset, extras) for path in paths]
+        descriptors = []
+        error = None
+        for future in futures:
+            try:
+                descriptors.append(future.result())
+            except Exception as exception:
+                error = error or exception
+    if error is not None:
+        # nobody will attach the blocks that were exported
+        for descriptor in descriptors:
+            block = SharedMemory(descriptor.name)
+            block.close()
+            block.unlink()
+        raise error
+    arenas = []
+    for path, descriptor in zip(paths, descriptors):
+        with open(path, "rb") as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        arenas.append(SharedArena(imported, descriptor, data))
+    return arenas
@@ -0,0 +1,22 @@
+from array import array
+from ctypes import _SimpleCData
+
+def plain(value):
+    """Converts a parse result into plain Python values.
+
+    ctypes objects become their `.value`, arrays become lists, lazy fields are decoded and
+    nested results are converted recursively. Useful for comparing the outputs of different backends.
+    """
+    if isinstance(value, _SimpleCData):
+        return value.value
+    if isinstance(value, dict):
+        return {key: plain(item) for key, item in value.items()}
+    if isinstance(value, array):
+        return value.tolist()
+    if isinstance(value, list):
+        return [plain(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(plain(item) for item in value)
+    if type(value).__name__ == "Lazy":
+        return plain(value.resolve())
+    return value
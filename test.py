@@ -1,6 +1,15 @@
-from parse import lexer, parser, ast_, code_gen
+from parse import lexer, parser, ast_, analysis, code_gen, c_gen, fuzz, index, loader, pool, query, shared, values
 from pprint import pprint
 from types import NoneType
+import types
+import contextvars
+import os
+import subprocess
+import sys
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from parse.arena import Arena, patch
 
 with open("example.spp") as file:
     example_code = file.read()
@@ -15,6 +24,535 @@ with open("example.py", "w") as file:
 
 import example
 with open("example.bmp","rb") as file:
-    data = file.read()
+    data = example_data = file.read()
+example_c = c_gen.build(parsed, "example_c")
+assert example_c.parseFile(data) == values.plain(example.parseFile(data))
 data = example.parseFile(data)[0]['pixels']['rows'][50]
-#pprint(data)
\ No newline at end of file
+#pprint(data)
+# only parse functions unless other variants are asked for, arena ones need skip ones
+assert not any(name.startswith(("skip", "arena", "layout", "offsets", "patch")) or name.endswith("_batch")
+               for name in vars(example))
+arena_only = code_gen.Generator(parsed, variants=("arena",)).generate()
+assert "def skipFile(" in arena_only and "def arenaFile(" in arena_only and "def patchFile(" not in arena_only
+try:
+    code_gen.Generator(parsed, variants=("fast",))
+except ValueError:
+    pass
+else:
+    raise AssertionError("unknown variant accepted")
+
+def program(source):
+    return parser.Parser(lexer.lex(source)).parse_program()
+
+def generated(source, name, **options):
+    module = types.ModuleType(name)
+    exec(compile(code_gen.Generator(program(source), **options).generate(), f"<{name}>", "exec"), module.__dict__)
+    return module
+
+# 64-bit struct arguments reach C expressions exactly
+wide = "struct Wide(n) { a: uint8; if (n == 9007199254740993) { b: uint8; } }"
+wide_c = c_gen.build(program(wide), "wide_c")
+assert wide_c.parseWide(b"\1\2", 0, 9007199254740993) == ({'a': 1, 'b': 2}, 2)
+assert wide_c.parseWide(b"\1\2", 0, 9007199254740992) == ({'a': 1}, 1)
+
+# struct parameters are positional after data and offset, in every backend
+pairs = "struct Pair(n, k) { xs: uint8[n]; if (k > 1) { y: uint8; } } struct Holder() { m: uint8; pair: Pair(m.value, 2); }"
+pairs_py = generated(pairs, "pairs_py", variants=("skip",))
+pairs_c = c_gen.build(program(pairs), "pairs_c")
+assert values.plain(pairs_py.parsePair(b"\0\1\2\3\4", 1, 2, 2)) == ({'xs': [1, 2], 'y': 3}, 4)
+assert values.plain(pairs_py.parsePair(b"\0\1\2\3\4", 1, 3, 0)) == ({'xs': [1, 2, 3]}, 4)
+assert pairs_py.skipPair(b"\0\1\2\3\4", 1, 2, 2)[1] == 4
+assert pairs_c.parsePair(b"\0\1\2\3\4", 1, 2, 2) == values.plain(pairs_py.parsePair(b"\0\1\2\3\4", 1, 2, 2))
+assert values.plain(pairs_py.parseHolder(b"\1\7\x08")) == pairs_c.parseHolder(b"\1\7\x08") == ({'m': 1, 'pair': {'xs': [7], 'y': 8}}, 3)
+# a call with the wrong number of arguments, or a parameter the parse function already has, fails at generation
+for source, message in (("struct P(n) { x: uint8[n]; } struct T() { p: P(1, 2); }", "P takes 1 argument(s), 'p' passes 2"),
+                        ("struct P(n) { x: uint8[n]; } struct T() { p: P; }", "P takes 1 argument(s), 'p' passes 0"),
+                        ("struct P(data) { x: uint8[data]; }", "Parameter 'data' of P shadows"),
+                        ("struct P(n, offset) { x: uint8[n]; }", "Parameter 'offset' of P shadows")):
+    try:
+        code_gen.Generator(program(source)).generate()
+    except ValueError as error:
+        assert message in str(error), error
+    else:
+        raise AssertionError(source)
+
+# signed and 64-bit integers, and arrays read in the other byte order
+numbers = """#endian big
+struct Nums() { a: int32; b: uint64; n: uint8; words: uint32[n.value]; c: int64; if (b.value > 9223372036854775808) { high: uint8; } }"""
+numbers_data = ((-2).to_bytes(4, "big", signed=True) + (2**63 + 5).to_bytes(8, "big") + b"\2"
+                + (0x01020304).to_bytes(4, "big") + (0xdeadbeef).to_bytes(4, "big") + (-2**63).to_bytes(8, "big", signed=True) + b"\7")
+expected_numbers = ({'a': -2, 'b': 2**63 + 5, 'n': 2, 'words': [0x01020304, 0xdeadbeef], 'c': -2**63, 'high': 7}, len(numbers_data))
+numbers_py = generated(numbers, "numbers_py")
+assert values.plain(numbers_py.parseNums(numbers_data)) == expected_numbers
+assert numbers_py.parseNums(numbers_data)[0]['words'].typecode in "IL"
+assert c_gen.build(program(numbers), "numbers_c").parseNums(numbers_data) == expected_numbers
+little = generated(numbers.replace("#endian big", "#endian little"), "numbers_little")
+little_data = b"\1\0\0\x80" + b"\0" * 8 + b"\1" + b"\4\3\2\1" + b"\0" * 8
+assert values.plain(little.parseNums(little_data))[0] == {'a': -2**31 + 1, 'b': 0, 'n': 1, 'words': [0x01020304], 'c': 0}
+
+# a cut record names the struct, field and offset where the data ends
+cuts = generated("struct Inner() { p: uint16; q: uint32; } "
+                 "struct Cut() { a: uint8; b: uint16; c: uint32; f1: 3b; f2: 13b; n: uint8; items: uint16[n.value]; tail: Inner[n.value]; }",
+                 "cuts", variants=("batch", "skip"))
+whole = b"\1" + b"\2\0" + b"\3\0\0\0" + b"\xff\xff" + b"\2" + b"\1\0\2\0" + b"\1\0\2\0\0\0" * 2
+assert cuts.parseCut(whole)[1] == len(whole)
+for cut, field, offset in ((2, "b", 1), (4, "c", 3), (8, "f1/f2", 7), (12, "items", 10), (20, "tail", 14)):
+    for parse_cut in (cuts.parseCut, cuts.skipCut, lambda data: cuts.parseCut_batch([data])):
+        try:
+            end = parse_cut(whole[:cut])[1]
+        except cuts.TruncatedError as error:
+            assert (error.struct, error.field, error.offset) == ("Cut", field, offset), (cut, error)
+            assert str(error) == f"Data ends inside Cut.{field} (field starts at offset {offset})"
+        else:
+            # skip functions step over arrays unchecked, their callers compare the end with the length
+            assert parse_cut is cuts.skipCut and field in ("items", "tail") and end > cut, (cut, end)
+
+# bit fields, bytes, terminated arrays and switches decode in C as in Python
+native = """#endian big
+struct N() { a: 3b; b: 13b; tag: uint8; body: switch (tag.value) { case 1, 2: uint16; default: bytes[until "\\r\\n"]; }
+             n: uint8; raw: bytes[n.value]; words: int16[until 7]; }
+struct Strict() { tag: uint8; body: switch (tag.value) { case 1: uint8; } }"""
+native_py = generated(native, "native_py")
+native_c = c_gen.build(program(native), "native_c")
+for record in (b"\xa5\x0f\x02\x01\x02\x02xy\xff\xfe\x00\x07", b"\0\1\x09ab\r\n\0\0\x07"):
+    assert native_c.parseN(record) == values.plain(native_py.parseN(record))
+assert native_c.parseN(b"\0\1\x09ab\r\n\0\0\x07")[0]['body'] == b"ab"
+for broken in (b"\0\1\x09ab\r", b"\0\1\1\0\0\0\0\0\7", b"\0\1\1\0\0\0\0\0"):
+    # a missing terminator or a cut raises, with the Python backend too
+    for parse_n in (native_c.parseN, native_py.parseN):
+        try:
+            parse_n(broken)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(broken)
+try:
+    native_c.parseStrict(b"\2\0")
+except ValueError as error:
+    assert "Strict.body" in str(error)
+else:
+    raise AssertionError("unmatched switch accepted")
+# a count read from the data is checked against the buffer before the list is made
+huge = c_gen.build(program("struct H() { n: uint32; xs: uint16[n.value]; }"), "huge_c")
+try:
+    huge.parseH(b"\xff\xff\xff\xff\0\0")
+except ValueError as error:
+    assert "4294967295 elements" in str(error)
+else:
+    raise AssertionError("huge count accepted")
+# compressed fields stay Python only
+try:
+    c_gen.build(program("struct I() { k: uint8; } struct Z() { n: uint8; body: I @zlib(n.value); }"), "zlib_c")
+except NotImplementedError:
+    pass
+else:
+    raise AssertionError("@zlib compiled to C")
+
+# switch, case and default only mean something inside a declaration
+words = generated("struct W() { default: uint8; case: uint8; switch: uint8; k: switch (default.value) { case 1: uint8; default: uint16; } }", "words")
+assert values.plain(words.parseW(b"\1\2\3\4")) == ({'default': 1, 'case': 2, 'switch': 3, 'k': 4}, 4)
+assert values.plain(words.parseW(b"\2\2\3\4\0")) == ({'default': 2, 'case': 2, 'switch': 3, 'k': 4}, 5)
+
+# bytes and until are only words in type and array size position
+terminated = generated("struct T() { bytes: uint8; until: uint8; name: bytes[until 0]; rest: uint8[until.value]; wide: uint16[until 65535]; }", "terminated")
+record = b"\1\2abc\0\7\7" + b"\1\0" * 300 + b"\xff\xff"
+expected = terminated.parseT(record)
+assert values.plain(expected)[0]['name'] == b"abc" and expected[1] == len(record)
+# the terminator is also found in buffers without find(), past the first window
+assert values.plain(terminated.parseT(memoryview(record))) == values.plain(expected)
+
+# a length read from the data makes every element of an array its own size
+compressed = generated("struct Inner() { k: uint8; } struct Item() { n: uint8; body: Inner @zlib(n.value); } "
+                       "struct Top() { items: Item[2]; }", "compressed", variants=("arena",))
+first, second = zlib.compress(b"\4"), zlib.compress(b"\5", 0)
+items = bytes([len(first)]) + first + bytes([len(second)]) + second
+assert len(items) == 23 and compressed.skipTop(items, 0)[1] == 23
+compressed.PARALLEL_MIN_BYTES = 1
+with ThreadPoolExecutor(2) as executor:
+    token = compressed.EXECUTOR.set(executor)
+    parsed_items = values.plain(compressed.parseTop(items, 0))
+    compressed.EXECUTOR.reset(token)
+assert parsed_items == ({'items': [{'n': 9, 'body': {'k': 4}}, {'n': 12, 'body': {'k': 5}}]}, 23)
+items_arena = Arena(compressed, "Top", items)
+assert [node.offset for node in items_arena.root["items"]] == [0, 10]
+assert values.plain(items_arena.root["items"][1]["body"].value) == {"k": 5}
+
+# batches parse like one call per record, from a list of buffers or one buffer with offsets
+batched = generated("""struct Pt() { x: uint8; y: int16; }
+struct Msg() { kind: uint8; flags: 3b; level: 5b; at: Pt; if (kind.value == 1) { extra: uint32; }
+               body: switch (kind.value) { case 2: Pt; default: bytes[until 0]; } n: uint8; items: Pt[n.value]; }""",
+                    "batched", variants=("batch",))
+messages = [b"\1\x2a\7\0\1\4\3\2\1abc\0\2\5\6\0\7\x08\0", b"\2\xff\1\2\0\3\4\0\0", b"\0\0\0\0\0\0\0"]
+joined = b"".join(messages)
+message_offsets = [0, len(messages[0]), len(messages[0]) + len(messages[1])]
+expected_messages = [values.plain(batched.parseMsg(message)[0]) for message in messages]
+assert expected_messages[0]['extra'] == 0x01020304 and 'extra' not in expected_messages[1]
+assert values.plain(batched.parseMsg_batch(messages)) == expected_messages
+assert values.plain(batched.parseMsg_batch(joined, message_offsets)) == expected_messages
+# a column per field, None where a record has no such field
+message_columns = {name: [message.get(name) for message in expected_messages]
+                   for name in ("kind", "flags", "level", "at", "extra", "body", "n", "items")}
+assert values.plain(batched.parseMsg_batch(messages, columnar=True)) == message_columns
+assert values.plain(batched.parseMsg_batch(joined, message_offsets, columnar=True)) == message_columns
+example_batched = generated(example_code, "example_batched", variants=("batch",))
+assert values.plain(example_batched.parseFile_batch([example_data, example_data])) \
+    == [values.plain(example.parseFile(example_data)[0])] * 2
+
+# fields decoded out of line are counted once per decode
+timed = generated("struct Body() { k: uint8; } struct Head() { at: uint8; body: Body @offset(at.value); }", "timed", instrument=True)
+for _ in range(2):
+    values.plain(timed.parseHead(b"\2\0\7", 0))
+assert timed.FIELD_STATS["Head.body"][0] == 2 and timed.FIELD_STATS["Head.body"][2] == 2
+
+# functions of loaded modules pickle into process pools
+loaded_example = loader.Loader().load("example.spp")
+loaded_example.PARALLEL_MIN_BYTES = 1 << 15
+with ProcessPoolExecutor(2) as executor:
+    token = loaded_example.EXECUTOR.set(executor)
+    in_processes = values.plain(loaded_example.parseFile(example_data, 0))
+    loaded_example.EXECUTOR.reset(token)
+assert in_processes == values.plain(example.parseFile(example_data))
+
+# patches write bit fields in the byte order the readers use
+bits_big = generated("#endian big\nstruct Flags() { a: 3b; b: 9b; c: 4b; }", "bits_big", variants=("patch",))
+bits_big.ENDIAN = "little"   # not a setting, changes nothing
+flags = bytearray(2)
+bits_big.patchFlags(flags, 0, "b", 300)
+patch(bits_big, "Flags", flags, "c", 5)
+assert values.plain(bits_big.parseFlags(flags)) == ({'a': 0, 'b': 300, 'c': 5}, 2)
+moved = generated("#endian big\nstruct Moved() { n: uint8; pad: uint8[n.value]; a: 3b; b: 13b; }", "moved", variants=("patch", "arena"))
+moved_data = bytearray(b"\1\0\0\0")
+patch(moved, "Moved", moved_data, "b", 4000)   # behind a counted array: found through an Arena
+assert values.plain(moved.parseMoved(moved_data))[0]['b'] == 4000
+
+# threaded batches come back in the order of a serial one
+threaded = generated("struct Rec() { id: uint32; v: int16; } struct Scaled(k) { id: uint32; if (k > 1) { v: int16; } }",
+                     "threaded", variants=("batch",))
+threaded_data = b"".join(n.to_bytes(4, "little") + (-n).to_bytes(2, "little", signed=True) for n in range(500))
+threaded_offsets = list(range(0, len(threaded_data), 6))
+threaded_buffers = [threaded_data[offset:offset + 6] for offset in threaded_offsets]
+serial = values.plain(threaded.parseRec_batch(threaded_buffers))
+assert [record['id'] for record in serial] == list(range(500))
+with ThreadPoolExecutor(4) as executor:
+    assert values.plain(pool.parse_threaded(threaded, "Rec", threaded_buffers, chunk=7, executor=executor)) == serial
+    assert values.plain(pool.parse_threaded(threaded, "Rec", threaded_data, threaded_offsets, chunk=7, executor=executor)) == serial
+    assert values.plain(pool.parse_threaded(threaded, "Scaled", threaded_buffers, extras={"k": 2}, chunk=7, executor=executor)) == serial
+
+# modules of both byte orders parse side by side without sharing a setting
+orders = {endian: generated(f"#endian {endian}\nstruct Word() {{ a: uint32; b: int16; c: 4b; d: 12b; }}", f"order_{endian}")
+          for endian in ("little", "big")}
+word = b"\1\2\3\4\xff\xfe\x12\x34"
+expected_words = {endian: values.plain(module.parseWord(word)) for endian, module in orders.items()}
+assert expected_words["little"][0]["a"] == 0x04030201 and expected_words["big"][0]["a"] == 0x01020304
+assert expected_words["little"][0]["b"] == -257 and expected_words["big"][0]["b"] == -2
+def parse_words(endian):
+    return [values.plain(orders[endian].parseWord(word)) for _ in range(200)]
+with ThreadPoolExecutor(8) as executor:
+    runs = [(endian, executor.submit(parse_words, endian)) for endian in ("little", "big") * 4]
+    assert all(run.result() == [expected_words[endian]] * 200 for endian, run in runs)
+
+# EXECUTOR set in one context is not seen by others, threads included
+class Counting(ThreadPoolExecutor):
+    submitted = 0
+    def submit(self, *args, **kwargs):
+        Counting.submitted += 1
+        return super().submit(*args, **kwargs)
+isolated = generated("struct Px() { x: uint8; } struct Row() { items: Px[64]; }", "isolated")
+isolated.PARALLEL_MIN_BYTES = 8
+row = bytes(range(64))
+expected_row = values.plain(isolated.parseRow(row))
+assert expected_row[0]["items"][63] == {"x": 63}
+def in_context():
+    isolated.EXECUTOR.set(executor)
+    return values.plain(isolated.parseRow(row))
+with Counting(2) as executor:
+    assert contextvars.copy_context().run(in_context) == expected_row and Counting.submitted > 0
+    submitted = Counting.submitted
+    assert isolated.EXECUTOR.get() is None and values.plain(isolated.parseRow(row)) == expected_row
+    token = isolated.EXECUTOR.set(executor)
+    with ThreadPoolExecutor(1) as other:
+        assert other.submit(isolated.EXECUTOR.get).result() is None
+        assert other.submit(lambda: values.plain(isolated.parseRow(row))).result() == expected_row
+    isolated.EXECUTOR.reset(token)
+    assert Counting.submitted == submitted
+
+# scans check every part of a field path before reading any file
+with tempfile.TemporaryDirectory() as directory:
+    records_schema = os.path.join(directory, "records.spp")
+    with open(records_schema, "w") as file:
+        file.write("struct Head() { kind: uint8; flag: 1b; pad: 7b; } struct Rec() { h: Head; n: uint8; body: uint8[n.value]; }")
+    records = os.path.join(directory, "records.bin")
+    with open(records, "wb") as file:
+        file.write(b"\2\1\1\x09" + b"\3\0\2\7\7" + b"\2\1\0")
+    assert sorted(query.scan([records], records_schema, "Rec", "h.kind.value == 2 && h.flag.value == 1", 1)) \
+        == [(records, 0), (records, 9)]
+    # files are scanned in chunks that resume at the next record, matches stream out per chunk
+    wanted = "h.kind.value == 2 && h.flag.value == 1"
+    assert query.scan_range(records, records_schema, "Rec", wanted, None, 0, 4) == ([0], 4)
+    assert query.scan_range(records, records_schema, "Rec", wanted, None, 4, 4) == ([], 9)
+    assert query.scan_range(records, records_schema, "Rec", wanted, None, 9, 4) == ([9], None)
+    many = os.path.join(directory, "many.bin")
+    with open(many, "wb") as file:
+        file.write((b"\2\1\1\x09" + b"\3\0\2\7\7" + b"\2\1\0") * 50 + b"\2\1\5")   # ends inside a record
+    expected_many = [offset for start in range(0, 600, 12) for offset in (start, start + 9)]
+    assert query.scan_file(many, records_schema, "Rec", wanted) == expected_many
+    streamed = list(query.scan([many, records], records_schema, "Rec", wanted, 2, chunk=20))
+    assert [offset for path, offset in streamed if path == many] == expected_many
+    assert [offset for path, offset in streamed if path == records] == [0, 9]
+    for where in ("h.nope.value == 2", "h.kind.valeu == 2", "n.value.value == 2", "body.value == 2"):
+        try:
+            list(query.scan([records], records_schema, "Rec", where, 1))
+        except KeyError:
+            pass
+        else:
+            raise AssertionError(f"{where} was accepted")
+
+# edits recompile incrementally into what a fresh Loader builds
+def positions(module):
+    # SOURCE_MAP entries by function and line within it
+    found = {}
+    for name, function in vars(module).items():
+        if isinstance(function, types.FunctionType) and function.__code__.co_filename == module.__file__:
+            codes = [function.__code__]
+            for code in codes:
+                codes += [constant for constant in code.co_consts if isinstance(constant, types.CodeType)]
+                for _, _, line in code.co_lines():
+                    if line is not None and line in module.SOURCE_MAP:
+                        found[name, line - function.__code__.co_firstlineno] = module.SOURCE_MAP[line]
+    return found
+
+def matches_fresh(incremental, path, roots, samples):
+    module = incremental.load(path)
+    fresh = loader.Loader(variants=("skip",)).load(path)
+    for root in roots:
+        for sample in samples:
+            for function in ("parse" + root, "skip" + root):
+                assert values.plain(getattr(module, function)(sample, 0)) \
+                    == values.plain(getattr(fresh, function)(sample, 0)), (function, sample)
+    assert positions(module) and positions(module) == positions(fresh)
+    assert {name for name in vars(module) if name.startswith(("parse", "skip"))} \
+        == {name for name in vars(fresh) if name.startswith(("parse", "skip"))}
+    return module
+
+shapes_text = """struct Point() {
+    x: uint8;
+    y: uint8;
+}
+
+struct Shape() {
+    kind: uint8;
+    origin: Point;
+    if (kind.value == 1) {
+        radius: uint16;
+    }
+    count: uint8;
+    points: Point[count.value];
+}
+
+struct Tag() {
+    tag: uint8;
+}
+"""
+shape_samples = [b"\1\1\6\0\1\2\7\x08\x09\x0a", b"\0\5\6\1\7\x08"]
+mtimes = iter(range(1, 100))
+def write(path, text):
+    with open(path, "w") as file:
+        file.write(text)
+    stamp = next(mtimes)
+    os.utime(path, (stamp, stamp))
+
+with tempfile.TemporaryDirectory() as directory:
+    shapes = os.path.join(directory, "shapes.spp")
+    write(shapes, shapes_text)
+    incremental = loader.Loader(variants=("skip",))
+    first = matches_fresh(incremental, shapes, ["Shape", "Tag"], shape_samples)
+    # lines inserted above and inside structs
+    shapes_text = "// shapes\n\n" + shapes_text.replace("    count: uint8;", "\n    count: uint8;")
+    write(shapes, shapes_text)
+    assert matches_fresh(incremental, shapes, ["Shape", "Tag"], shape_samples) is first
+    # a syntax error leaves the loader usable once it is fixed
+    write(shapes, shapes_text.replace("radius: uint16;", "radius: uint16"))
+    try:
+        incremental.load(shapes)
+    except parser.ParseError:
+        pass
+    else:
+        raise AssertionError("syntax error accepted")
+    write(shapes, shapes_text)
+    matches_fresh(incremental, shapes, ["Shape", "Tag"], shape_samples)
+    # a removed struct takes its functions along
+    shapes_text = shapes_text[:shapes_text.index("struct Tag")]
+    write(shapes, shapes_text)
+    module = matches_fresh(incremental, shapes, ["Shape"], shape_samples)
+    assert not hasattr(module, "parseTag") and not hasattr(module, "skipTag")
+    # a condition reading another field changes what skip functions keep
+    shapes_text = shapes_text.replace("kind.value == 1", "origin.x.value == 1")
+    write(shapes, shapes_text)
+    module = matches_fresh(incremental, shapes, ["Shape"], shape_samples)
+    assert values.plain(module.skipShape(shape_samples[0], 0))[0] == {'origin': {'x': 1}, 'count': 2}
+
+# imports and the preprocessor
+with tempfile.TemporaryDirectory() as directory:
+    common = os.path.join(directory, "common.spp")
+    write(common, "struct Point() { x: uint8; y: uint8; }\n")
+    top = os.path.join(directory, "top.spp")
+    write(top, 'import "common.spp";\n#define COUNT 2\n#define LOOSE\n#undef LOOSE\n'
+               "struct Top() {\n    at: Point;\n    values: uint8[COUNT];\n"
+               "#ifdef WIDE\n    wide: uint32;\n#endif\n#ifndef LOOSE\n    last: uint8;\n#endif\n}\n")
+    top_data = b"\1\2\3\4\5\6\7\x08\x09"
+    imports = loader.Loader()
+    narrow = imports.load(top)
+    assert values.plain(narrow.parseTop(top_data, 0)) == ({'at': {'x': 1, 'y': 2}, 'values': [3, 4], 'last': 5}, 5)
+    assert narrow.parsePoint is imports.load(common).parsePoint
+    # names defined before the file select sections, the file's own #define wins
+    wide = loader.Loader({"WIDE": "", "COUNT": "1"}).load(top)
+    assert values.plain(wide.parseTop(top_data, 0)) == ({'at': {'x': 1, 'y': 2}, 'values': [3, 4], 'wide': 0x08070605, 'last': 9}, 9)
+    # an edited import recompiles its importers
+    write(common, "struct Point() { x: uint8; y: uint16; }\n")
+    edited = imports.load(top)
+    assert edited is not narrow
+    assert values.plain(edited.parseTop(top_data, 0)) == ({'at': {'x': 1, 'y': 0x0302}, 'values': [4, 5], 'last': 6}, 6)
+    # workers that are not forked compile the loaded modules again under the same names
+    spawned = subprocess.run([sys.executable, "-c", f"""
+import multiprocessing
+from parse import loader, query, shared, values
+multiprocessing.set_start_method("spawn")
+top = loader.Loader(variants=("arena",)).load({top!r})
+with loader.process_pool(2) as executor:
+    assert values.plain(executor.submit(top.parseTop, {top_data!r}, 0).result()) == values.plain(top.parseTop({top_data!r}, 0))
+with open({os.path.join(directory, "top.bin")!r}, "wb") as file:
+    file.write({top_data!r})
+arena, = shared.parse_files(top.__name__, "Top", [{os.path.join(directory, "top.bin")!r}])
+assert values.plain(arena.root["at"]["y"].value) == 0x0302
+arena.close()
+assert list(query.scan([{os.path.join(directory, "top.bin")!r}], {top!r}, "Top", "at.x.value == 1", 2)) == [({os.path.join(directory, "top.bin")!r}, 0)]
+"""], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    assert spawned.returncode == 0, spawned.stderr
+
+# offset indexes grow with appended records and give random access
+logged = generated("struct Rec() { n: uint8; body: uint8[n.value]; }", "logged", variants=("skip",))
+with tempfile.TemporaryDirectory() as directory:
+    log = os.path.join(directory, "log.bin")
+    with open(log, "wb") as file:
+        file.write(b"\1\7\2\7\7\3\7")   # the last record is truncated
+    assert list(index.build_index(log, logged, "Rec")) == [0, 2, 5]
+    with open(log, "r+b") as file:
+        file.seek(5)
+        file.write(b"\0\3\1\2\3")
+    assert list(index.build_index(log, logged, "Rec")) == [0, 2, 5, 6, 10]
+    with index.open_indexed(log, logged, "Rec", update=False) as indexed:
+        assert len(indexed) == 4 and indexed.span(-1) == (6, 10)
+        assert values.plain(indexed[3]) == {'n': 3, 'body': [1, 2, 3]}
+
+# arenas decode what parse functions give
+example_arenas = loader.load("example.spp", variants=("arena",))
+example_arena = Arena(example_arenas, "File", example_data)
+assert example_arena.root["dib_header"]["width"].value.value == example.parseFile(example_data)[0]["dib_header"]["width"].value
+assert values.plain(example_arena.root["pixels"]["rows"][50].value) == values.plain(data)
+
+# patches go through the static offsets or through an arena
+example_patches = loader.load("example.spp", variants=("arena", "patch"))
+patched = bytearray(example_data)
+assert patch(example_patches, "File", patched, "file_header.file_size", 1234) == 2
+at = patch(example_patches, "File", patched, "pixels.rows.3.pixels.0.red", 17)
+patched_file = values.plain(example_patches.parseFile(patched))[0]
+assert patched_file["file_header"]["file_size"] == 1234 and patched_file["pixels"]["rows"][3]["pixels"][0]["red"] == 17
+expected_patch = bytearray(example_data)
+expected_patch[2:6] = (1234).to_bytes(4, "little")
+expected_patch[at] = 17
+assert patched == expected_patch
+
+# arenas parsed in other processes are attached without copies
+with tempfile.TemporaryDirectory() as directory:
+    bitmap = os.path.join(directory, "example.bmp")
+    with open(bitmap, "wb") as file:
+        file.write(example_data)
+    expanded = Arena(example_arenas, "File", example_data)
+    expanded.expand_all()
+    arenas = shared.parse_files(example_arenas.__name__, "File", [bitmap, bitmap], workers=2)
+    try:
+        for attached in arenas:
+            assert bytes(attached.nodes) == expanded.nodes.tobytes()
+            assert values.plain(attached.root["pixels"]["rows"][50].value) == values.plain(data)
+    finally:
+        for attached in arenas:
+            attached.close()
+
+# elements with a field at an absolute position are not parsed from chunks
+pointing = generated("struct Body() { k: uint8; } struct Item() { n: uint8; body: Body @offset(9); } "
+                     "struct List() { pad: uint8[4]; items: Item[5]; }", "pointing")
+pointed = bytes(range(1, 11))
+serial = values.plain(pointing.parseList(pointed))
+pointing.PARALLEL_MIN_BYTES = 1
+with ThreadPoolExecutor(2) as executor:
+    token = pointing.EXECUTOR.set(executor)
+    assert values.plain(pointing.parseList(pointed)) == serial
+    pointing.EXECUTOR.reset(token)
+assert [item["body"]["k"] for item in serial[0]["items"]] == [10] * 5
+
+# readers are kept per argument tuple, up to SPECIALIZATIONS read at each miss
+sized = generated("struct Head() { n: uint8; } struct Row(head, k) { cells: uint8[head.n.value + k]; } "
+                  "struct Table() { head: Head; row: Row(head, 1); }", "sized")
+assert values.plain(sized.parseTable(b"\2\7\7\7")) == ({'head': {'n': 2}, 'row': {'cells': [7, 7, 7]}}, 4)
+assert sized.parseRow(b"\5\6", 0, {'n': sized.c_uint8(1)}, 0)[1] == 1   # a struct value is not cached
+assert not sized.specializeRow.readers
+counted = generated("struct Cells(n) { cells: uint8[n]; }", "counted")
+first_reader = counted.specializeCells(1)
+assert counted.specializeCells(1) is first_reader
+counted.SPECIALIZATIONS = 2
+for n in (2, 3):
+    counted.specializeCells(n)
+assert list(counted.specializeCells.readers) == [(2,), (3,)]
+assert counted.specializeCells(1) is not first_reader
+assert values.plain(counted.parseCells(b"\1\2\3", 0, 3)) == ({'cells': [1, 2, 3]}, 3)
+
+# validations batched over a run still fail in schema order around nested structs
+checked = generated('struct Sub() { v: uint8; if (v.value == 0) { raise "sub bad"; } } '
+                    'struct Top() { a: uint8; if (a.value == 0) { raise "a bad"; } b: uint8; '
+                    'if (b.value == 0) { raise "b bad"; } sub: Sub; c: uint8; '
+                    'if (c.value == 0) { raise "c bad"; } if (c.value == 1) { raise "c one"; } }', "checked")
+assert checked.parseTop(b"\1\1\1\2")[1] == 4
+for record, message in ((b"\0\0\0\0", "a bad"), (b"\1\0\0\0", "b bad"), (b"\1\1\0\0", "sub bad"),
+                        (b"\1\1\1\0", "c bad"), (b"\1\1\1\1", "c one")):
+    try:
+        checked.parseTop(record)
+    except ValueError as error:
+        assert str(error) == message, (record, error)
+    else:
+        raise AssertionError(f"{record} validated")
+
+# equality chains of DISPATCH_MIN branches become a dict of case functions
+chain = ("struct D() {{ k: uint8; if (k.value == 1) {{ a: uint8; }} elif (k.value == 2) {{ b: uint16; }} "
+         "elif (k.value == 3) {{ c: uint8[2]; }} elif (k.value == 1) {{ d: uint8; }} elif (k.value == 4) {{ e: uint8; }}{} }}")
+dispatched = generated(chain.format(" else { z: uint8; }"), "dispatched")
+undispatched = generated(chain.format(""), "undispatched")
+assert "offset = _casesD_4.get(ctx['k'].value, no_case)(" in code_gen.Generator(program(chain.format(""))).generate()
+assert values.plain(dispatched.parseD(b"\1\5")) == ({'k': 1, 'a': 5}, 2)
+assert values.plain(dispatched.parseD(b"\2\1\1")) == ({'k': 2, 'b': 257}, 3)
+assert values.plain(dispatched.parseD(b"\3\1\2")) == ({'k': 3, 'c': [1, 2]}, 3)
+assert values.plain(dispatched.parseD(b"\4\6")) == ({'k': 4, 'e': 6}, 2)
+assert values.plain(dispatched.parseD(b"\7\6")) == ({'k': 7, 'z': 6}, 2)
+assert values.plain(undispatched.parseD(b"\7\6")) == ({'k': 7}, 1)
+
+# sibling fields: an array nothing reads yet is decoded while the parse goes on
+file_graph = analysis.Analysis(parsed)
+assert file_graph.dependencies("File")["pixels"] == {"file_header", "dib_header"}
+assert file_graph.dependents("File")["dib_header"] == {"pixels"}
+siblings = generated("struct Cell() { a: uint8; b: uint8; } struct Tail(rows) { x: uint8; } "
+                     "struct Grid() { n: uint8; cells: Cell[n.value]; m: uint8; more: Cell[m.value]; last: Tail(more); }",
+                     "siblings")
+grid = bytes([3]) + bytes(range(6)) + bytes([2]) + bytes(range(10, 14)) + b"\x63"
+serial_grid = values.plain(siblings.parseGrid(grid))
+siblings.PARALLEL_MIN_BYTES = 1
+with ThreadPoolExecutor(2) as executor:
+    token = siblings.EXECUTOR.set(executor)
+    concurrent_grid, end = siblings.parseGrid(grid)
+    siblings.EXECUTOR.reset(token)
+assert type(concurrent_grid["cells"]).__name__ == "Lazy" and isinstance(concurrent_grid["more"], list)
+assert (values.plain(concurrent_grid), end) == serial_grid
+assert serial_grid[0]["cells"][2] == {'a': 4, 'b': 5} and serial_grid[1] == len(grid)
+
+# every backend agrees on a few random schemas, the same ones on every run
+fuzzed = fuzz.run(0, 6, 5, True, 1)
+assert fuzzed.cases == 30 and not fuzzed.failures, "\n\n".join(fuzzed.failures)
+assert fuzzed.throughput["c"][0] > 0